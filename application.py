@@ -1,12 +1,27 @@
 # Flask application for Hallmark webpage
+import hashlib
+import json
 import os
-from flask import Flask, flash, redirect, render_template, request, session, Markup
+from flask import Flask, Response, flash, jsonify, make_response, redirect, render_template, request, session, stream_with_context, Markup
 from flask_session import Session
 from tempfile import mkdtemp
-from helpers import GetHallmarkSelection, apology
-from hallmarkGenerator import GetHallmarkSettings
+from helpers import GetHallmarkSelection, GetPlotRecord, apology
+from hallmarkGenerator import GetHallmarkSettings, GetHallmarkSettingsChunks, ParsePlotID, RenderPlot
+from vocabulary import ConfigureVocabularyFile, GetVocabulary, GetVocabularyVersion
+from metrics import EnableMetrics, MetricsEnabled, FormatMetrics
+from plotPool import ConfigurePlotPool, StartPlotPool, TakePlots, GetPlotPoolStats, DEFAULT_LOW_WATERMARK, DEFAULT_HIGH_WATERMARK
+from connectionPool import ConfigurePool, ReleaseConnection, DATABASE_PATH, DEFAULT_POOL_SIZE
+from queryTracer import StartTrace, StopTrace, FormatTraceReport
 from werkzeug.exceptions import default_exceptions, HTTPException, InternalServerError
 
+# Limits for /api/plots: the most plots in one request, the most sent as a single JSON list (more are streamed as NDJSON), and how many to generate at a time
+MAX_API_PLOTS = 1000000
+MAX_JSON_PLOTS = 100
+API_CHUNK_SIZE = 500
+
+# How long (in seconds) browsers, proxies and CDNs may cache a /plot/<seed> or /p/<plotID> page before checking its ETag
+PLOT_CACHE_SECONDS = 86400
+
 # Configure application
 app = Flask(__name__)
 
@@ -19,16 +34,60 @@ app.config["SESSION_PERMANENT"] = False
 app.config["SESSION_TYPE"] = "filesystem"
 Session(app)
 
+# Share a pool of read-only connections to hallmark.db between all the worker threads
+ConfigurePool(DATABASE_PATH, int(os.environ.get("HALLMARK_POOL_SIZE", DEFAULT_POOL_SIZE)))
+
+# Time each stage of plot generation and count fallbacks, for /metrics. Off unless HALLMARK_METRICS=1, since timing every stage slows generation down
+if os.environ.get("HALLMARK_METRICS", "0") == "1":
+    EnableMetrics()
+
+# Record the queries made by each request and log a report of them. Off unless HALLMARK_TRACE_QUERIES=1
+TRACE_QUERIES = os.environ.get("HALLMARK_TRACE_QUERIES", "0") == "1"
+
+# Map a compiled vocabulary file (see compiledVocabulary.py) instead of loading hallmark.db, if HALLMARK_VOCABULARY_FILE names one.
+# Every worker maps the same file, so they share one copy of the vocabulary
+if os.environ.get("HALLMARK_VOCABULARY_FILE"):
+    ConfigureVocabularyFile(os.environ["HALLMARK_VOCABULARY_FILE"])
+
+# Load the vocabulary once, at startup, so requests never need to touch the database
+GetVocabulary()
+
+# Keep a pool of ready-made plots topped up in the background, so the index page doesn't have to wait for them to be generated
+ConfigurePlotPool(int(os.environ.get("HALLMARK_PLOT_POOL_LOW", DEFAULT_LOW_WATERMARK)), int(os.environ.get("HALLMARK_PLOT_POOL_HIGH", DEFAULT_HIGH_WATERMARK)))
+StartPlotPool()
+
+
+
+@app.teardown_appcontext
+def ReturnConnection(e):
+    """Return the thread's database connection (if it took one) to the pool at the end of each request."""
+    ReleaseConnection()
+
+
+
+@app.before_request
+def StartQueryTrace():
+    """Start recording the request's queries, if query tracing is on."""
+    if TRACE_QUERIES:
+        StartTrace(request.method + " " + request.full_path.rstrip("?"))
+
+
+
+@app.teardown_request
+def ReportQueryTrace(e):
+    """Log the request's queries, if query tracing is on and it made any. Most requests won't: the vocabulary is only loaded when hallmark.db changes."""
+    trace = StopTrace() if TRACE_QUERIES else None
+    if trace != None and len(trace["queries"]) > 0:
+        app.logger.warning(FormatTraceReport(trace))
+
 
 
 @app.route("/")
 def index():
     """Render index page."""
     try:
-        # Get settings for 3 x modified Hallmark movies
-        mySettings = []
-        for i in range(0,3):
-            mySettings.append(GetHallmarkSettings(False))    
+        # Get settings for 3 x modified Hallmark movies, from the pool if there are enough ready
+        mySettings = TakePlots(3)
     
         # Arrange into a list of dictionaries, aiming for three different images and title templates
         myMovies = GetHallmarkSelection(mySettings)
@@ -39,6 +98,104 @@ def index():
     
     
     
+@app.route("/plot/<int:seed>", methods=["GET"])
+def plot(seed):
+    """Render page with the modified plot for a seed. The same seed always gives the same plot, until the vocabulary changes."""
+    try:
+        return CachedPlotPage("plot:" + str(seed), lambda: GetHallmarkSettings(False, seed))
+    except:
+        return apology("Generation of an improved Hallmark movie has failed. Hallmark is just really good as it is, apparently.", 403)
+
+
+
+@app.route("/p/<plotID>", methods=["GET"])
+def permalink(plotID):
+    """Render page with the modified plot for a plot ID, rebuilt straight from the ID."""
+    try:
+        # Check the ID before it becomes part of the cache key, so each plot has only one cache key and ETag
+        plotNumber = ParsePlotID(GetVocabulary(), plotID)
+        return CachedPlotPage("id:" + plotID, lambda: RenderPlot(plotNumber))
+    except ValueError:
+        return apology("That plot doesn't exist (or not any more, if the vocabulary has changed since).", 404)
+    except:
+        return apology("Generation of an improved Hallmark movie has failed. Hallmark is just really good as it is, apparently.", 403)
+
+
+
+def CachedPlotPage(cacheKey, GetSettings):
+    """Return a response with the page for a single plot, which can be cached by browsers, proxies and CDNs.
+
+    Keyword arguments:
+    cacheKey -- a string which identifies the plot, for as long as the vocabulary doesn't change
+    GetSettings -- a function which returns the settings for the plot. Only called if the client doesn't already have the page
+    """
+    # The page depends only on the key and the vocabulary, so that's all the ETag needs. If the client already has it, skip generation
+    etag = hashlib.sha1((cacheKey + ":" + GetVocabularyVersion()).encode()).hexdigest()
+    cacheControl = "public, max-age=" + str(PLOT_CACHE_SECONDS)
+    if etag in request.if_none_match:
+        return Response(status=304, headers={"ETag": '"' + etag + '"', "Cache-Control": cacheControl})
+
+    # Get the settings and arrange them into a dictionary
+    mySettings = GetSettings()
+    thisMovie = {}
+    thisMovie["plot"] = Markup(mySettings["plot"])
+    thisMovie["image"] = mySettings["images"][0]
+    thisMovie["title"] = mySettings["titles"][0]
+
+    response = make_response(render_template("original.html", myMovie = thisMovie))
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cacheControl
+    return response
+
+
+
+@app.route("/api/plots", methods=["GET"])
+def plots():
+    """Return n modified plots, each with an image and a title.
+
+    Up to MAX_JSON_PLOTS come back as a JSON list. Larger requests (or any with format=ndjson) are streamed as
+    newline-delimited JSON, one record per line, generated a chunk at a time so the server never holds them all.
+    An optional whole-number seed makes the response repeatable.
+    """
+    try:
+        n = int(request.args.get("n", 1))
+    except ValueError:
+        n = 0
+
+    if n < 1 or n > MAX_API_PLOTS:
+        return jsonify({"error": "n must be a whole number between 1 and " + str(MAX_API_PLOTS)}), 400
+
+    seed = request.args.get("seed", None, type=int)
+
+    if n <= MAX_JSON_PLOTS and request.args.get("format", "json") != "ndjson":
+        return jsonify([GetPlotRecord(mySettings) for chunk in GetHallmarkSettingsChunks(n, API_CHUNK_SIZE, seed) for mySettings in chunk])
+
+    # Each chunk of plots becomes one piece of the response
+    def GenerateLines():
+        for chunk in GetHallmarkSettingsChunks(n, API_CHUNK_SIZE, seed):
+            yield "".join(json.dumps(GetPlotRecord(mySettings)) + "\n" for mySettings in chunk)
+
+    return Response(stream_with_context(GenerateLines()), mimetype="application/x-ndjson")
+
+
+
+@app.route("/api/pool", methods=["GET"])
+def plotPoolStats():
+    """Return the depth, refill rate and other statistics for the pool of ready-made plots, as JSON."""
+    return jsonify(GetPlotPoolStats())
+
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Return the plot generation timings and fallback counts, in the Prometheus text format."""
+    if not MetricsEnabled():
+        return Response("Metrics are disabled. Set HALLMARK_METRICS=1 to enable them.\n", status=404, mimetype="text/plain")
+
+    return Response(FormatMetrics(), mimetype="text/plain; version=0.0.4")
+
+
+
 @app.route("/original", methods=["GET"])
 def original():
     """Render page with the original Hallmark plot."""
@@ -0,0 +1,114 @@
+# ASGI (Quart) application for Hallmark webpage. Serves the same pages as application.py, with async handlers.
+# Run with an ASGI server, e.g. "hypercorn asgiApplication:app"
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from markupsafe import Markup
+from quart import Quart, Response, render_template
+from werkzeug.exceptions import default_exceptions, HTTPException, InternalServerError
+from helpers import GetHallmarkSelection
+from hallmarkGenerator import GetHallmarkSettings
+from vocabulary import ConfigureVocabularyFile, GetVocabulary
+from metrics import EnableMetrics, MetricsEnabled, FormatMetrics
+from plotPool import ConfigurePlotPool, StartPlotPool, TakePlots, DEFAULT_LOW_WATERMARK, DEFAULT_HIGH_WATERMARK
+from connectionPool import ConfigurePool, DATABASE_PATH, DEFAULT_POOL_SIZE
+
+# Configure application
+app = Quart(__name__)
+
+# Ensure templates are auto-reloaded
+app.config["TEMPLATES_AUTO_RELOAD"] = True
+
+# Share a pool of read-only connections to hallmark.db between all the worker threads
+ConfigurePool(DATABASE_PATH, int(os.environ.get("HALLMARK_POOL_SIZE", DEFAULT_POOL_SIZE)))
+
+# Anything which might block (generating plots, or reloading the vocabulary from hallmark.db) runs on these threads, so the event loop never waits.
+# There's no point having more threads than connections in the pool
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("HALLMARK_POOL_SIZE", DEFAULT_POOL_SIZE)), thread_name_prefix="hallmark")
+
+# Time each stage of plot generation and count fallbacks, for /metrics. Off unless HALLMARK_METRICS=1, since timing every stage slows generation down
+if os.environ.get("HALLMARK_METRICS", "0") == "1":
+    EnableMetrics()
+
+# Map a compiled vocabulary file (see compiledVocabulary.py) instead of loading hallmark.db, if HALLMARK_VOCABULARY_FILE names one.
+# Every worker maps the same file, so they share one copy of the vocabulary
+if os.environ.get("HALLMARK_VOCABULARY_FILE"):
+    ConfigureVocabularyFile(os.environ["HALLMARK_VOCABULARY_FILE"])
+
+# Load the vocabulary once, at startup, so requests never need to touch the database
+GetVocabulary()
+
+# Keep a pool of ready-made plots topped up in the background, so the index page doesn't have to wait for them to be generated
+ConfigurePlotPool(int(os.environ.get("HALLMARK_PLOT_POOL_LOW", DEFAULT_LOW_WATERMARK)), int(os.environ.get("HALLMARK_PLOT_POOL_HIGH", DEFAULT_HIGH_WATERMARK)))
+StartPlotPool()
+
+
+
+
+async def RunBlocking(func, *args):
+    """Run a blocking function on the executor and wait for its result without blocking the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+
+async def apology(errMsg, errcode):
+    """Render the apology page."""
+    return await render_template("apology.html", theError=errMsg), errcode
+
+
+
+@app.route("/")
+async def index():
+    """Render index page."""
+    try:
+        # Get settings for 3 x modified Hallmark movies. Take what's ready from the pool, then generate any missing ones concurrently
+        mySettings = await RunBlocking(TakePlots, 3, False)
+        mySettings.extend(await asyncio.gather(*[RunBlocking(GetHallmarkSettings, False) for i in range(3 - len(mySettings))]))
+
+        # Arrange into a list of dictionaries, aiming for three different images and title templates
+        myMovies = GetHallmarkSelection(mySettings)
+
+        return await render_template("index.html", movies=myMovies)
+    except:
+        return await apology("Generation of improved Hallmark movies has failed. Hallmark is just really good as it is, apparently.", 403)
+
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    """Return the plot generation timings and fallback counts, in the Prometheus text format."""
+    if not MetricsEnabled():
+        return Response("Metrics are disabled. Set HALLMARK_METRICS=1 to enable them.\n", status=404, mimetype="text/plain")
+
+    return Response(FormatMetrics(), mimetype="text/plain; version=0.0.4")
+
+
+
+@app.route("/original", methods=["GET"])
+async def original():
+    """Render page with the original Hallmark plot."""
+    try:
+        # Get setting for the "original" Hallmark movie and arrange it into a dictionary
+        originalMovie = await RunBlocking(GetHallmarkSettings, True)
+        thisMovie = {}
+        thisMovie["plot"] = Markup(originalMovie["plot"])
+        thisMovie["image"] = originalMovie["images"][0]
+        thisMovie["title"] = originalMovie["titles"][0]
+
+        return await render_template("original.html", myMovie = thisMovie)
+    except:
+        return await apology("Attempt to lookup the original movie details failed.", 403)
+
+
+
+async def errorhandler(e):
+    """Handle error"""
+    if not isinstance(e, HTTPException):
+        e = InternalServerError()
+    return await apology(e.name, e.code)
+
+
+
+# Listen for errors
+for code in default_exceptions:
+    app.errorhandler(code)(errorhandler)
@@ -0,0 +1,411 @@
+# Times the hot paths (plot generation, weighted picks, the index page selection, importing and the web routes) and compares them with a saved baseline.
+# Run from the project directory: python benchmarks/runBenchmarks.py [options]. See benchmarks/README.md for the options.
+import argparse
+import contextlib
+import glob
+import importlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from connectionPool import ConfigurePool, DATABASE_PATH
+from hallmarkGenerator import GetHallmarkSettings, CreateAliasTableFromWeights, WeightedPick, CreateUnfairCoin
+from helpers import GetHallmarkSelection
+from migrate import CreateDatabase
+from plotQuery import GetHallmarkSettingsFromDatabase
+from sourceParser import ParseFileSections, GetSectionOrder
+from storage import OpenStorage
+from vocabulary import GetVocabulary, GetVocabularyVersion
+
+
+# Declare some globals
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_RESULTS_PATH = os.path.join(BENCHMARK_DIR, "latest.json")
+
+# Every benchmark starts from this seed, so two runs make the same choices in the same order
+SEED = 2022
+
+# The groups of benchmarks, in the order they run
+GROUPS = ["generator", "aliasTable", "selection", "import", "routes"]
+
+# How many plots GetHallmarkSettingsFromDatabase makes per query in the generator benchmarks
+DATABASE_BATCH_SIZE = 100
+
+# Choice group sizes for the alias table benchmarks
+ALIAS_TABLE_SIZES = [2, 10, 100, 1000, 10000, 100000]
+
+# Calls are timed in batches big enough to take at least this long (in seconds), so the cost of reading the clock doesn't swamp fast calls.
+# Anything slower than this is timed one call at a time
+MIN_BATCH_SECONDS = 0.00005
+
+# Each benchmark keeps going for at least this long (in seconds) and this many batches. --quick uses QUICK_SECONDS instead
+MIN_SECONDS = 1.0
+QUICK_SECONDS = 0.2
+MIN_BATCHES = 30
+
+# How many times to import the whole of sourceData, for each import mode. Row-at-a-time mode takes a few seconds per import
+IMPORT_REPEATS = {"bulk": 20, "rows": 3}
+QUICK_IMPORT_REPEATS = {"bulk": 5, "rows": 1}
+
+# By default, a benchmark whose ops/sec falls by more than this fraction of the baseline counts as a regression
+DEFAULT_TOLERANCE = 0.1
+
+
+
+def main():
+    """Run the benchmarks, write the results as JSON and report any regressions against the baseline."""
+    parser = argparse.ArgumentParser(description="Benchmark the Hallmark generator, importer and web routes.")
+    parser.add_argument("--db", default=DATABASE_PATH, help="database to generate plots from (default: hallmark.db)")
+    parser.add_argument("--only", default=",".join(GROUPS), help="comma-separated groups to run, from: " + ", ".join(GROUPS))
+    parser.add_argument("--quick", action="store_true", help="shorter runs, for a rough idea")
+    parser.add_argument("--out", default=DEFAULT_RESULTS_PATH, help="where to write the results as JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="baseline JSON to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="save these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="fall in ops/sec that counts as a regression (default: 0.1 = 10%%)")
+    args = parser.parse_args()
+
+    groups = [group.strip() for group in args.only.split(",") if group.strip() != ""]
+    unknown = [group for group in groups if group not in GROUPS]
+    if len(unknown) > 0:
+        parser.error("unknown group(s): " + ", ".join(unknown))
+
+    dbPath = os.path.abspath(args.db)
+    if not os.path.isfile(dbPath):
+        parser.error("no database at " + dbPath + ". Create one with migrate.py and import.py first")
+
+    ConfigurePool(dbPath)
+    results = RunBenchmarks(groups, dbPath, args.quick)
+    report = {"meta": GetRunDetails(dbPath, args.quick), "results": results}
+
+    with open(args.out, "w") as writer:
+        json.dump(report, writer, indent=2)
+    print("Results written to " + args.out)
+
+    # Compare before saving, so --save-baseline still shows what changed since the old baseline
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, "r") as reader:
+            baseline = json.load(reader)["results"]
+    else:
+        print("No baseline at " + args.baseline + " to compare with. Use --save-baseline to save one.")
+
+    regressions = CompareWithBaseline(results, baseline, args.tolerance)
+    PrintComparison(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as writer:
+            json.dump(report, writer, indent=2)
+        print("Baseline saved to " + args.baseline)
+
+    elif len(regressions) > 0:
+        print(str(len(regressions)) + " benchmark(s) slower than the baseline: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+
+
+def RunBenchmarks(groups, dbPath, quick):
+    """Run the chosen groups of benchmarks, returning a dictionary of benchmark name => summary (see Summarise)."""
+    minSeconds = QUICK_SECONDS if quick else MIN_SECONDS
+    results = {}
+
+    # Load the vocabulary up front, so the first benchmark doesn't pay for it
+    GetVocabulary()
+
+    if "generator" in groups:
+        results.update(BenchmarkGenerator(minSeconds))
+    if "aliasTable" in groups:
+        results.update(BenchmarkAliasTables(minSeconds))
+    if "selection" in groups:
+        results.update(BenchmarkSelection(minSeconds))
+    if "import" in groups:
+        results.update(BenchmarkImport(QUICK_IMPORT_REPEATS if quick else IMPORT_REPEATS))
+    if "routes" in groups:
+        results.update(BenchmarkRoutes(dbPath, minSeconds))
+
+    return results
+
+
+
+
+def BenchmarkGenerator(minSeconds):
+    """Time GetHallmarkSettings for modified and original plots, and GetHallmarkSettingsFromDatabase making a batch of plots."""
+    results = {}
+    random.seed(SEED)
+    results["generator.settings.modified"] = Measure(lambda: GetHallmarkSettings(False), minSeconds)
+    random.seed(SEED)
+    results["generator.settings.original"] = Measure(lambda: GetHallmarkSettings(True), minSeconds)
+    results["generator.database.batch" + str(DATABASE_BATCH_SIZE)] = Measure(lambda: GetHallmarkSettingsFromDatabase(DATABASE_BATCH_SIZE, SEED), minSeconds)
+    return results
+
+
+
+
+def BenchmarkAliasTables(minSeconds):
+    """Time building alias tables, WeightedPick and CreateUnfairCoin for a range of choice group sizes.
+
+    Weights fall off like a Zipf distribution (the nth option is weighted 1/n), as a few common words and a long tail of rare ones would be.
+    """
+    results = {}
+    for size in ALIAS_TABLE_SIZES:
+        ids = list(range(size))
+        weights = [1 / (pos + 1) for pos in range(size)]
+        aliasTable = CreateAliasTableFromWeights(ids, weights)
+        rng = random.Random(SEED)
+
+        label = ".n=" + str(size)
+        results["aliasTable.build" + label] = Measure(lambda: CreateAliasTableFromWeights(ids, weights), minSeconds)
+        results["aliasTable.weightedPick" + label] = Measure(lambda: WeightedPick(aliasTable, rng), minSeconds)
+        results["aliasTable.unfairCoin" + label] = Measure(lambda: CreateUnfairCoin(aliasTable, rng), minSeconds)
+
+    return results
+
+
+
+
+def BenchmarkSelection(minSeconds):
+    """Time GetHallmarkSelection choosing images and titles for three plots.
+
+    Each call gets three new plots, generated outside the timed part, since the titles are shuffled as they're read.
+    """
+    rng = random.Random(SEED)
+    return {"selection.getHallmarkSelection": Measure(GetHallmarkSelection, minSeconds,
+                                                       lambda: [GetHallmarkSettings(False, rng) for i in range(3)])}
+
+
+
+
+def BenchmarkImport(repeats):
+    """Time import.py on each file in sourceData, in both bulk and row-at-a-time mode.
+
+    Each repeat imports every file, one at a time, into a new empty database. Files are imported in order of the last section
+    they contain (see GetSectionOrder), which puts every file after the files it relies on.
+    """
+    importer = importlib.import_module("import")
+
+    ranks = GetSectionOrder()
+    parsedFiles = [(path, ParseFileSections(path)) for path in glob.glob(os.path.join(PROJECT_DIR, "sourceData", "*.txt"))]
+    parsedFiles.sort(key=lambda item: (max(ranks.get(myTable, len(ranks)) for myTable, records in item[1]), item[0]))
+
+    samples = {}
+    with tempfile.TemporaryDirectory() as tempDir, contextlib.redirect_stdout(io.StringIO()):
+        # The CS50 Library (if HALLMARK_STORAGE=cs50) logs every query it runs, which would be timed along with the import
+        logging.getLogger("cs50").disabled = True
+        try:
+            for mode in ["bulk", "rows"]:
+                for repeat in range(repeats[mode]):
+                    dbPath = os.path.join(tempDir, mode + str(repeat) + ".db")
+                    CreateDatabase(dbPath)
+                    db = OpenStorage(dbPath) if mode == "rows" else None
+
+                    for path, fileSections in parsedFiles:
+                        startTime = time.perf_counter()
+                        if mode == "bulk":
+                            importer.BulkImportFile(dbPath, path, False)
+                        else:
+                            with open(path, "r") as reader:
+                                importer.ImportToDatabase(db, reader)
+                        samples.setdefault((mode, path), []).append(time.perf_counter() - startTime)
+        finally:
+            logging.getLogger("cs50").disabled = False
+
+    # Each sample is one file, so ops/sec is files per second. Add records per second, since files vary so much in size
+    results = {}
+    for path, fileSections in parsedFiles:
+        numRecords = sum(len(records) for myTable, records in fileSections)
+        for mode in ["bulk", "rows"]:
+            summary = Summarise(samples[(mode, path)], 1)
+            summary["records"] = numRecords
+            summary["recordsPerSec"] = summary["opsPerSec"] * numRecords
+            results["import." + mode + "." + os.path.basename(path)] = summary
+
+    return results
+
+
+
+
+def BenchmarkRoutes(dbPath, minSeconds):
+    """Time the / and /original pages through Flask's test client.
+
+    The pool of ready-made plots is kept empty, so every / request generates its plots inline and the timings don't depend on how
+    far ahead the background worker has got.
+    """
+    app = LoadFlaskApp(dbPath)
+    client = app.test_client()
+
+    def GetPage(url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(url + " returned status " + str(response.status_code))
+
+    results = {}
+    random.seed(SEED)
+    results["routes.index"] = Measure(lambda: GetPage("/"), minSeconds)
+    random.seed(SEED)
+    results["routes.original"] = Measure(lambda: GetPage("/original"), minSeconds)
+    return results
+
+
+
+
+def LoadFlaskApp(dbPath):
+    """Return the Flask app from application.py, set up to use the database at dbPath.
+
+    application.py loads hallmark.db from the working directory as it's imported, so import it from a temporary directory holding
+    a link to the database, then point the connection pool back at the real path.
+    """
+    # A low watermark of 0 means the background worker never starts refilling the pool
+    os.environ["HALLMARK_PLOT_POOL_LOW"] = "0"
+
+    startDir = os.getcwd()
+    with tempfile.TemporaryDirectory() as tempDir:
+        os.symlink(dbPath, os.path.join(tempDir, DATABASE_PATH))
+        os.chdir(tempDir)
+        try:
+            application = importlib.import_module("application")
+        finally:
+            os.chdir(startDir)
+
+    ConfigurePool(dbPath)
+    return application.app
+
+
+
+
+def Measure(func, minSeconds, makeArgs=None):
+    """Call a function repeatedly and return a summary of how long it took (see Summarise).
+
+    Keyword arguments:
+    func -- the function to time
+    minSeconds -- keep timing for at least this long (and at least MIN_BATCHES batches)
+    makeArgs -- optional. A function returning the argument for one call of func. Called before each batch, outside the timed part
+    """
+    def RunBatch(batchSize):
+        argsList = [makeArgs() for i in range(batchSize)] if makeArgs != None else None
+        startTime = time.perf_counter()
+        if argsList == None:
+            for i in range(batchSize):
+                func()
+        else:
+            for myArgs in argsList:
+                func(myArgs)
+        return time.perf_counter() - startTime
+
+    # Find a batch size that takes long enough to time accurately. This doubles as the warm-up
+    batchSize = 1
+    while RunBatch(batchSize) < MIN_BATCH_SECONDS:
+        batchSize *= 2
+
+    # Then time batches until there's enough data. Each sample is the average time per call within its batch
+    samples = []
+    totalSeconds = 0.0
+    while totalSeconds < minSeconds or len(samples) < MIN_BATCHES:
+        batchSeconds = RunBatch(batchSize)
+        totalSeconds += batchSeconds
+        samples.append(batchSeconds / batchSize)
+
+    return Summarise(samples, batchSize)
+
+
+
+
+def Summarise(samples, batchSize):
+    """Return a dictionary summarising a list of timings, each the average seconds per call over a batch of calls.
+
+    Keys in the returned dictionary:
+    ops -- the number of calls timed
+    opsPerSec -- calls per second, over all the batches
+    batchSize -- calls per batch. Where this is above 1, the percentiles are of batch averages, so smooth out the slowest calls
+    meanUs, p50Us, p90Us, p99Us, maxUs -- time per call, in microseconds
+    """
+    samplesUs = sorted(sample * 1000000 for sample in samples)
+    if len(samplesUs) > 1:
+        cuts = statistics.quantiles(samplesUs, n=100, method="inclusive")
+    else:
+        cuts = samplesUs * 99
+
+    summary = {}
+    summary["ops"] = len(samples) * batchSize
+    summary["opsPerSec"] = 1000000 / statistics.mean(samplesUs)
+    summary["batchSize"] = batchSize
+    summary["meanUs"] = statistics.mean(samplesUs)
+    summary["p50Us"] = cuts[49]
+    summary["p90Us"] = cuts[89]
+    summary["p99Us"] = cuts[98]
+    summary["maxUs"] = samplesUs[-1]
+    return summary
+
+
+
+
+def GetRunDetails(dbPath, quick):
+    """Return a dictionary describing the machine, code and data the benchmarks ran against, for telling results apart later."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=PROJECT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    details = {}
+    details["time"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    details["commit"] = commit
+    details["python"] = platform.python_version()
+    details["platform"] = platform.platform()
+    details["cpus"] = os.cpu_count()
+    details["database"] = dbPath
+    details["vocabularyVersion"] = GetVocabularyVersion()
+    details["quick"] = quick
+    return details
+
+
+
+
+def CompareWithBaseline(results, baseline, tolerance):
+    """Return a list of the names of benchmarks whose ops/sec has fallen by more than the tolerance since the baseline."""
+    return [name for name in results if name in baseline and GetChange(results[name], baseline[name]) < -tolerance]
+
+
+
+
+def GetChange(summary, baseSummary):
+    """Return the change in ops/sec from the baseline, as a fraction (e.g. -0.2 = 20% slower)."""
+    return summary["opsPerSec"] / baseSummary["opsPerSec"] - 1
+
+
+
+
+def PrintComparison(results, baseline, tolerance):
+    """Print a table of each benchmark's ops/sec and latencies, next to its change since the baseline."""
+    print(format("benchmark", "<45") + format("ops/sec", ">14") + format("p50 us", ">12") + format("p99 us", ">12") + format("vs baseline", ">14"))
+    for name, summary in results.items():
+        if name not in baseline:
+            change = "new"
+        else:
+            fraction = GetChange(summary, baseline[name])
+            change = format(fraction, "+.1%")
+            if fraction < -tolerance:
+                change += " !"
+
+        print(format(name, "<45") + format(summary["opsPerSec"], ">14,.1f") + format(summary["p50Us"], ">12,.1f") +
+              format(summary["p99Us"], ">12,.1f") + format(change, ">14"))
+
+    missing = [name for name in baseline if name not in results]
+    if len(missing) > 0:
+        print(str(len(missing)) + " benchmark(s) in the baseline weren't run this time")
+
+
+
+if __name__ == "__main__":
+    main()
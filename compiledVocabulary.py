@@ -0,0 +1,517 @@
+# Compiles the vocabulary into a single binary file, which the generator maps into memory instead of loading it from hallmark.db.
+# Usage: python compiledVocabulary.py [--db hallmark.db | --source sourceData] [--out hallmark.vocab]
+import argparse
+import array
+import bisect
+import contextlib
+import importlib
+import io
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import zlib
+from collections.abc import Mapping, Sequence
+from sys import byteorder, exit
+from types import MappingProxyType
+
+
+# Declare some globals
+VOCABULARY_FILE_PATH = "hallmark.vocab"
+DATABASE_PATH = "hallmark.db"
+
+# The start of every vocabulary file, and the version of its layout. A file with another version has to be compiled again
+FILE_MAGIC = b"HMVOCAB\x00"
+FORMAT_VERSION = 1
+
+# Layout: the header (FILE_MAGIC, FORMAT_VERSION and the number of sections), then a table of contents giving each section's name,
+# array type code, offset and length in bytes, then the sections. Each section is a little-endian array starting on an 8 byte boundary,
+# so it can be read where it is, without copying.
+# Every string is stored once, sorted by its UTF-8 bytes, so sorting by a string's number is the same as sorting by the string.
+# A hash table (open addressing on the CRC-32 of the bytes, with linear probing) finds a string's number without searching
+HEADER = struct.Struct("<8sII")
+SECTION_ENTRY = struct.Struct("<32s4sQQ")
+ALIGNMENT = 8
+
+# Stand-ins for a missing words or categories ID in an ID section, and a missing string in a string section
+NO_ID = -2 ** 63
+NO_STRING = -1
+
+# The maps which are stored as sorted keys and one value each, or a list of values each: vocabulary key => (key type, value type).
+# Types are "int" (an ID), "str" (a string's number) and "pair" (two strings, packed into one number)
+SINGLE_MAPS = {"words": ("int", "str"), "wordIDs": ("str", "int"), "objectPronouns": ("str", "str"), "verbs": ("pair", "str"),
+               "images": ("str", "str")}
+LIST_MAPS = {"categoryWords": "str", "categoryIDWords": "int", "characterPronouns": "int", "characterHometowns": "int", "wordImages": "str"}
+
+# The array type code used for each type of key or value
+TYPECODES = {"int": "q", "str": "i", "pair": "q"}
+
+
+
+def main():
+    """Compile the vocabulary in hallmark.db, or in a directory of .txt files, into a vocabulary file."""
+    parser = argparse.ArgumentParser(description="Compile the Hallmark vocabulary into a file the generator can map into memory.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--db", default=DATABASE_PATH, help="compile the vocabulary in this database (default: " + DATABASE_PATH + ")")
+    source.add_argument("--source", help="compile straight from a directory of .txt files like sourceData, without a database")
+    parser.add_argument("--out", default=VOCABULARY_FILE_PATH, help="the file to write (default: " + VOCABULARY_FILE_PATH + ")")
+    args = parser.parse_args()
+
+    try:
+        if args.source != None:
+            vocab = LoadVocabularyFromSource(args.source)
+        else:
+            vocab = LoadVocabularyFromDatabase(args.db)
+        CompileVocabulary(vocab, args.out)
+
+    except (ValueError, OSError, sqlite3.Error) as e:
+        print("Compiling failed: " + str(e))
+        exit(1)
+
+    print("Compiled " + str(len(vocab["words"])) + " words into " + args.out + " (" + format(os.path.getsize(args.out), ",") + " bytes)")
+
+
+
+def LoadVocabularyFromDatabase(dbPath):
+    """Return the vocabulary model (see vocabulary.LoadVocabulary) for a database."""
+    from connectionPool import PoolConnection
+    from vocabulary import LoadVocabulary
+
+    if not os.path.exists(dbPath):
+        raise ValueError(dbPath + " doesn't exist")
+
+    db = PoolConnection(dbPath)
+    try:
+        return LoadVocabulary(db)
+    finally:
+        db.close()
+
+
+
+def LoadVocabularyFromSource(srcDir):
+    """Return the vocabulary model (see vocabulary.LoadVocabulary) for a directory of .txt files, by importing them into a scratch
+    database. The importer checks the files exactly as it does for hallmark.db, so the two always agree."""
+    importer = importlib.import_module("import")
+    from migrate import CreateDatabase
+
+    if not os.path.isdir(srcDir):
+        raise ValueError(srcDir + " isn't a directory")
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        dbPath = os.path.join(tempDir, "hallmark.db")
+        CreateDatabase(dbPath)
+
+        # The importer reports on everything it adds
+        with contextlib.redirect_stdout(io.StringIO()):
+            importer.ImportDirectory(dbPath, srcDir, True, False)
+        return LoadVocabularyFromDatabase(dbPath)
+
+
+
+def CompileVocabulary(vocab, outPath):
+    """Write a vocabulary model to a vocabulary file, along with the alias table for each choice group.
+
+    Keyword arguments:
+    vocab -- the vocabulary model, from vocabulary.LoadVocabulary
+    outPath -- the file to write. An existing file is replaced in one step, so a process which has the old one mapped keeps reading it
+    """
+    from hallmarkGenerator import CreateAliasTable
+
+    # Strings first, since everything else refers to them by number
+    strings = sorted(CollectStrings(vocab), key=lambda string: string.encode("utf-8"))
+    stringNumbers = {string: number for number, string in enumerate(strings)}
+    blob = bytearray()
+    offsets = [0]
+    for string in strings:
+        blob += string.encode("utf-8")
+        offsets.append(len(blob))
+
+    sections = {"strings.blob": array.array("B", blob), "strings.offsets": array.array("q", offsets), "strings.hashSlots": BuildHashSlots(strings)}
+
+    def Encode(value, valueType):
+        if valueType == "str":
+            return NO_STRING if value == None else stringNumbers[value]
+        if valueType == "pair":
+            return (stringNumbers[value[0]] << 32) | stringNumbers[value[1]]
+        return NO_ID if value == None else value
+
+    for name, (keyType, valueType) in SINGLE_MAPS.items():
+        items = sorted((Encode(key, keyType), Encode(value, valueType)) for key, value in vocab[name].items())
+        sections[name + ".keys"] = array.array(TYPECODES[keyType], [key for key, value in items])
+        sections[name + ".values"] = array.array(TYPECODES[valueType], [value for key, value in items])
+
+    for name, keyType in LIST_MAPS.items():
+        AddListMap(sections, name, keyType, {Encode(key, keyType): [Encode(value, "str") for value in values] for key, values in vocab[name].items()})
+
+    sections["mainCharCandidates"] = array.array("q", vocab["mainCharCandidates"])
+    sections["defaultImages"] = array.array("i", [Encode(image, "str") for image in vocab["defaultImages"]])
+    sections["titleTemplates.templates"] = array.array("i", [Encode(template, "str") for template, display in vocab["titleTemplates"]])
+    sections["titleTemplates.displays"] = array.array("i", [Encode(display, "str") for template, display in vocab["titleTemplates"]])
+
+    # Probabilities records, grouped by choice group, each group with its alias table. Alias positions count from the start of the group
+    groupNames = sorted(vocab["choiceGroups"], key=lambda name: stringNumbers[name])
+    columns = {column: [] for column in ["id", "probability", "words_id", "categories_id", "prefixStr", "prob", "alias"]}
+    starts = [0]
+    for groupName in groupNames:
+        records = vocab["choiceGroups"][groupName]
+        aliasTable = CreateAliasTable(records)
+        for record, prob, alias in zip(records, aliasTable["prob"], aliasTable["alias"]):
+            columns["id"].append(record["id"])
+            columns["probability"].append(record["probability"])
+            columns["words_id"].append(Encode(record["words_id"], "int"))
+            columns["categories_id"].append(Encode(record["categories_id"], "int"))
+            columns["prefixStr"].append(Encode(record["prefixStr"], "str"))
+            columns["prob"].append(prob)
+            columns["alias"].append(alias)
+        starts.append(len(columns["id"]))
+
+    sections["choiceGroups.keys"] = array.array("i", [stringNumbers[name] for name in groupNames])
+    sections["choiceGroups.starts"] = array.array("q", starts)
+    for column, typecode in [("id", "q"), ("probability", "d"), ("words_id", "q"), ("categories_id", "q"), ("prefixStr", "i"), ("prob", "d"), ("alias", "i")]:
+        sections["probabilities." + column] = array.array(typecode, columns[column])
+
+    # Every probabilities record by ID, as its position in the columns above
+    byID = sorted((recordID, pos) for pos, recordID in enumerate(columns["id"]))
+    sections["probabilities.keys"] = array.array("q", [recordID for recordID, pos in byID])
+    sections["probabilities.values"] = array.array("q", [pos for recordID, pos in byID])
+
+    WriteSections(sections, outPath)
+
+
+
+def CollectStrings(vocab):
+    """Return a set of every string in a vocabulary model."""
+    strings = set(vocab["words"].values())
+    strings.update(vocab["wordIDs"])
+    for name in ["categoryWords", "objectPronouns", "images", "wordImages"]:
+        strings.update(vocab[name])
+    for name in ["objectPronouns", "images"]:
+        strings.update(vocab[name].values())
+    for infinitive, pronoun in vocab["verbs"]:
+        strings.update([infinitive, pronoun])
+    strings.update(vocab["verbs"].values())
+    for name in LIST_MAPS:
+        for values in vocab[name].values():
+            strings.update(values)
+    strings.update(vocab["defaultImages"])
+    strings.update(vocab["choiceGroups"])
+    strings.update(record["prefixStr"] for records in vocab["choiceGroups"].values() for record in records)
+    for template, display in vocab["titleTemplates"]:
+        strings.update([template, display])
+
+    strings.discard(None)
+    return strings
+
+
+
+def BuildHashSlots(strings):
+    """Return the hash table for a sorted list of strings: an array with a power of two slots, at least twice as many as there are
+    strings, each holding NO_STRING or the number of the string which hashed to it (or to a full slot before it)."""
+    mask = 1
+    while mask + 1 < len(strings) * 2:
+        mask = mask * 2 + 1
+
+    slots = array.array("i", [NO_STRING]) * (mask + 1)
+    for number, string in enumerate(strings):
+        slot = zlib.crc32(string.encode("utf-8")) & mask
+        while slots[slot] != NO_STRING:
+            slot = (slot + 1) & mask
+        slots[slot] = number
+
+    return slots
+
+
+
+def AddListMap(sections, name, keyType, lists):
+    """Add the sections for a map with a list of strings for each key: the sorted keys, then where each key's values start in a
+    single array of all of them (with the end of the last one added on the end)."""
+    keys = sorted(lists)
+    starts = [0]
+    values = []
+    for key in keys:
+        values.extend(lists[key])
+        starts.append(len(values))
+
+    sections[name + ".keys"] = array.array(TYPECODES[keyType], keys)
+    sections[name + ".starts"] = array.array("q", starts)
+    sections[name + ".values"] = array.array("i", values)
+
+
+
+def WriteSections(sections, outPath):
+    """Write a dictionary of section name => array to a vocabulary file, in the layout described at the top of this module."""
+    if byteorder != "little":
+        raise ValueError("vocabulary files are little-endian, so they can only be compiled and read on little-endian machines")
+
+    # Work out where each section goes, after the header and the table of contents
+    offset = AlignOffset(HEADER.size + SECTION_ENTRY.size * len(sections))
+    entries = []
+    for name, values in sections.items():
+        if len(name) > 32:
+            raise ValueError("section names can't be longer than 32 characters: " + name)
+        length = len(values) * values.itemsize
+        entries.append(SECTION_ENTRY.pack(name.encode("ascii"), values.typecode.encode("ascii"), offset, length))
+        offset = AlignOffset(offset + length)
+
+    tempPath = outPath + ".tmp"
+    with open(tempPath, "wb") as writer:
+        writer.write(HEADER.pack(FILE_MAGIC, FORMAT_VERSION, len(sections)))
+        writer.write(b"".join(entries))
+        for values in sections.values():
+            writer.write(b"\x00" * (AlignOffset(writer.tell()) - writer.tell()))
+            values.tofile(writer)
+
+    os.replace(tempPath, outPath)
+
+
+
+def AlignOffset(offset):
+    """Return the first offset at or after the given one where a section can start."""
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+
+def LoadCompiledVocabulary(path):
+    """Map a vocabulary file into memory and return a read-only vocabulary model for it, with the same keys as vocabulary.LoadVocabulary,
+    plus "aliasTables" (choice group name => alias table, as from hallmarkGenerator.CreateAliasTable).
+
+    Keyword arguments:
+    path -- a file written by CompileVocabulary
+
+    Nothing is copied out of the file up front: the maps and lists read it where it is, decoding strings as they're asked for.
+    Processes which map the same file share the same memory, and loading takes about as long as opening it.
+    """
+    with open(path, "rb") as reader:
+        fileMap = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+
+    sections = ReadSections(fileMap, path)
+    strings = StringTable(sections["strings.blob"], sections["strings.offsets"], sections["strings.hashSlots"])
+    keyCodecs = {"int": IntKeyCodec(), "str": StringKeyCodec(strings), "pair": PairKeyCodec(strings)}
+    vocab = {}
+
+    for name, (keyType, valueType) in SINGLE_MAPS.items():
+        values = sections[name + ".values"]
+        if valueType == "str":
+            GetValue = lambda pos, values=values: strings.Get(values[pos])
+        else:
+            GetValue = lambda pos, values=values: values[pos]
+        vocab[name] = CompiledMapping(sections[name + ".keys"], keyCodecs[keyType], GetValue)
+
+    for name, keyType in LIST_MAPS.items():
+        starts = sections[name + ".starts"]
+        values = sections[name + ".values"]
+        GetValue = lambda pos, starts=starts, values=values: CompiledSequence(starts[pos + 1] - starts[pos], lambda i, start=starts[pos]: strings.Get(values[start + i]))
+        vocab[name] = CompiledMapping(sections[name + ".keys"], keyCodecs[keyType], GetValue, True)
+
+    vocab["mainCharCandidates"] = sections["mainCharCandidates"]
+    vocab["defaultImages"] = CompiledSequence(len(sections["defaultImages"]), lambda i: strings.Get(sections["defaultImages"][i]))
+    vocab["titleTemplates"] = CompiledSequence(len(sections["titleTemplates.templates"]),
+                                               lambda i: (strings.Get(sections["titleTemplates.templates"][i]), strings.Get(sections["titleTemplates.displays"][i])))
+
+    # Probabilities records are made as they're asked for, looking like the ones from LoadVocabulary
+    def GetRecord(pos):
+        return MappingProxyType({"id": sections["probabilities.id"][pos], "probability": sections["probabilities.probability"][pos],
+                                 "words_id": GetID(sections["probabilities.words_id"][pos]),
+                                 "categories_id": GetID(sections["probabilities.categories_id"][pos]),
+                                 "prefixStr": strings.Get(sections["probabilities.prefixStr"][pos])})
+
+    starts = sections["choiceGroups.starts"]
+    vocab["probabilities"] = CompiledMapping(sections["probabilities.keys"], keyCodecs["int"], lambda pos: GetRecord(sections["probabilities.values"][pos]))
+    vocab["choiceGroups"] = CompiledMapping(sections["choiceGroups.keys"], keyCodecs["str"],
+                                            lambda pos: CompiledSequence(starts[pos + 1] - starts[pos], lambda i, start=starts[pos]: GetRecord(start + i)), True)
+
+    # The alias tables are slices of the file too, so there's nothing to build
+    aliasTables = {}
+    for pos, groupName in enumerate(vocab["choiceGroups"]):
+        start, end = starts[pos], starts[pos + 1]
+        aliasTables[groupName] = MappingProxyType({"ids": sections["probabilities.id"][start:end], "weights": sections["probabilities.probability"][start:end],
+                                                   "prob": sections["probabilities.prob"][start:end], "alias": sections["probabilities.alias"][start:end]})
+    vocab["aliasTables"] = MappingProxyType(aliasTables)
+
+    return MappingProxyType(vocab)
+
+
+
+def ReadSections(fileMap, path):
+    """Check a mapped vocabulary file's header and return a dictionary of section name => memoryview of that section's array."""
+    if byteorder != "little":
+        raise ValueError("vocabulary files are little-endian, so they can only be compiled and read on little-endian machines")
+    if len(fileMap) < HEADER.size:
+        raise ValueError(path + " isn't a Hallmark vocabulary file")
+
+    magic, version, sectionCount = HEADER.unpack_from(fileMap, 0)
+    if magic != FILE_MAGIC:
+        raise ValueError(path + " isn't a Hallmark vocabulary file")
+    if version != FORMAT_VERSION:
+        raise ValueError(path + " is in format version " + str(version) + ", not " + str(FORMAT_VERSION) + ". Compile it again")
+
+    fileView = memoryview(fileMap)
+    sections = {}
+    for i in range(sectionCount):
+        name, typecode, offset, length = SECTION_ENTRY.unpack_from(fileMap, HEADER.size + SECTION_ENTRY.size * i)
+        if offset + length > len(fileMap):
+            raise ValueError(path + " is cut short. Compile it again")
+        sections[name.rstrip(b"\x00").decode("ascii")] = fileView[offset:offset + length].cast(typecode.rstrip(b"\x00").decode("ascii"))
+
+    return sections
+
+
+
+def GetID(value):
+    """Return an ID read from an ID section, or None for NO_ID."""
+    return None if value == NO_ID else value
+
+
+
+class StringTable:
+    """Every string in a vocabulary file, by number."""
+
+    def __init__(self, blob, offsets, hashSlots):
+        self.blob = blob
+        self.offsets = offsets
+        self.hashSlots = hashSlots
+        self.mask = len(hashSlots) - 1
+
+
+    def Get(self, number):
+        """Return string number n, or None for NO_STRING."""
+        if number == NO_STRING:
+            return None
+        return str(self.blob[self.offsets[number]:self.offsets[number + 1]], "utf-8")
+
+
+    def Find(self, string):
+        """Return the number of a string, or NO_STRING if it isn't in the file."""
+        if not isinstance(string, str):
+            return NO_STRING
+        target = string.encode("utf-8", "surrogatepass")
+
+        slot = zlib.crc32(target) & self.mask
+        while True:
+            number = self.hashSlots[slot]
+            if number == NO_STRING or self.blob[self.offsets[number]:self.offsets[number + 1]] == target:
+                return number
+            slot = (slot + 1) & self.mask
+
+
+
+class IntKeyCodec:
+    """Keys which are IDs, stored as they are."""
+
+    def Encode(self, key):
+        return key if isinstance(key, int) else None
+
+
+    def Decode(self, value):
+        return value
+
+
+
+class StringKeyCodec:
+    """Keys which are strings, stored as their numbers."""
+
+    def __init__(self, strings):
+        self.strings = strings
+
+
+    def Encode(self, key):
+        number = self.strings.Find(key)
+        return None if number == NO_STRING else number
+
+
+    def Decode(self, value):
+        return self.strings.Get(value)
+
+
+
+class PairKeyCodec:
+    """Keys which are a pair of strings (e.g. the verbs' (infinitive, subject pronoun)), stored as one number made from both numbers."""
+
+    def __init__(self, strings):
+        self.strings = strings
+
+
+    def Encode(self, key):
+        if not isinstance(key, tuple) or len(key) != 2:
+            return None
+        first, second = self.strings.Find(key[0]), self.strings.Find(key[1])
+        if first == NO_STRING or second == NO_STRING:
+            return None
+        return (first << 32) | second
+
+
+    def Decode(self, value):
+        return (self.strings.Get(value >> 32), self.strings.Get(value & 0xFFFFFFFF))
+
+
+
+class CompiledMapping(Mapping):
+    """A read-only dictionary whose keys are a sorted array in a vocabulary file. Looking up a key is a binary search."""
+
+    def __init__(self, keyArray, keyCodec, GetValue, keepValues=False):
+        """Keyword arguments:
+        keyArray -- the sorted, encoded keys
+        keyCodec -- turns keys into the numbers in keyArray and back
+        GetValue -- function taking a key's position in keyArray and returning its value
+        keepValues -- optional. True = make each value once and keep it, so the same key always gives the same object (e.g. a list
+                      of probabilities records, which the alias table cache checks for)
+        """
+        self.keyArray = keyArray
+        self.keyCodec = keyCodec
+        self.GetValue = GetValue
+        self.keptValues = {} if keepValues else None
+
+
+    def __getitem__(self, key):
+        encoded = self.keyCodec.Encode(key)
+        if encoded != None:
+            pos = bisect.bisect_left(self.keyArray, encoded)
+            if pos < len(self.keyArray) and self.keyArray[pos] == encoded:
+                if self.keptValues == None:
+                    return self.GetValue(pos)
+                if pos not in self.keptValues:
+                    self.keptValues[pos] = self.GetValue(pos)
+                return self.keptValues[pos]
+
+        raise KeyError(key)
+
+
+    def __iter__(self):
+        return (self.keyCodec.Decode(value) for value in self.keyArray)
+
+
+    def __len__(self):
+        return len(self.keyArray)
+
+
+
+class CompiledSequence(Sequence):
+    """A read-only list whose items are made from a vocabulary file as they're asked for."""
+
+    def __init__(self, length, GetItem):
+        """Keyword arguments:
+        length -- the number of items
+        GetItem -- function taking a position and returning the item there
+        """
+        self.length = length
+        self.GetItem = GetItem
+
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return tuple(self.GetItem(i) for i in range(*pos.indices(self.length)))
+        if pos < 0:
+            pos += self.length
+        if pos < 0 or pos >= self.length:
+            raise IndexError("vocabulary list index out of range")
+        return self.GetItem(pos)
+
+
+    def __len__(self):
+        return self.length
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# Process-wide pool of read-only connections to hallmark.db, shared by every thread
+import atexit
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from storage import OpenStorage
+
+
+# Declare some globals
+DATABASE_PATH = "hallmark.db"
+DEFAULT_POOL_SIZE = 8
+
+# How long (in seconds) a thread will wait for a connection when they're all in use
+CHECKOUT_TIMEOUT = 10
+
+_pool = {"path": DATABASE_PATH, "size": DEFAULT_POOL_SIZE, "idle": queue.LifoQueue(), "opened": [], "closed": False}
+_poolLock = threading.Lock()
+_local = threading.local()
+
+
+
+def PoolConnection(dbPath):
+    """Return a new read-only connection for the pool, from the storage backend in use (see storage.OpenStorage). Its execute method
+    behaves like the CS50 Library's, for SELECT queries, and records the query if the thread is tracing."""
+    return OpenStorage(dbPath, readOnly=True)
+
+
+
+
+def ConfigurePool(dbPath=DATABASE_PATH, poolSize=DEFAULT_POOL_SIZE):
+    """Set the database and the maximum number of connections, closing any connections opened with the old settings.
+
+    Keyword arguments:
+    dbPath -- the path to the SQLite database file
+    poolSize -- the maximum number of connections open at once
+    """
+    if poolSize < 1:
+        raise ValueError("poolSize must be at least 1")
+
+    ClosePool()
+    with _poolLock:
+        _pool["path"] = dbPath
+        _pool["size"] = poolSize
+        _pool["idle"] = queue.LifoQueue()
+        _pool["opened"] = []
+        _pool["closed"] = False
+
+
+
+
+def GetDatabasePath():
+    """Return the path to the database used by the pool."""
+    return _pool["path"]
+
+
+
+
+def GetConnection():
+    """Return this thread's connection, checking one out of the pool if the thread doesn't have one yet.
+
+    Connections are opened lazily, up to the pool size. After that, wait for another thread to release one.
+    """
+    db = getattr(_local, "connection", None)
+    if db != None:
+        return db
+
+    if _pool["closed"]:
+        raise RuntimeError("The connection pool has been shut down")
+
+    # Prefer an idle connection. If there aren't any and there's room in the pool, open a new one
+    try:
+        db = _pool["idle"].get_nowait()
+    except queue.Empty:
+        with _poolLock:
+            if len(_pool["opened"]) < _pool["size"]:
+                db = PoolConnection(_pool["path"])
+                _pool["opened"].append(db)
+
+        if db == None:
+            try:
+                db = _pool["idle"].get(timeout=CHECKOUT_TIMEOUT)
+            except queue.Empty:
+                raise RuntimeError("Timed out waiting for a database connection")
+
+    # Idle connections can go stale (e.g. if the database file was replaced), so check it before handing it over
+    if not ConnectionIsHealthy(db):
+        db = ReplaceConnection(db)
+
+    _local.connection = db
+    return db
+
+
+
+
+def ReleaseConnection():
+    """Return this thread's connection (if it has one) to the pool."""
+    db = getattr(_local, "connection", None)
+    if db == None:
+        return
+
+    _local.connection = None
+
+    # After shutdown, nothing goes back into the pool
+    if _pool["closed"] or db not in _pool["opened"]:
+        db.close()
+    else:
+        _pool["idle"].put(db)
+
+
+
+
+@contextmanager
+def PooledConnection():
+    """Provide this thread's connection for a with block, returning it to the pool afterwards if it was checked out for the block."""
+    alreadyHeld = getattr(_local, "connection", None) != None
+    db = GetConnection()
+    try:
+        yield db
+    finally:
+        if not alreadyHeld:
+            ReleaseConnection()
+
+
+
+
+def ConnectionIsHealthy(db):
+    """Return boolean indicating if a connection can still run queries."""
+    # Ask the backend's own connection, so the check isn't recorded as one of the thread's queries. Each backend fails differently
+    try:
+        db.connection.execute("SELECT 1")
+        return True
+    except Exception:
+        return False
+
+
+
+
+def ReplaceConnection(db):
+    """Close a broken connection and return a new one in its place."""
+    try:
+        db.close()
+    except sqlite3.Error:
+        pass
+
+    newDb = PoolConnection(_pool["path"])
+    with _poolLock:
+        if db in _pool["opened"]:
+            _pool["opened"].remove(db)
+        _pool["opened"].append(newDb)
+
+    return newDb
+
+
+
+
+def ClosePool():
+    """Close every connection in the pool. Connections still checked out are closed when they're released."""
+    with _poolLock:
+        _pool["closed"] = True
+        while True:
+            try:
+                _pool["idle"].get_nowait().close()
+            except queue.Empty:
+                break
+
+
+
+
+def GetPoolStats():
+    """Return a dictionary describing the state of the pool."""
+    stats = {}
+    stats["size"] = _pool["size"]
+    stats["opened"] = len(_pool["opened"])
+    stats["idle"] = _pool["idle"].qsize()
+    stats["closed"] = _pool["closed"]
+    return stats
+
+
+
+# Make sure every connection is closed when the process exits
+atexit.register(ClosePool)
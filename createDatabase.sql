@@ -128,6 +128,35 @@ CREATE TABLE wordsToTitles(
         REFERENCES titleTemplates(id)
 );
 
+-- What "python import.py --sync" imported last time: a hash of each source file and section, the facts each section adds,
+-- and how many of each section's facts add or rely on each record (including links)
+CREATE TABLE syncFiles(
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    hash TEXT NOT NULL
+);
+
+CREATE TABLE syncSections(
+    id INTEGER PRIMARY KEY,
+    syncFiles_id INTEGER NOT NULL,
+    tableName TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    facts TEXT NOT NULL,
+    FOREIGN KEY(syncFiles_id)
+        REFERENCES syncFiles(id)
+);
+
+CREATE TABLE syncRecords(
+    id INTEGER PRIMARY KEY,
+    syncSections_id INTEGER NOT NULL,
+    tableName TEXT NOT NULL,
+    name TEXT NOT NULL,
+    optional INTEGER NOT NULL,
+    uses INTEGER NOT NULL,
+    FOREIGN KEY(syncSections_id)
+        REFERENCES syncSections(id)
+);
+
 -- Create indexes for hallmark.db
 CREATE INDEX words_index ON words(id, display, categories_id);
 CREATE INDEX ctp_index ON charactersToPronouns(character_id);
@@ -137,4 +166,22 @@ CREATE INDEX verb_index ON verbs(infinitives_id, pronounGroups_id);
 CREATE INDEX inf_index ON infinitives(name);
 CREATE INDEX probs_index ON probabilities(id);
 CREATE INDEX cg_index ON choiceGroups(name);
-CREATE INDEX img_index ON images(name);
\ No newline at end of file
+CREATE INDEX img_index ON images(name);
+CREATE INDEX syncRecords_section ON syncRecords(syncSections_id);
+CREATE UNIQUE INDEX syncRecords_record ON syncRecords(tableName, name, optional, syncSections_id);
+
+-- Unique indexes, so bulk imports can use INSERT OR IGNORE
+CREATE UNIQUE INDEX categories_unique ON categories(name);
+CREATE UNIQUE INDEX choiceGroups_unique ON choiceGroups(name);
+CREATE UNIQUE INDEX infinitives_unique ON infinitives(name);
+CREATE UNIQUE INDEX pronounGroups_unique ON pronounGroups(name);
+CREATE UNIQUE INDEX images_unique ON images(name);
+CREATE UNIQUE INDEX titleTemplates_unique ON titleTemplates(titleTemplate);
+CREATE UNIQUE INDEX words_unique ON words(categories_id, display);
+CREATE UNIQUE INDEX pronounGroupMembers_unique ON pronounGroupMembers(group_id, pronoun_id);
+CREATE UNIQUE INDEX pronounSets_unique ON pronounSets(subjectPronoun_id, objectPronoun_id);
+CREATE UNIQUE INDEX verbs_unique ON verbs(infinitives_id, pronounGroups_id, result_id);
+CREATE UNIQUE INDEX charactersToPronouns_unique ON charactersToPronouns(character_id, subjectPronoun_id);
+CREATE UNIQUE INDEX charactersToHometowns_unique ON charactersToHometowns(character_id, location_id);
+CREATE UNIQUE INDEX wordsToImages_unique ON wordsToImages(words_id, images_id);
+CREATE UNIQUE INDEX wordsToTitles_unique ON wordsToTitles(words_id, titleTemplates_id);
@@ -1,81 +1,299 @@
 # Generates an alternative plot for a Hallmark movie
-import cs50
-import re
-from sys import exit
 import random
 from collections import deque
-import math
-from cs50 import SQL
+from collections.abc import Sequence
+from metrics import TimedStage, CountFallback
+from plotCodec import EncodeDigits, CreateDigitReader, ReadDigit, ReaderIsFinished, EncodeBase62, DecodeBase62
+from plotTemplate import OPEN_TAG, CLOSE_TAG, CompileTemplate, RenderTemplate
+from substringMatcher import BuildMatcher, FindMatches
+from vocabulary import GetVocabulary
+
+# NumPy is only needed for batch generation, so the web app can run without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 # Declare some globals
-OPEN_TAG = "#["
-CLOSE_TAG = "]#"
 VOWELS = "aeiou"
 
+# The actual plot of all Hallmark movies, with #[...]# tags around the changeable parts.
+BASE_PLOT = "#[]#an attractive young <strong>#[woman]#</strong> #[works]# hard in <strong>#[a well-paid and professional]#</strong> job in the big city, " \
+            "until circumstances require #[her]# to return to the <strong>#[small town]#</strong> where #[she]# grew up. There #[she]# " \
+            "#[meets]# <strong>#[an attractive young man]#</strong> who teaches #[her]# the true meaning of <strong>#[Christmas]#</strong>."
+
+# List with one element for each #[...]# tag, containing the dictionary key that must go inside.
+TAG_CONTENTS = ["bees", "mainChar", "work/s", "jobDesc", "pronounObj", "hometown", "pronounSubj", "pronounSubj", "meet/s", "lifeguide", "pronounObj", "topic"]
+
+# Every key GetVariables puts in the dictionary of variables
+PLOT_KEYS = ("bees", "mainChar", "hometown", "pronounObj", "pronounSubj", "work/s", "meet/s", "jobDesc", "lifeguide", "topic")
+
+# The base plot, parsed once. A mistake in TAG_CONTENTS stops the module from loading, rather than turning up in a plot
+PLOT_TEMPLATE = CompileTemplate(BASE_PLOT, TAG_CONTENTS, PLOT_KEYS)
+
+# List of slots which can have pics assigned, in priority order, and some default pics to return if this goes horribly wrong
+PIC_SLOTS = ("bees", "mainChar", "lifeguide", "topic", "jobDesc")
+DEFAULT_PICS = ("default0.png", "default1.png", "default2.png")
+
+# Display text for a words ID that doesn't exist
+MISSING_WORDS = "- KABOOM! -"
+
+# Placeholder for the topic in title templates
+TOPIC_PLACEHOLDER = "#[topic]#"
+
+# Compiled lifeguide prefixes, keyed by the prefix string. See GetPrefixTemplate
+_prefixTemplates = {}
+
+# Alias tables for each choice group, built on first use. See GetAliasTable
+_aliasTables = {}
+
+# NumPy versions of the vocabulary for batch generation, built on first use. See GetBatchArrays
+_batchArrays = {}
 
+# Index for looking up the images for a plot, built on first use. See GetImageIndex
+_imageIndex = {}
 
-def GetHallmarkSettings(defaultWanted):
+# Index for looking up the title templates for a plot, built on first use. See GetTitleIndex
+_titleIndex = {}
+
+# Length of the longest plot ID the vocabulary allows, worked out on first use. See GetPlotIDLength
+_plotIDLength = {}
+
+
+
+def GetHallmarkSettings(defaultWanted, rng=None):
     """Output a sentence resembling the plot of a Hallmark movie.
     
     Keyword arguments:
     defaultWanted -- boolean. True = return plot, image and title for the normal Hallmark plot; False = return modified plot, images and titles
+    rng -- optional. A random.Random instance, or a seed for one. The same seed always gives the same settings (for the same vocabulary). None = use the random module
+
+    As well as the plot, images and titles, the result has a "plotID": a short string which RenderPlot can turn back into the same settings.
     """
-    # Configure CS50 Library to use SQLite database
-    db = SQL("sqlite:///hallmark.db")
-    
-    # Begin with the actual plot of all Hallmark movies, with #[...]# tags around the changeable parts.
-    basePlot = "#[]#an attractive young <strong>#[woman]#</strong> #[works]# hard in <strong>#[a well-paid and professional]#</strong> job in the big city, "
-    basePlot += "until circumstances require #[her]# to return to the <strong>#[small town]#</strong> where #[she]# grew up. There #[she]# "
-    basePlot += "#[meets]# <strong>#[an attractive young man]#</strong> who teaches #[her]# the true meaning of <strong>#[Christmas]#</strong>."
+    # All the words, grammar and settings come from the in-memory vocabulary, so generating a plot doesn't touch the database
+    vocab = GetVocabulary()
 
     # If the default was requested, we want the base plot (only without the tags) and a mostly empty varDict
     if defaultWanted:
         varDict = {}
         varDict["dictName"] = "original"
-        myPlot = basePlot.replace(OPEN_TAG, "").replace(CLOSE_TAG, "")
+        return BuildSettings(vocab, varDict, PLOT_TEMPLATE["default"], None)
+
+    # Otherwise put together a, dare I say, significantly more interesting alternative plot.
+    # Create a dictionary of variables to go inside the tags, noting each choice so they can be packed into an ID
+    chooser = RandomChooser(GetRandom(rng))
+    varDict = GetVariables(vocab, chooser)
+    return BuildSettings(vocab, varDict, RenderTemplate(PLOT_TEMPLATE, varDict), EncodeDigits(chooser.digits))
+
+
 
-    # Otherwise put together a, dare I say, significantly more interesting alternative plot
-    else:
-        # List with one element for each #[...]# tag, containing the dictionary key that must go inside.
-        tagContents = ["bees", "mainChar", "work/s", "jobDesc", "pronounObj", "hometown", "pronounSubj", "pronounSubj", "meet/s", "lifeguide", "pronounObj", "topic"]
 
-        # Split up the base plot, create a dictionary of variables to go inside the tags, then put it all together
-        basePlotList = SplitTaggedStr(basePlot)
-        varDict = GetVariables(db)
-        myPlot = GetNewPlot(basePlotList, tagContents, varDict)
+def RenderPlot(plotID):
+    """Return the settings for the plot with this ID, the same as GetHallmarkSettings returned when the plot was first generated.
+
+    Keyword arguments:
+    plotID -- a plot ID, either the string from GetHallmarkSettings or the integer it encodes
+
+    The choices are read straight out of the ID, so there's no random sampling. IDs only hold for the vocabulary they were made with:
+    raise ValueError if the ID isn't valid for the current one.
+    """
+    vocab = GetVocabulary()
+    if isinstance(plotID, str):
+        plotID = ParsePlotID(vocab, plotID)
+
+    chooser = IDChooser(plotID)
+    varDict = GetVariables(vocab, chooser)
+    if not chooser.IsFinished():
+        raise ValueError("Not a valid plot ID for the current vocabulary: " + str(plotID))
+
+    return BuildSettings(vocab, varDict, RenderTemplate(PLOT_TEMPLATE, varDict), plotID)
+
+
+
+
+def ParsePlotID(vocab, plotID):
+    """Return the integer for a plot ID string from GetHallmarkSettings.
+
+    Raise ValueError if it's longer than any plot ID for the vocabulary could be, or isn't exactly the string EncodeBase62 makes
+    (e.g. it has leading zeros), so each plot has only one ID string.
+    """
+    value = DecodeBase62(plotID, GetPlotIDLength(vocab))
+    if EncodeBase62(value) != plotID:
+        raise ValueError("Not a plot ID: " + plotID)
+
+    return value
+
+
+
+
+def GetPlotIDLength(vocab):
+    """Return the number of characters in the longest plot ID the vocabulary allows, working it out the first time it's needed.
+
+    Every choice GetVariables makes is counted at the most options it could ever have, so no plot ID is any longer than this.
+    Like the alias tables, the length is cached against the vocabulary and worked out again when it's reloaded.
+    """
+    if _plotIDLength.get("vocab") is vocab:
+        return _plotIDLength["length"]
 
-    # Declare a dictionary to hold the results and populate it
+    def MostOptions(lists):
+        return max([len(thisList) for thisList in lists], default=1)
+
+    def GroupSize(choiceGroupName):
+        return len(vocab["choiceGroups"].get(choiceGroupName, ())) or 1
+
+    # The character block: main character (maybe from any valid character), bee twist, then the working character's pronoun and hometown
+    limit = GroupSize("mainChar") * max(1, len(vocab["mainCharCandidates"])) * GroupSize("toBeeOrNotToBee")
+    limit *= max(1, MostOptions(vocab["characterPronouns"].values())) * max(1, MostOptions(vocab["characterHometowns"].values()))
+
+    # Job description, then the lifeguide record with the most options for its prefix and guide, then the topic
+    limit *= GroupSize("jobDesc") * GroupSize("lifeguide")
+    mostLifeguides = 1
+    for record in vocab["choiceGroups"].get("lifeguide", ()):
+        lifeguides = max(1, len(vocab["categoryIDWords"].get(record["categories_id"], ())))
+        if record["prefixStr"] != None and record["prefixStr"] != "":
+            for pos, categoryName in GetPrefixTemplate(record["prefixStr"])["slots"]:
+                lifeguides *= max(1, len(vocab["categoryWords"].get(categoryName, ())))
+        mostLifeguides = max(mostLifeguides, lifeguides)
+
+    limit *= mostLifeguides * max(1, len(vocab["categoryWords"].get("topic", ())))
+
+    _plotIDLength["length"] = len(EncodeBase62(limit - 1))
+    _plotIDLength["vocab"] = vocab
+    return _plotIDLength["length"]
+
+
+
+
+@TimedStage()
+def BuildSettings(vocab, varDict, myPlot, plotID):
+    """Return the dictionary of settings for a plot, given its variables, its untidied sentence and its plot ID (an integer, or None for the original)."""
+    # Titles are shuffled using the plot ID, so rebuilding a plot from its ID puts them in the same order too
     result = {}
     result["plot"] = TidyUpString(myPlot)
-    result["images"] = GetValidImages(db, varDict)
-    result["titles"] = GetValidTitles(db, varDict)
+    result["images"] = GetValidImages(vocab, varDict)
+    if plotID == None:
+        result["titles"] = GetValidTitles(vocab, varDict)
+        result["plotID"] = None
+    else:
+        result["titles"] = GetValidTitles(vocab, varDict, random.Random(plotID))
+        result["plotID"] = EncodeBase62(plotID)
 
     return result
 
 
 
 
-def SplitTaggedStr(taggedStr):
-    """Split up the base string via the #[...]# tags, so we can edit in some new bits."""
-    # re.split uses "[" and "]", so for this to work it's necessary to insert the escape character inside the tags.
-    # Just the open tag is sufficient (the "]" in the close tag doesn't cause any problems once the open tag's "[" is escaped. I assume due to it being unpaired)
-    escOpenTag = OPEN_TAG[0] + "\\" + OPEN_TAG[1]
-    splitStrArr = re.split(escOpenTag + "|" + CLOSE_TAG, taggedStr)
-    return splitStrArr
+@TimedStage()
+def GetHallmarkSettingsBatch(n, rng=None):
+    """Output a list of n modified Hallmark plots, each in the same format as GetHallmarkSettings(False). Requires NumPy.
+
+    Every slot is drawn for all n plots at once, as a vector, then the slots which depend on others
+    (pronouns and verbs on the character; hometowns on the character) are looked up by indexing into arrays.
+
+    Keyword arguments:
+    n -- the number of plots wanted.
+    rng -- optional. A NumPy random Generator, or a seed for one. None = a freshly seeded Generator
+
+    Each choice is noted down as it's drawn, so every plot gets the same plot ID as GetHallmarkSettings would give it, and RenderPlot
+    rebuilds it from that ID. As in BuildSettings, each plot's titles are shuffled with a random.Random of their own, seeded with the
+    plot ID, so they're settled when the plot is generated, whatever order the plots' titles are read in.
+    """
+    if np == None:
+        raise RuntimeError("GetHallmarkSettingsBatch requires NumPy")
+
+    vocab = GetVocabulary()
+    rng = np.random.default_rng(rng)
+
+    # Assemble each plot from its column of variables
+    varDicts, plotIDs = GetVariablesBatch(vocab, n, rng)
+    return [BuildSettings(vocab, varDict, RenderTemplate(PLOT_TEMPLATE, varDict), plotID) for varDict, plotID in zip(varDicts, plotIDs)]
+
+
 
 
+def GetHallmarkSettingsChunks(n, chunkSize, seed=None):
+    """Yield n sets of modified Hallmark settings, as lists of up to chunkSize at a time, so callers never need to hold all n at once.
+
+    Keyword arguments:
+    n -- the total number of settings wanted.
+    chunkSize -- the most settings to generate (and yield) at once.
+    seed -- optional. The same seed (and chunkSize) always gives the same settings. None = unseeded
+
+    Uses GetHallmarkSettingsBatch when NumPy is available, otherwise GetHallmarkSettings(False) one at a time.
+    """
+    if np != None:
+        rng = np.random.default_rng(seed)
+    else:
+        rng = GetRandom(seed)
+
+    remaining = n
+    while remaining > 0:
+        thisChunk = min(chunkSize, remaining)
+        if np != None:
+            yield GetHallmarkSettingsBatch(thisChunk, rng)
+        else:
+            yield [GetHallmarkSettings(False, rng) for i in range(thisChunk)]
+        remaining -= thisChunk
+
 
 
-def GetVariables(db):
-    """Generate dictionary of variables for the Hallmark plot."""
+
+def GetRandom(rng):
+    """Return something to draw random numbers from: the random module for None, a new random.Random for a seed, or the argument itself."""
+    if rng == None:
+        return random
+    elif isinstance(rng, int):
+        return random.Random(rng)
+    else:
+        return rng
+
+
+
+
+@TimedStage()
+def GetVariables(vocab, chooser):
+    """Generate dictionary of variables for the Hallmark plot.
+
+    Keyword arguments:
+    vocab -- the Hallmark vocabulary
+    chooser -- a RandomChooser (to make a new plot) or an IDChooser (to rebuild the plot with that ID). Every choice goes through it, in the same order
+    """
+    # Create a dictionary containing each unique variable in the sentence, then populate it one independent block at a time
+    myVars = {}
+    myVars["dictName"] = "v2.0"
+    for blockName, GetBlockVariables in GetVariableBlocks():
+        myVars.update(GetBlockVariables(vocab, chooser))
+
+    return myVars
+
+
+
+
+def GetVariableBlocks():
+    """Return a tuple of (name, function) pairs, in the order GetVariables uses them.
+
+    Each function takes (vocab, chooser) and returns a dictionary of some of the plot's variables. None of the blocks' choices
+    depend on another block, which is what lets plotSpace work out the distribution of each block separately.
+    """
+    return (("character", GetCharacterVariables),
+            ("jobDesc", lambda vocab, chooser: {"jobDesc": GetJobDesc(vocab, chooser)}),
+            ("lifeguide", lambda vocab, chooser: {"lifeguide": GetLifeguide(vocab, chooser)}),
+            ("topic", lambda vocab, chooser: {"topic": GetTopic(vocab, chooser)}))
+
+
+
+
+@TimedStage()
+def GetCharacterVariables(vocab, chooser):
+    """Return a dictionary of the variables which depend on the main character: bees, mainChar, hometown, pronouns and verbs."""
     # The main character affects some grammar and the hometown, so settle on the main character first
-    mainCharID = GetMainCharID(db)
+    mainCharID = GetMainCharID(vocab, chooser)
     
     # Check if the "main char is actually a swarm of bees assuming a shape" plot twist is active and assign workingID accordingly
-    beeID = ProbabilitiesPick(db, "toBeeOrNotToBee")[0]["words_id"]
+    beeID = ProbabilitiesPick(vocab, "toBeeOrNotToBee", chooser)[0]["words_id"]
     if beeID != None:
-        beeStr = GetWords(db, beeID)
+        beeStr = GetWords(vocab, beeID)
     else:
         beeStr = " "
 
@@ -86,60 +304,310 @@ def GetVariables(db):
 
     # The subject pronoun is used as an argument for verbs and object pronouns
     # Get that next, so you don't need to worry about the order in which you populate the variables below
-    subjectPronoun = GetSubjectPronoun(db, workingID)
+    subjectPronoun = GetSubjectPronoun(vocab, workingID, chooser)
 
-    # Create a dictionary containing each unique variable in the sentence, then populate it
     myVars = {}
-    myVars["dictName"] = "v2.0"
     myVars["bees"] = beeStr
-    myVars["mainChar"] = GetWords(db, mainCharID)
-    myVars["hometown"] = GetHometown(db, workingID)
-    myVars["pronounObj"] = GetObjectPronoun(db, subjectPronoun)
+    myVars["mainChar"] = GetWords(vocab, mainCharID)
+    myVars["hometown"] = GetHometown(vocab, workingID, chooser)
+    myVars["pronounObj"] = GetObjectPronoun(vocab, subjectPronoun)
     myVars["pronounSubj"] = subjectPronoun
-    myVars["work/s"] = ConjugateVerb(db, "to work", subjectPronoun)
-    myVars["meet/s"] = ConjugateVerb(db, "to meet", subjectPronoun)
-    myVars["jobDesc"] = GetJobDesc(db)
-    myVars["lifeguide"] = GetLifeguide(db)
-    myVars["topic"] = GetTopic(db)
+    myVars["work/s"] = ConjugateVerb(vocab, "to work", subjectPronoun)
+    myVars["meet/s"] = ConjugateVerb(vocab, "to meet", subjectPronoun)
 
     return myVars
 
 
 
 
-def GetNewPlot(originalAsList, keyForSlot, newWordsDict):
-    """Combine the original Hallmark plot (as a list) with the dictionary of replacement words, via a list matching dictionary keys to replacement slots.
-    
+@TimedStage()
+def GetVariablesBatch(vocab, n, rng):
+    """Generate n dictionaries of variables for Hallmark plots, drawing each slot for all n plots at once.
+    Return a list of the dictionaries and a list of their plot IDs (integers, as made by EncodeDigits).
+
     Keyword arguments:
-    originalAsList -- the "basePlot" as a list of strings, where odd indexes are to be replaced and evens are to be kept.
-    keyForSlot -- a list with one element for each "replacement slot", each containing the dictionary key to be inserted.
-    newWordsDict -- a dictionary of replacement words for the Hallmark plot.
+    vocab -- the Hallmark vocabulary
+    n -- the number of dictionaries wanted
+    rng -- a NumPy random Generator
+
+    Each draw is noted down as a digit for the plot IDs: a (rows, positions, radices) triple, in the same order GetVariables makes
+    its choices, so IDChooser reads the same choices back out. A radix of 1 (a choice of one) adds nothing to the ID.
     """
-    if len(keyForSlot) != int((len(originalAsList) - 1) / 2):
-        # Check there's a variable assigned to each slot.
-        # If there isn't, who knows what mess we have. Return an alternative plot.
-        return "ROCKS FALL; EVERYONE DIES. But before they die, they learn the true meaning of love."
+    arrays = GetBatchArrays(vocab)
+    allRows = slice(None)
+    digits = []
+
+    # Settle on the main characters first. Each draw is a position in the choice group's records, converted to a position in the character table
+    mainCharPos = AliasDrawBatch(arrays["mainChar"], n, rng)
+    mainChars = arrays["mainCharRecordChars"][mainCharPos]
+    digits.append((allRows, mainCharPos, len(arrays["mainChar"]["prob"])))
+
+    # Records with no words ID mean "select any valid word"
+    anyRows = np.flatnonzero(mainChars < 0)
+    mainChars[anyRows], candidatePos = RaggedPickBatch(arrays["candidateChars"], np.zeros(len(anyRows), dtype=np.int64), rng)
+    digits.append((anyRows, candidatePos, arrays["candidateChars"]["counts"][0]))
+
+    # Bee twist. Where it's active, the swarm of bees becomes the working character
+    beePos = AliasDrawBatch(arrays["toBeeOrNotToBee"], n, rng)
+    beeChars = arrays["beeRecordChars"][beePos]
+    workingChars = np.where(beeChars >= 0, beeChars, mainChars)
+    digits.append((allRows, beePos, len(arrays["toBeeOrNotToBee"]["prob"])))
+
+    # Pronouns and hometowns depend on the working character; object pronouns and verbs depend on the subject pronoun
+    pronouns, pronounPos = RaggedPickBatch(arrays["charPronouns"], workingChars, rng)
+    digits.append((allRows, pronounPos, arrays["charPronouns"]["counts"][workingChars]))
+    hometowns, hometownPos = RaggedPickBatch(arrays["charHometowns"], workingChars, rng)
+    digits.append((allRows, hometownPos, arrays["charHometowns"]["counts"][workingChars]))
+
+    jobDescPos = AliasDrawBatch(arrays["jobDesc"], n, rng)
+    digits.append((allRows, jobDescPos, len(arrays["jobDesc"]["prob"])))
+
+    # Lifeguides have a different prefix and category for each record, so build them one record at a time
+    lifeguidePos = AliasDrawBatch(arrays["lifeguide"], n, rng)
+    digits.append((allRows, lifeguidePos, len(arrays["lifeguide"]["prob"])))
+    lifeguides = np.full(n, "", dtype=object)
+    for recordPos, lifeguideParts in enumerate(arrays["lifeguideRecords"]):
+        rows = np.flatnonzero(lifeguidePos == recordPos)
+        if len(rows) == 0:
+            continue
+
+        if lifeguideParts != None:
+            lifeguides[rows], recordDigits = LifeguideBatch(lifeguideParts, len(rows), rng)
+
+        # GetLifeguide still fills in the prefix when there are no guides to pick from. The lifeguide comes out blank whatever
+        # the prefix's words are, so note the first of each
+        else:
+            recordDigits = [(np.zeros(len(rows), dtype=np.int64), radix) for radix in arrays["lifeguidePrefixRadices"][recordPos]]
 
-    # Loop through the list of possible replacements replacing the words
-    else:
-        myStr = ""
-        for i in range(len(keyForSlot)):
+        digits.extend((rows, positions, radix) for positions, radix in recordDigits)
 
-            # Original words list will have something to go in front of the replacement word/s, so add that to the string
-            myStr += originalAsList[i * 2]
+    topics, topicPos = RaggedPickBatch(arrays["topics"], np.zeros(n, dtype=np.int64), rng)
+    digits.append((allRows, topicPos, arrays["topics"]["counts"][0]))
 
-            # Add the replacement words
-            if newWordsDict[keyForSlot[i]] == "":
-                # "" means something went wrong. Fail gracefully by using the static text
-                myStr += originalAsList[i * 2 + 1]
-            else:
-                # Replace with the more interesting alternative
-                myStr += str(newWordsDict[keyForSlot[i]])
+    # Gather everything into columns, then turn the columns into one dictionary per plot
+    columns = {}
+    columns["bees"] = arrays["beeRecordStrs"][beePos]
+    columns["mainChar"] = arrays["charDisplays"][mainChars]
+    columns["hometown"] = hometowns
+    columns["pronounObj"] = arrays["pronounObj"][pronouns]
+    columns["pronounSubj"] = arrays["pronounSubj"][pronouns]
+    columns["work/s"] = arrays["work/s"][pronouns]
+    columns["meet/s"] = arrays["meet/s"][pronouns]
+    columns["jobDesc"] = arrays["jobDescRecordStrs"][jobDescPos]
+    columns["lifeguide"] = lifeguides
+    columns["topic"] = topics
 
-    # There's a fences-and-posts thing going on here, so add on the last "post" from the originalAsList
-    myStr += originalAsList[len(originalAsList)-1]
+    keys = list(columns)
+    varDicts = []
+    for values in zip(*(columns[key].tolist() for key in keys)):
+        myVars = dict(zip(keys, values))
+        myVars["dictName"] = "v2.0"
+        varDicts.append(myVars)
+
+    return varDicts, EncodeDigitsBatch(n, digits)
+
+
+
+
+def LifeguideBatch(lifeguideParts, m, rng):
+    """Return an array of m lifeguide strings for a single lifeguide probabilities record, and a list of the (positions, radix) pairs
+    picked along the way, in the order GetLifeguide picks them.
+
+    Keyword arguments:
+    lifeguideParts -- a dictionary from GetBatchArrays, with the prefix split into parts and an array of words for the category
+    m -- the number of lifeguides wanted
+    rng -- a NumPy random Generator
+    """
+    # Evens in the prefix are static text; odds are arrays of words to pick from (matching the parts of a compiled template)
+    lifeguides = np.full(m, "", dtype=object)
+    digits = []
+    for i, part in enumerate(lifeguideParts["prefix"]):
+        if i % 2 == 0:
+            lifeguides = lifeguides + part
+        else:
+            positions = rng.integers(0, len(part), m)
+            lifeguides = lifeguides + part[positions]
+            digits.append((positions, len(part)))
+
+    # Append the guide itself, then put a or an in front of it all
+    positions = rng.integers(0, len(lifeguideParts["guides"]), m)
+    lifeguides = lifeguides + " " + lifeguideParts["guides"][positions]
+    digits.append((positions, len(lifeguideParts["guides"])))
+    return np.frompyfunc(GetAOrAn, 1, 1)(lifeguides) + " " + lifeguides, digits
+
+
+
+
+def AliasDrawBatch(aliasArrays, n, rng):
+    """Return an array of n weighted random positions from an alias table stored as NumPy arrays: n dice rolls, then n coin flips."""
+    diceResults = rng.integers(0, len(aliasArrays["prob"]), n)
+    heads = rng.random(n) < aliasArrays["prob"][diceResults]
+    return np.where(heads, diceResults, aliasArrays["alias"][diceResults])
+
+
+
+
+def RaggedPickBatch(ragged, rows, rng):
+    """For each row number in 'rows', pick a random element from that row of a ragged array built by BuildRaggedArrays.
+    Return an array of the elements and an array of their positions in their rows."""
+    positions = (rng.random(len(rows)) * ragged["counts"][rows]).astype(np.int64)
+    return ragged["flat"][ragged["offsets"][rows] + positions], positions
 
-    return myStr
+
+
+
+def EncodeDigitsBatch(n, digits):
+    """Return a list of n plot IDs, packing each plot's digits the same way as EncodeDigits.
+
+    Keyword arguments:
+    n -- the number of plots
+    digits -- a list of (rows, positions, radices) triples, in the order they were chosen. rows picks out the plots the digit
+              belongs to (a slice or an array of row numbers); positions and radices are an array or a number for each of them
+    """
+    # Python integers, since an ID can outgrow 64 bits
+    values = np.zeros(n, dtype=object)
+    multipliers = np.ones(n, dtype=object)
+    for rows, positions, radices in digits:
+        values[rows] += np.asarray(positions, dtype=object) * multipliers[rows]
+        multipliers[rows] *= np.asarray(radices, dtype=object)
+
+    return [int(value) for value in values]
+
+
+
+
+def BuildRaggedArrays(lists, sentinel, dtype):
+    """Return a dictionary of NumPy arrays representing a list of lists, for picking from with RaggedPickBatch.
+
+    Keyword arguments:
+    lists -- a list of lists
+    sentinel -- the value to pick from an empty list
+    dtype -- the NumPy data type of the elements
+
+    The flat array begins with the sentinel. Empty lists are given a count of 1 and point at it.
+    """
+    flat = [sentinel]
+    offsets = []
+    counts = []
+    for thisList in lists:
+        if len(thisList) == 0:
+            offsets.append(0)
+            counts.append(1)
+        else:
+            offsets.append(len(flat))
+            counts.append(len(thisList))
+            flat.extend(thisList)
+
+    ragged = {}
+    ragged["flat"] = np.array(flat, dtype=dtype)
+    ragged["offsets"] = np.array(offsets, dtype=np.int64)
+    ragged["counts"] = np.array(counts, dtype=np.int64)
+    return ragged
+
+
+
+
+def GetBatchArrays(vocab):
+    """Return NumPy arrays describing the vocabulary for GetVariablesBatch, building them the first time they're needed.
+
+    Like the alias tables, the arrays are cached against the vocabulary and rebuilt when it's reloaded.
+    """
+    if _batchArrays.get("vocab") is vocab:
+        return _batchArrays["arrays"]
+
+    arrays = {}
+
+    # Alias tables for each choice group, with positions rather than IDs. A missing group behaves like ProbabilitiesPick's dummy record
+    groupRecords = {}
+    for groupName in ["toBeeOrNotToBee", "mainChar", "jobDesc", "lifeguide"]:
+        if groupName in vocab["choiceGroups"]:
+            groupRecords[groupName] = vocab["choiceGroups"][groupName]
+            aliasTable = GetAliasTable(vocab, groupName)
+            arrays[groupName] = {"prob": np.array(aliasTable["prob"], dtype=np.float64), "alias": np.array(aliasTable["alias"], dtype=np.int64)}
+        else:
+            groupRecords[groupName] = ({"words_id": None, "categories_id": None, "prefixStr": None},)
+            arrays[groupName] = {"prob": np.ones(1, dtype=np.float64), "alias": np.zeros(1, dtype=np.int64)}
+
+    # Bee twist: display text and working character for each record
+    beeStrs = []
+    for record in groupRecords["toBeeOrNotToBee"]:
+        beeStrs.append(" " if record["words_id"] == None else GetWords(vocab, record["words_id"]))
+
+    # Table of every character that can be picked. Position 0 is "no character", which behaves like GetMainCharID returning ""
+    charIDs = [""]
+    charIDs.extend(vocab["mainCharCandidates"])
+    charIDs.extend(r["words_id"] for r in groupRecords["mainChar"] if r["words_id"] != None and r["words_id"] not in charIDs)
+    charIDs.extend(r["words_id"] for r in groupRecords["toBeeOrNotToBee"] if r["words_id"] != None and r["words_id"] not in charIDs)
+    charPositions = {wid: pos for pos, wid in enumerate(charIDs)}
+
+    arrays["beeRecordStrs"] = np.array(beeStrs, dtype=object)
+    arrays["beeRecordChars"] = np.array([-1 if beeStr == " " else charPositions[r["words_id"]]
+                                         for r, beeStr in zip(groupRecords["toBeeOrNotToBee"], beeStrs)], dtype=np.int64)
+    arrays["mainCharRecordChars"] = np.array([-1 if r["words_id"] == None else charPositions[r["words_id"]]
+                                              for r in groupRecords["mainChar"]], dtype=np.int64)
+    arrays["candidateChars"] = BuildRaggedArrays([[charPositions[wid] for wid in vocab["mainCharCandidates"]]], 0, np.int64)
+    # Position 0 gets its fallback text directly (here and in the pronoun tables below), so building the tables doesn't count as using a fallback
+    arrays["charDisplays"] = np.array([MISSING_WORDS] + [GetWords(vocab, wid) for wid in charIDs[1:]], dtype=object)
+    arrays["charHometowns"] = BuildRaggedArrays([vocab["characterHometowns"].get(wid, ()) for wid in charIDs], "", object)
+
+    # Table of subject pronouns. Position 0 is "no pronoun", which leaves the default text in place
+    pronouns = [""]
+    for wid in charIDs:
+        pronouns.extend(p for p in vocab["characterPronouns"].get(wid, ()) if p not in pronouns)
+    pronounPositions = {p: pos for pos, p in enumerate(pronouns)}
+
+    arrays["charPronouns"] = BuildRaggedArrays([[pronounPositions[p] for p in vocab["characterPronouns"].get(wid, ())] for wid in charIDs], 0, np.int64)
+    arrays["pronounSubj"] = np.array(pronouns, dtype=object)
+    arrays["pronounObj"] = np.array([""] + [GetObjectPronoun(vocab, p) for p in pronouns[1:]], dtype=object)
+    arrays["work/s"] = np.array([""] + [ConjugateVerb(vocab, "to work", p) for p in pronouns[1:]], dtype=object)
+    arrays["meet/s"] = np.array([""] + [ConjugateVerb(vocab, "to meet", p) for p in pronouns[1:]], dtype=object)
+
+    # Job descriptions are fixed for each record, so the whole string can be prepared in advance
+    jobDescStrs = []
+    for record in groupRecords["jobDesc"]:
+        if record["words_id"] == None:
+            jobDescStrs.append("")
+        else:
+            myDesc = GetWords(vocab, record["words_id"])
+            jobDescStrs.append(GetAOrAn(myDesc) + " " + myDesc)
+
+    arrays["jobDescRecordStrs"] = np.array(jobDescStrs, dtype=object)
+
+    # Lifeguides: for each record, the prefix split into static text and arrays of words, plus an array of guides. None = return "".
+    # Also the number of words for each of the prefix's slots, which GetLifeguide picks from even when it returns ""
+    lifeguideRecords = []
+    lifeguidePrefixRadices = []
+    for record in groupRecords["lifeguide"]:
+        if record["prefixStr"] != None and record["prefixStr"] != "":
+            lifeguidePrefixRadices.append([max(1, len(vocab["categoryWords"].get(categoryName, ()))) for pos, categoryName in GetPrefixTemplate(record["prefixStr"])["slots"]])
+        else:
+            lifeguidePrefixRadices.append([])
+
+        guides = vocab["categoryIDWords"].get(record["categories_id"], ())
+        if record["categories_id"] == None or len(guides) == 0:
+            lifeguideRecords.append(None)
+            continue
+
+        # Evens in the prefix are static text and odds are arrays of words. A missing category becomes static text, as in HandlePrefix
+        lifeguideParts = {"prefix": [""], "guides": np.array(guides, dtype=object)}
+        if record["prefixStr"] != None and record["prefixStr"] != "":
+            for i, part in enumerate(GetPrefixTemplate(record["prefixStr"])["parts"]):
+                if i % 2 == 0:
+                    lifeguideParts["prefix"][-1] += part
+                elif len(vocab["categoryWords"].get(part, ())) == 0:
+                    lifeguideParts["prefix"][-1] += "happy"
+                else:
+                    lifeguideParts["prefix"].extend([np.array(vocab["categoryWords"][part], dtype=object), ""])
+
+        lifeguideRecords.append(lifeguideParts)
+
+    arrays["lifeguideRecords"] = lifeguideRecords
+    arrays["lifeguidePrefixRadices"] = lifeguidePrefixRadices
+    arrays["topics"] = BuildRaggedArrays([vocab["categoryWords"].get("topic", ())], "", object)
+
+    _batchArrays["arrays"] = arrays
+    _batchArrays["vocab"] = vocab
+    return arrays
 
 
 
@@ -147,81 +615,109 @@ def GetNewPlot(originalAsList, keyForSlot, newWordsDict):
 def TidyUpString(myStr):
     """Format the sentence. Get rid of leading and trailing spaces, remove tags, capitalise the first letter of the first word."""
     myStr = myStr.strip()
-    myArr = myStr.split(" ")
-    myArr[0] = myArr[0].capitalize()
 
-    # Put it back together, including all the spaces we lost
-    myStr = " ".join(elem for elem in myArr)
+    # Only the first word needs to change, so capitalise that and leave the rest of the string alone
+    firstSpace = myStr.find(" ")
+    if firstSpace == -1:
+        myStr = myStr.capitalize()
+    else:
+        myStr = myStr[:firstSpace].capitalize() + myStr[firstSpace:]
 
-    # Remove any tags that still remain
-    myStr = myStr.replace(OPEN_TAG, "").replace(CLOSE_TAG, "")
+    # Remove any tags that still remain. Compiled templates don't leave any behind, so this is usually skipped
+    if OPEN_TAG in myStr or CLOSE_TAG in myStr:
+        myStr = myStr.replace(OPEN_TAG, "").replace(CLOSE_TAG, "")
 
     return myStr
 
 
 
-def GetValidImages(db, varDict):
+@TimedStage()
+def GetValidImages(vocab, varDict):
     """Make a prioritised list of all images which illustrate something in the new Hallmark plot."""
-    # Init the queryStr and the "validPics" list, plus setup some default pics to return if this goes horribly wrong
-    defaultPics = ["default0.png", "default1.png", "default2.png"]
+    imageIndex = GetImageIndex(vocab)
     validPics = []
-    queryStr = "SELECT i.filename, i.fextension FROM images i"
 
-    # If it's the original plot, lookup the details for the original overlay and return that
+    # If it's the original plot, lookup the details for the original overlay and return that. Failing that, return the defaults as a last resort
     if varDict["dictName"] == "original":
-
-        # Append text to look up the image based on the name
-        queryStr += " WHERE i.name = ?"
-
-        # Try to get the info from the database. Failing that, return the three hard-coded defaults as a last resort
-        try:
-            sqldata = db.execute(queryStr, varDict["dictName"])
-            validPics.append(sqldata[0]["filename"] + "." + sqldata[0]["fextension"])
-        except:
-            validPics.extend(defaultPics)
+        if imageIndex["original"] != None:
+            validPics.append(imageIndex["original"])
+        else:
+            CountFallback("missing_original_pic")
+            validPics.extend(DEFAULT_PICS)
 
     # Otherwise check all variables that can possibly affect the selected image and make a list of any images that come up
     else:
-        # List of slots which can have pics assigned, in priority order
-        picSlots = ["bees","mainChar","lifeguide","topic","jobDesc"]
-
-        # Append text to lookup the image based on the words
-        queryStr += " JOIN wordsToImages wti ON i.id = wti.images_id"
-        queryStr += " JOIN words w ON w.id = wti.words_id"
-
         # Loop through the list of relevant slots, obtaining any relevant context-sensitive images for each
         try:
-            for thisSlot in picSlots:
-                # Some lifeguide options contain irrelevant adjectives before the character. To handle those, use INSTR.
+            for thisSlot in PIC_SLOTS:
+                # Some lifeguide options contain irrelevant adjectives before the character. To handle those, look for the words anywhere in the text.
+                # If exactly one of the words is found, the lifeguide's pic is that word's pic (if it has exactly one)
                 if thisSlot == "lifeguide":
-                    loopQueryStr = queryStr + " WHERE INSTR(?, w.display) > 0"
+                    matches = FindMatches(imageIndex["matcher"], varDict[thisSlot])
+                    slotPic = imageIndex["matcherPics"][matches.pop()] if len(matches) == 1 else None
                 else:
-                    loopQueryStr = queryStr + " WHERE w.display = ?"
-                
-                # Lookup the image for the words. If there is one, store it in the list
-                sqldata = db.execute(loopQueryStr, varDict[thisSlot])
-                if len(sqldata) == 1:
-                    validPics.append(sqldata[0]["filename"] + "." + sqldata[0]["fextension"])
+                    slotPic = imageIndex["slotPics"].get(varDict[thisSlot])
 
-        except:
-            pass
+                # If there's an image for the words, store it in the list
+                if slotPic != None:
+                    validPics.append(slotPic)
 
-        # Try to add on the latest default pics from the database.
-        try:
-            sqldata = db.execute("SELECT i.filename, i.fextension FROM images i WHERE i.name LIKE 'default%'")
-            for i in range(0, len(sqldata)):
-                validPics.append(sqldata[i]["filename"] + "." + sqldata[i]["fextension"])
-        
-        # Failing that, add on the three hard-coded defaults as a last resort
         except:
-            validPics.extend(defaultPics)
+            CountFallback("image_lookup_error")
+
+        # Add on the defaults, which were settled when the index was built. A plot with no images of its own usually relies on
+        # them, which is fine unless the vocabulary had none and they're the hard-coded ones
+        if len(validPics) == 0 and imageIndex["defaults"] is DEFAULT_PICS:
+            CountFallback("builtin_default_pics")
+        validPics.extend(imageIndex["defaults"])
 
     return validPics
 
 
 
-def GetValidTitles(db, varDict):
-    """Make a shuffled list of titles relating to something in the new Hallmark plot."""
+
+def GetImageIndex(vocab):
+    """Return a dictionary for looking up the images for a plot, building it the first time it's needed.
+
+    Like the alias tables, the index is cached against the vocabulary and rebuilt when it's reloaded.
+
+    Keys in the returned dictionary:
+    slotPics -- words display text => filename, for words linked to exactly one image
+    matcher -- a substring matcher (see BuildMatcher) for the display text of every words record linked to an image
+    matcherPics -- for each pattern in the matcher, its filename (or None if it's linked to more than one image)
+    defaults -- tuple of filenames to append after the plot's own images
+    original -- the filename of the original plot's image, or None if there isn't one
+    """
+    if _imageIndex.get("vocab") is vocab:
+        return _imageIndex["index"]
+
+    displays = list(vocab["wordImages"])
+
+    imageIndex = {}
+    imageIndex["slotPics"] = {display: pics[0] for display, pics in vocab["wordImages"].items() if len(pics) == 1}
+    imageIndex["matcher"] = BuildMatcher(displays)
+    imageIndex["matcherPics"] = tuple(imageIndex["slotPics"].get(display) for display in displays)
+
+    # Use the latest default pics from the vocabulary. Failing that, use the three hard-coded defaults as a last resort
+    if len(vocab["defaultImages"]) > 0:
+        imageIndex["defaults"] = vocab["defaultImages"]
+    else:
+        imageIndex["defaults"] = DEFAULT_PICS
+
+    imageIndex["original"] = vocab["images"].get("original")
+
+    _imageIndex["index"] = imageIndex
+    _imageIndex["vocab"] = vocab
+    return imageIndex
+
+
+
+@TimedStage()
+def GetValidTitles(vocab, varDict, rng=random):
+    """Make a shuffled list of titles relating to something in the new Hallmark plot.
+
+    The list is a TitleList: titles are only shuffled into place and formatted as they're read, since usually only the first one is used.
+    """
     titleList = []   
     
     # If it's the original movie, return a single title
@@ -230,27 +726,25 @@ def GetValidTitles(db, varDict):
     
     # Otherwise return a list of suitable titles
     else:
-        # This query gets a list of titles. At the mo', titles are either:
+        # At the mo', titles are either:
         #   a) for any topic (so there is no words link, they just work for any title); b) for a specific hometown; c) special pun for bees; d) special pun for demons
-        queryStr = "SELECT t.titleTemplate FROM titleTemplates t"
-        queryStr += " LEFT JOIN wordsToTitles wtc ON wtc.titleTemplates_id = t.id"
-        queryStr += " LEFT JOIN words w ON wtc.words_id = w.id"
-        queryStr += " WHERE w.display IS NULL OR w.display = :hometown OR w.display = :bees OR INSTR(:lifeguide, w.display) > 0"
-        
-        # Populate the list
         try:
-            # Run the query to get the list of templates
-            templates = db.execute(queryStr, hometown=varDict["hometown"], bees=varDict["bees"], lifeguide=varDict["lifeguide"])
-    
-            # Loop through the templates replacing all instances of the "#[topic]#" placeholder with the actual topic
-            for i in range(0, len(templates)):
-                titleList.append(templates[i]["titleTemplate"].replace("#[topic]#", varDict["topic"]).title())
-    
-            # Now shuffle the list in a vague attempt to not always end up with the same titles
-            random.shuffle(titleList)
+            titleIndex = GetTitleIndex(vocab)
+
+            # Find every linked words record which appears in the plot. A set, so a template linked to one of them is only included once
+            plotDisplays = {titleIndex["displays"][pos] for pos in FindMatches(titleIndex["matcher"], varDict["lifeguide"])}
+            plotDisplays.update(display for display in (varDict["hometown"], varDict["bees"]) if display in titleIndex["linked"])
+
+            # Combine the templates for any topic with those for the words that were found
+            candidates = list(titleIndex["universal"])
+            for display in plotDisplays:
+                candidates.extend(titleIndex["linked"][display])
+
+            titleList = TitleList(candidates, varDict["topic"], rng)
             
         except:
             # If it all goes horribly wrong, here are some default titles that could apply to absolutely anything.
+            CountFallback("default_titles")
             titleList.append("Every Cloud Has A Silver Lining")
             titleList.append("Learning And Loving")
             titleList.append("Our Meaning Is What We Make")
@@ -259,11 +753,96 @@ def GetValidTitles(db, varDict):
 
 
 
-def GetMainCharID(db):
+
+class TitleList(Sequence):
+    """A shuffled list of titles for one plot, which shuffles and formats each title the first time it's read.
+
+    Reading titles from the start costs one random pick and one format per title, however many candidates there are.
+    """
+
+    def __init__(self, candidates, topic, rng=random):
+        """Keyword arguments:
+        candidates -- a list of title templates, each split around its "#[topic]#" placeholders (see GetTitleIndex). The list is shuffled in place
+        topic -- display text to replace the placeholders
+        rng -- the random.Random (or the random module) to shuffle with
+        """
+        self.candidates = candidates
+        self.topic = topic
+        self.rng = rng
+        self.titles = []
+
+
+    def __len__(self):
+        return len(self.candidates)
+
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("TitleList index out of range")
+
+        # Fisher-Yates, one step at a time: swap a random remaining candidate into the next position, then format it
+        while len(self.titles) <= i:
+            pos = len(self.titles)
+            swapPos = self.rng.randint(pos, len(self.candidates) - 1)
+            self.candidates[pos], self.candidates[swapPos] = self.candidates[swapPos], self.candidates[pos]
+            self.titles.append(self.topic.join(self.candidates[pos]).title())
+
+        return self.titles[i]
+
+
+    def __repr__(self):
+        return "TitleList(" + repr(list(self)) + ")"
+
+
+
+
+def GetTitleIndex(vocab):
+    """Return a dictionary for looking up the title templates for a plot, building it the first time it's needed.
+
+    Like the alias tables, the index is cached against the vocabulary and rebuilt when it's reloaded.
+    Each template is stored as a tuple of the text around its "#[topic]#" placeholders, ready for TitleList to join with the topic.
+
+    Keys in the returned dictionary:
+    universal -- tuple of the templates suitable for any plot
+    linked -- words display text => tuple of the templates linked to those words (once per link)
+    displays -- list of the display text in "linked"
+    matcher -- a substring matcher (see BuildMatcher) for "displays", to find the words in the lifeguide
+    """
+    if _titleIndex.get("vocab") is vocab:
+        return _titleIndex["index"]
+
+    universal = []
+    linked = {}
+    for template, display in vocab["titleTemplates"]:
+        splitTemplate = tuple(template.split(TOPIC_PLACEHOLDER))
+        if display == None:
+            universal.append(splitTemplate)
+        else:
+            linked.setdefault(display, []).append(splitTemplate)
+
+    titleIndex = {}
+    titleIndex["universal"] = tuple(universal)
+    titleIndex["linked"] = {display: tuple(templates) for display, templates in linked.items()}
+    titleIndex["displays"] = list(linked)
+    titleIndex["matcher"] = BuildMatcher(titleIndex["displays"])
+
+    _titleIndex["index"] = titleIndex
+    _titleIndex["vocab"] = vocab
+    return titleIndex
+
+
+
+@TimedStage()
+def GetMainCharID(vocab, chooser):
     """Return a words ID for a randomly selected main character variable."""
     try:
         # Probabilities contains some alternative settings for this slot, with weightings. Select one.
-        mySettings = ProbabilitiesPick(db, "mainChar")
+        mySettings = ProbabilitiesPick(vocab, "mainChar", chooser)
 
         # Some "settings" simply tell you which words record to use. If one of those was chosen, return the words_id
         if mySettings[0]["words_id"] != None:
@@ -271,129 +850,102 @@ def GetMainCharID(db):
 
         # One option has a probability, but all settings are blank. This means "select any valid word".
         else:
-            # SQL query to get a list of all words records which:
+            # The vocabulary keeps a list of all words records which:
             #   a) have a pronoun, b) have a hometown, c) are in a category that could conceivably be a character
-            queryStr = "SELECT DISTINCT w.id FROM words w"
-            queryStr += " INNER JOIN charactersToPronouns ctp ON w.id = ctp.character_id"
-            queryStr += " INNER JOIN charactersToHometowns cth ON w.id = cth.character_id"
-            queryStr += " JOIN categories c ON w.categories_id = c.id"
-            queryStr += " WHERE c.name IN ('humanoid', 'animal', 'inanimate')"
-
-            # Run the query, then return one of the options (equal chance of each)
-            sqldata = db.execute(queryStr)
-            myPick = EqualPickList(sqldata)["id"]
+            myPick = EqualPickList(vocab["mainCharCandidates"], chooser)
             if myPick == None:
+                CountFallback("no_main_char")
                 return ""
             else:
                 return int(myPick)
 
     # If it all goes wrong, return "" so the program will use the default text instead
     except:
+        CountFallback("main_char_error")
         return ""
 
 
 
-def GetSubjectPronoun(db, wid):
+@TimedStage()
+def GetSubjectPronoun(vocab, wid, chooser):
     """Return display text for a subject pronoun.
     
     Keyword arguments:
-    db -- the database connection for Hallmark
+    vocab -- the Hallmark vocabulary
     wid -- an ID in the words table for a words record with at least one subject pronoun assignment.
     """
-    # SQL query to get a list of pronouns tagged as valid for this character type
-    queryStr = "SELECT w.display FROM words w"
-    queryStr += " INNER JOIN charactersToPronouns ctp ON ctp.subjectPronoun_id = w.id"
-    queryStr += " WHERE ctp.character_id = ?"
-
-    # Return the/a result of the query
-    try:
-        results = db.execute(queryStr, wid)
-        return EqualPickList(results)["display"]
-
-    # If it all goes wrong, return "" so the program will use the default text instead
-    except:
+    # Pick one of the pronouns tagged as valid for this character type. If there aren't any, return "" so the program will use the default text instead
+    myPick = EqualPickList(vocab["characterPronouns"].get(wid, ()), chooser)
+    if myPick == None:
+        CountFallback("no_pronoun")
         return ""
+    else:
+        return myPick
 
 
 
-def GetHometown(db, myCharID):
+@TimedStage()
+def GetHometown(vocab, myCharID, chooser):
     """Return display text for a suitable location of childhood significance for the main character.
     
     Keyword arguments:
-    db -- the database connection for Hallmark
+    vocab -- the Hallmark vocabulary
     myCharID -- an ID in the words table for a words record with at least one hometown assignment.
     """
-    # SQL query to get a list of display words which are flagged as suitable hometowns for this character type
-    queryStr = "SELECT w.display FROM words w"
-    queryStr += " JOIN charactersToHometowns cth ON w.id = cth.location_id"
-    queryStr += " WHERE cth.character_id = ?"
-
-    # Return the/a result of the query (some characters have more than one possible hometown)
-    try:
-        results = db.execute(queryStr, myCharID)
-        return EqualPickList(results)["display"]
-
-    # If it all goes wrong, return "" so the program will use the default text instead
-    except:
+    # Pick one of the locations flagged as suitable hometowns for this character type (some characters have more than one possible hometown)
+    # If there aren't any, return "" so the program will use the default text instead
+    myPick = EqualPickList(vocab["characterHometowns"].get(myCharID, ()), chooser)
+    if myPick == None:
+        CountFallback("no_hometown")
         return ""
+    else:
+        return myPick
         
         
 
-def GetObjectPronoun(db, subjWords):
+@TimedStage()
+def GetObjectPronoun(vocab, subjWords):
     """Return display text for an object pronoun, based on the subject pronoun display text."""
-    # SQL query to get the display text for the object pronoun, based on the subject pronoun that was passed in
-    queryStr = "SELECT wo.display FROM words wo"
-    queryStr += " JOIN pronounSets ps ON ps.objectPronoun_id = wo.id"
-    queryStr += " JOIN words ws ON ps.subjectPronoun_id = ws.id"
-    queryStr += " WHERE ws.display = ?"
-
-    # Return the result of the query
-    try:
-        return db.execute(queryStr, subjWords)[0]["display"]
-
-    # If it all goes wrong, return "" so the program will use the default text instead
-    except:
+    # Look up the object pronoun, returning "" so the program will use the default text if there isn't one
+    objectPronoun = vocab["objectPronouns"].get(subjWords)
+    if objectPronoun == None:
+        CountFallback("no_object_pronoun")
         return ""
+    return objectPronoun
 
 
 
-def ConjugateVerb(db, infinitive, subjectPronoun):
+def ConjugateVerb(vocab, infinitive, subjectPronoun):
     """Conjugate a verb based on the infinitive and subject."""
-    # SQL query to get the display text of the correct verb, based on the infinitive name and subject pronoun display text
-    queryStr = "SELECT w.display FROM words w"
-    queryStr += " JOIN verbs v ON w.id = v.result_id"
-    queryStr += " JOIN infinitives i ON i.id = v.infinitives_id"
-    queryStr += " JOIN pronounGroups pg ON pg.id = v.pronounGroups_id"
-    queryStr += " JOIN pronounGroupMembers pgm ON pgm.group_id = pg.id"
-    queryStr += " JOIN words wp ON wp.id = pgm.pronoun_id"
-    queryStr += " WHERE i.name = ? AND wp.display = ?"
-
-    # Run that and return it
-    try:
-        return db.execute(queryStr, infinitive, subjectPronoun)[0]["display"]
-
-    # If it all goes wrong, return "" so the program will use the default text instead
-    except:
+    # Look up the correct verb, based on the infinitive name and subject pronoun display text.
+    # If there isn't one, return "" so the program will use the default text instead
+    verb = vocab["verbs"].get((infinitive, subjectPronoun))
+    if verb == None:
+        CountFallback("no_verb")
         return ""
+    return verb
 
 
 
-def GetJobDesc(db):
+@TimedStage()
+def GetJobDesc(vocab, chooser):
     """Return display text describing the main character's job in the big city."""
     # Grab some probabilities settings. All jobDesc probabilities settings have a words_id, so return that
     try:
-        mySettings = ProbabilitiesPick(db, "jobDesc")
+        mySettings = ProbabilitiesPick(vocab, "jobDesc", chooser)
         
         if mySettings[0]["words_id"] != None:
-            myDesc = GetWords(db, int(mySettings[0]["words_id"]))
+            myDesc = GetWords(vocab, int(mySettings[0]["words_id"]))
             return GetAOrAn(myDesc) + " " + myDesc
 
         # If probabilities pick went wrong, return "" so the program will use the default text instead
         else:
+            CountFallback("blank_job_desc")
             return ""
 
     # If something else goes wrong, return "" so the program will use the default text instead
     except:
+        CountFallback("job_desc_error")
         return ""
 
 
@@ -424,48 +976,52 @@ def BeginsWithVowel(myStr):
     
     # If something goes wrong, grammatically incorrect is preferable to something crashing
     except:
+        CountFallback("a_or_an_error")
         return False
 
 
 
-def GetLifeguide(db):
+@TimedStage()
+def GetLifeguide(vocab, chooser):
     """Return display text describing the 'lifeguide'"""
     # Select a row of settings from probabilities. For lifeguide they should all have a category ID; most will also have a prefix string
-    mySettings = ProbabilitiesPick(db, "lifeguide")
+    mySettings = ProbabilitiesPick(vocab, "lifeguide", chooser)
 
     # Get display text for the prefixStr, if there is one
-    myPrefix = HandlePrefix(db, mySettings[0]["prefixStr"])
-
-    # SQL query to get a list of words with a particular catgeories_id
-    queryStr = "SELECT w.display FROM words w"
-    queryStr += " WHERE w.categories_id = ?"
+    myPrefix = HandlePrefix(vocab, mySettings[0]["prefixStr"], chooser)
 
-    # Run it with the categories_id from probabilities passed in as the argument.
+    # Pick one of the words with the categories_id from probabilities
     try:
         if mySettings[0]["categories_id"] != None:
-            guideOptions = db.execute(queryStr, mySettings[0]["categories_id"])
+            guideOption = EqualPickList(vocab["categoryIDWords"].get(mySettings[0]["categories_id"], ()), chooser)
+            if guideOption == None:
+                CountFallback("no_lifeguide_words")
+                return ""
     
             # Append the prefix
-            lifeguide = myPrefix + " " + EqualPickList(guideOptions)["display"]
+            lifeguide = myPrefix + " " + guideOption
             
             # Return a or an, followed by the lifeguide text
             return GetAOrAn(lifeguide) + " " + lifeguide
         
         # If ProbabilitiesPick failed, return "" so the program will use the default text instead
         else:
+            CountFallback("blank_lifeguide")
             return ""
     
     # If it all goes wrong, return "" so the program will use the default text instead
     except:
+        CountFallback("lifeguide_error")
         return ""
 
 
 
-def HandlePrefix(db, myPrefix):
+@TimedStage()
+def HandlePrefix(vocab, myPrefix, chooser):
     """Return display text for a prefix embellishing the lifeguide.
     
     Keyword arguments:
-    db -- connection to the Hallmark database.
+    vocab -- the Hallmark vocabulary.
     myPrefix -- a settings string.
     
     Settings string example:
@@ -478,211 +1034,288 @@ def HandlePrefix(db, myPrefix):
     if myPrefix == None or myPrefix == "":
         return ""
 
-    # If there is a prefix, split it up and replace the variables with something suitable
+    # If there is a prefix, fill in its compiled template with something suitable
     else:
+        # Each slot's key is the category name for the variable we want. Pick one of the words in that category for each slot
+        prefixTemplate = GetPrefixTemplate(myPrefix)
+        parts = list(prefixTemplate["parts"])
+        for pos, categoryName in prefixTemplate["slots"]:
+            myPick = EqualPickList(vocab["categoryWords"].get(categoryName, ()), chooser)
 
-        # SQL query to get a list of words with a particular category name
-        queryStr = "SELECT w.display FROM words w"
-        queryStr += " JOIN categories c ON c.id = w.categories_id"
-        queryStr += " WHERE c.name = ?"
-    
-        # Split up the prefix based on the variable tags
-        prefixArr = SplitTaggedStr(myPrefix)
-    
-        # Generate the string
-        myStr = ""
-        for i in range(0, len(prefixArr)):
-    
-            # Evens = static text, so just dunk it into the string
-            if i % 2 == 0:
-                myStr += prefixArr[i]
-    
-            # Odds = the category name for the variable we want. Run the SQL query we prepared earlier, then pick a result
+            # "Adjective" is the most common prefix category and if you describe the Lifeguide as a "happy happy man" it'd sort of make sense, so...
+            if myPick == None:
+                CountFallback("happy_prefix")
+                parts[pos] = "happy"
             else:
-                try:
-                    sqldata = db.execute(queryStr, prefixArr[i])
-                    myStr += EqualPickList(sqldata)["display"]
-                
-                # "Adjective" is the most common prefix category and if you describe the Lifeguide as a "happy happy man" it'd sort of make sense, so...
-                except:
-                    myStr += "happy"
-    
-        return myStr
+                parts[pos] = myPick
 
+        return "".join(parts)
 
 
-def GetTopic(db):
-    """Return display words for a topic of conversation."""
-    # Prepare SQL query to make a list of all words records in the "topic" category
-    queryStr = "SELECT w.display FROM words w"
-    queryStr += " JOIN categories c ON c.id = w.categories_id"
-    queryStr += " WHERE c.name = 'topic'"
 
-    # Run the query, then pick an option
-    try:
-        topicOptions = db.execute(queryStr)
-        return EqualPickList(topicOptions)["display"]
+def GetPrefixTemplate(myPrefix):
+    """Return the compiled template for a lifeguide prefix string, compiling it the first time it's needed."""
+    prefixTemplate = _prefixTemplates.get(myPrefix)
+    if prefixTemplate == None:
+        try:
+            prefixTemplate = CompileTemplate(myPrefix)
 
-    # If it all goes wrong, return "" so the program will use the default text instead
-    except:
-        return ""
+        # A prefix with unbalanced tags is a mistake in the source data. Treat it as static text rather than crashing
+        except ValueError:
+            CountFallback("bad_prefix")
+            prefixTemplate = CompileTemplate(myPrefix.replace(OPEN_TAG, "").replace(CLOSE_TAG, ""))
 
+        _prefixTemplates[myPrefix] = prefixTemplate
 
+    return prefixTemplate
 
-def EqualPickList(myList):
-    """Return a random element from a list."""
-    # If the list only has one variable, return that
-    if len(myList) == 1:
-        return myList[0]
 
-    # If it has more than one, pick one at random
-    elif len(myList) > 1:
-        return myList[random.randint(0, len(myList)-1)]
 
-    # If it all goes horribly wrong, return a dummy dictionary of blankness
+@TimedStage()
+def GetTopic(vocab, chooser):
+    """Return display words for a topic of conversation."""
+    # Pick one of the words records in the "topic" category. If there aren't any, return "" so the program will use the default text instead
+    myPick = EqualPickList(vocab["categoryWords"].get("topic", ()), chooser)
+    if myPick == None:
+        CountFallback("no_topic")
+        return ""
     else:
-        fail = {}
-        fail["display"] = None
-        fail["id"] = None
-        return fail
+        return myPick
+
 
 
+def EqualPickList(myList, chooser):
+    """Return an element from a list, as picked by the chooser, or None if the list is empty."""
+    # If it all goes horribly wrong, return None
+    if len(myList) == 0:
+        return None
+
+    # Otherwise pick one, giving every element an equal chance
+    else:
+        return myList[chooser.Choose(len(myList))]
 
-def ProbabilitiesPick(db, choiceGroupName):
+
+
+@TimedStage(labelPos=1, labelName="choice_group")
+def ProbabilitiesPick(vocab, choiceGroupName, chooser):
     """Return the results fields from a weighted randomly select a record from the probabilities table.
     
     Keyword arguments:
-    db -- connection to the Hallmark database
+    vocab -- the Hallmark vocabulary
     choiceGroupName -- the name identifying the group of probabilities records to choose between
+    chooser -- a RandomChooser or IDChooser
     """
     try:
-        sqlData = db.execute("SELECT p.id, p.probability FROM probabilities p INNER JOIN choiceGroups cg ON cg.id = p.choiceGroups_id WHERE cg.name = ?", choiceGroupName)
-        chosenID = WeightedPick(sqlData)
-        return db.execute("SELECT words_id, categories_id, prefixStr FROM probabilities WHERE id = ?", chosenID)
+        chosenPos = chooser.ChooseWeighted(GetAliasTable(vocab, choiceGroupName))
+        return [vocab["choiceGroups"][choiceGroupName][chosenPos]]
 
     # If something goes wrong, return a dummy dictionary of blankness
     except:
+        CountFallback("blank_probabilities")
         fail = {}
         fail["words_id"] = None
         fail["categories_id"] = None
-        fail["prefixStr_id"] = None
-        return fail   
+        fail["prefixStr"] = None
+        return [fail]
+
+
 
+class RandomChooser:
+    """Makes each choice behind a new plot at random, keeping a note of them all so they can be packed into a plot ID (see plotCodec.EncodeDigits)."""
 
+    def __init__(self, rng):
+        """Keyword arguments:
+        rng -- a random.Random, or the random module
+        """
+        self.rng = rng
+        self.digits = []
 
-def GetWords(db, wid):
+
+    def Choose(self, count):
+        """Return a position between 0 and count - 1, each with an equal chance."""
+        # With only one option there's no choice to make (or to note down)
+        if count <= 1:
+            return 0
+
+        pos = self.rng.randint(0, count - 1)
+        self.digits.append((pos, count))
+        return pos
+
+
+    def ChooseWeighted(self, aliasTable):
+        """Return a position in an alias table (see CreateAliasTable), with weightings applied."""
+        pos = WeightedPick(aliasTable, self.rng)
+        if len(aliasTable["ids"]) > 1:
+            self.digits.append((pos, len(aliasTable["ids"])))
+        return pos
+
+
+
+
+class IDChooser:
+    """Repeats the choices behind an existing plot, by reading them back out of its plot ID."""
+
+    def __init__(self, plotID):
+        """Keyword arguments:
+        plotID -- an integer made by plotCodec.EncodeDigits (ParsePlotID turns a plot ID string back into one)
+        """
+        self.reader = CreateDigitReader(plotID)
+
+
+    def Choose(self, count):
+        """Return the position that was chosen from count options."""
+        if count <= 1:
+            return 0
+        return ReadDigit(self.reader, count)
+
+
+    def ChooseWeighted(self, aliasTable):
+        """Return the position that was chosen from an alias table. The weightings only matter when choosing at random."""
+        return self.Choose(len(aliasTable["ids"]))
+
+
+    def IsFinished(self):
+        """Return boolean indicating if every choice in the ID has been used up. False means it wasn't a valid ID for this vocabulary."""
+        return ReaderIsFinished(self.reader)
+
+
+
+@TimedStage()
+def GetWords(vocab, wid):
     """Return the display words for a given words ID."""
     try:
-        return db.execute("SELECT display FROM words WHERE id = ?", wid)[0]["display"]
+        return vocab["words"][wid]
     except:
-        return "- KABOOM! -"
+        CountFallback("missing_words")
+        return MISSING_WORDS
+
 
 
+def GetAliasTable(vocab, choiceGroupName):
+    """Return the alias table for a choice group, building it the first time it's needed.
+
+    Tables are cached against the vocabulary's tuple of probabilities records for the group. When the
+    vocabulary is reloaded (because the probabilities changed), the records are new and the table is rebuilt.
+    """
+    # A compiled vocabulary file comes with its alias tables already built
+    if "aliasTables" in vocab:
+        return vocab["aliasTables"][choiceGroupName]
+
+    groupRecords = vocab["choiceGroups"][choiceGroupName]
+
+    cached = _aliasTables.get(choiceGroupName)
+    if cached == None or cached[0] is not groupRecords:
+        cached = (groupRecords, CreateAliasTable(groupRecords))
+        _aliasTables[choiceGroupName] = cached
+
+    return cached[1]
 
-def WeightedPick(idsAndWeights):
-    """Select an ID randomly, but with weightings applied.
+
+
+def WeightedPick(aliasTable, rng=random):
+    """Select a position in the alias table randomly, but with weightings applied.
 
     Keyword arguments:
-    idsAndWeights -- a list of dictionaries with two fields, "id" and "probability"
+    aliasTable -- a dictionary created by CreateAliasTable
+    rng -- a random.Random, or the random module
     """
     # If this is somehow run with only one option, return it.
-    if len(idsAndWeights) == 1:
-        return idsAndWeights[0]["id"]
+    if len(aliasTable["ids"]) == 1:
+        return 0
 
-    # Otherwise apply alias algorithm to perform a weighted selection
+    # Otherwise use the alias table to perform a weighted selection: create a biased coin and flip it
     else:
-        # The probabilities should already be percentages, but make sure.
-        idsAndWeights = ConvertToPercentages(idsAndWeights)
-        
-        # Create a biased coin and flip it
-        myCoin = CreateUnfairCoin(idsAndWeights)
-        thisSideUp = UnfairCoinFlip(myCoin["probOfHeads"])
+        myCoin = CreateUnfairCoin(aliasTable, rng)
+        thisSideUp = UnfairCoinFlip(myCoin["probOfHeads"], rng)
         return myCoin["sides"][thisSideUp]
 
 
 
-def CreateUnfairCoin(idsAndWeights):
-    """Return a dictionary with two values, representing an unfair coin:
-        "probOfHeads" (a float between 0 and 1)
-        "sides" (a two-element list where [0] contains the result of heads and [1] the result of tails)
-    
+def CreateAliasTable(idsAndWeights):
+    """Return a dictionary with four tuples, representing an alias table:
+        "ids" (the ID of each option)
+        "weights" (the weight of each option, as given)
+        "prob" (for each position, the probability of keeping that position's option rather than its alias)
+        "alias" (for each position, the position of the option to use instead)
+
     Keyword arguments:
     idsAndWeights -- a list of dictionaries with two fields, "id" and "probability"
-    
-    Note: implementation of the alias algorithm, as explained at https://www.keithschwarz.com/darts-dice-coins/.
     """
-    myCoin = {}
-
-    # If there are only two options, set up the biased coin immediately.
-    if len(idsAndWeights) == 2:
-        myCoin["probOfHeads"] = idsAndWeights[0]["probability"]
-        myCoin["sides"] = [idsAndWeights[0]["id"], idsAndWeights[1]["id"]]
-
-    # If there are more than 2 options, decide which two options are going into the biased coin, then set it up.
-    else:
-        # Setup arrays to store the probabilities and aliases
-        sizeOfSrc = len(idsAndWeights)
-        aliasIds = [None] * sizeOfSrc
-        prob = [None] * sizeOfSrc
-
-        # Use deque for the worklists, to improve performance when popping values from the start
-        smallWork = deque([])
-        largeWork = deque([])
-
-        # Populate the two working lists
-        for pos in range(0, sizeOfSrc):
-            # Scale the probabilities so the average probability = 1
-            idsAndWeights[pos]["probability"] = idsAndWeights[pos]["probability"] * sizeOfSrc
-
-            # Assign elements to large or small depending on if their probability is above or below average
-            if idsAndWeights[pos]["probability"] >= 1:
-                largeWork.append(pos)
-            else:
-                smallWork.append(pos)
+    return CreateAliasTableFromWeights([item["id"] for item in idsAndWeights], [item["probability"] for item in idsAndWeights])
 
-        # While both working lists have values, loop through using the next largeWork option to fill up the space above the next smallWork option
-        while len(largeWork) > 0 and len(smallWork) > 0:
-            tPos = smallWork.popleft()
-            aPos = largeWork.popleft()
 
-            # Add these to the results lists
-            prob[tPos] = idsAndWeights[tPos]["probability"]
-            aliasIds[tPos] = idsAndWeights[aPos]["id"]
 
-            # Filling the gap above tPos "used up" some of aPos's probability. Adjust, then reassign the remainder of aPos to a work list
-            idsAndWeights[aPos]["probability"] = (idsAndWeights[aPos]["probability"] + idsAndWeights[tPos]["probability"]) - 1
+def CreateAliasTableFromWeights(ids, weights):
+    """Return an alias table, as from CreateAliasTable, given a list of IDs and a matching list of weights.
 
-            if idsAndWeights[aPos]["probability"] < 1:
-                smallWork.append(aPos)
-            else:
-                largeWork.append(aPos)
+    Note: implementation of Vose's alias method, as explained at https://www.keithschwarz.com/darts-dice-coins/.
+    """
+    # The probabilities should already be percentages, but make sure.
+    percentages = ConvertToPercentages(weights)
+
+    # Setup arrays to store the probabilities and aliases. Scale the probabilities so the average probability = 1
+    sizeOfSrc = len(percentages)
+    scaled = [p * sizeOfSrc for p in percentages]
+    aliasPos = list(range(sizeOfSrc))
+    prob = [1.0] * sizeOfSrc
+
+    # Use deque for the worklists, to improve performance when popping values from the start
+    # Assign elements to large or small depending on if their probability is above or below average
+    smallWork = deque(pos for pos in range(sizeOfSrc) if scaled[pos] < 1)
+    largeWork = deque(pos for pos in range(sizeOfSrc) if scaled[pos] >= 1)
+
+    # While both working lists have values, loop through using the next largeWork option to fill up the space above the next smallWork option
+    while len(largeWork) > 0 and len(smallWork) > 0:
+        tPos = smallWork.popleft()
+        aPos = largeWork.popleft()
+
+        # Add these to the results lists
+        prob[tPos] = scaled[tPos]
+        aliasPos[tPos] = aPos
+
+        # Filling the gap above tPos "used up" some of aPos's probability. Adjust, then reassign the remainder of aPos to a work list
+        scaled[aPos] = (scaled[aPos] + scaled[tPos]) - 1
+
+        if scaled[aPos] < 1:
+            smallWork.append(aPos)
+        else:
+            largeWork.append(aPos)
 
-        # In theory smallWork should always empty first, leaving some "larges" that don't need an alias because they have a value of 1.
-        while len(largeWork) > 0:
-            lPos = largeWork.popleft()
-            prob[lPos] = 1
+    # Anything left over in either list (whether in theory or due to numerical instability) keeps the default probability of 1, with no alias
+    aliasTable = {}
+    aliasTable["ids"] = tuple(ids)
+    aliasTable["weights"] = tuple(weights)
+    aliasTable["prob"] = tuple(prob)
+    aliasTable["alias"] = tuple(aliasPos)
+    return aliasTable
 
-        # In practice numerical instability can result in some "larges" being assigned to smallWork by accident. Handle those too.
-        while len(smallWork) > 0:
-            sPos = smallWork.popleft()
-            prob[sPos] = 1
 
-        # Perform a fair "dice roll" to determine which pair/probabilities we're going to use to setup our biased coin
-        diceResult = random.randint(0, sizeOfSrc-1)
 
-        # Setup the biased coin based on the dice roll's selection
-        myCoin["probOfHeads"] = prob[diceResult]
-        myCoin["sides"] = [idsAndWeights[diceResult]["id"], aliasIds[diceResult]]
+def CreateUnfairCoin(aliasTable, rng=random):
+    """Return a dictionary with two values, representing an unfair coin:
+        "probOfHeads" (a float between 0 and 1)
+        "sides" (a two-element list where [0] contains the position for heads and [1] the position for tails)
     
+    Keyword arguments:
+    aliasTable -- a dictionary created by CreateAliasTable
+    rng -- a random.Random, or the random module
+    """
+    # Perform a fair "dice roll" to determine which pair/probabilities we're going to use to setup our biased coin
+    diceResult = rng.randint(0, len(aliasTable["ids"])-1)
+
+    # Setup the biased coin based on the dice roll's selection
+    myCoin = {}
+    myCoin["probOfHeads"] = aliasTable["prob"][diceResult]
+    myCoin["sides"] = [diceResult, aliasTable["alias"][diceResult]]
     return myCoin
 
 
 
-def UnfairCoinFlip(probOfHeads):
+def UnfairCoinFlip(probOfHeads, rng=random):
     """Return 0 ("heads") or 1 ("tails") with the probability of heads being as per the argument."""
 
     # Pick a float between 0 and 1
-    randProb = random.random()
+    randProb = rng.random()
 
     # Check if that beats the unfair odds of heads
     if randProb < probOfHeads:
@@ -692,44 +1325,7 @@ def UnfairCoinFlip(probOfHeads):
 
 
 
-def ConvertToPercentages(idsAndWeights):
-    """Return a list of dictionaries where the probability values sum up to 1."""
-    # See if it already sums to 1 (maybe they're already percentages)
-    startTotal = sum(item["probability"] for item in idsAndWeights)
-
-    # If it doesn't, adjust the values so it does
-    if 1 != startTotal:
-        # Adjust the values proportionately
-        for r in idsAndWeights:
-            r["probability"] = r["probability"] / startTotal
-
-        # Round down the proportionate probabilities in idsAndWeights to 2 dp, storing the remainders
-        remainders = []
-        for r in range(len(idsAndWeights)):
-            thisCombo = {}
-            prob2dp = math.floor(idsAndWeights[r]["probability"] * 100) / 100.0
-            thisCombo["pos"] = r
-            thisCombo["remainder"] = idsAndWeights[r]["probability"] - prob2dp
-            idsAndWeights[r]["probability"] = prob2dp
-            remainders.append(thisCombo)
-        
-        # Calculate how much was lost via rounding down
-        difference = 1 - sum(item["probability"] for item in idsAndWeights)
-
-        # Sort the remainders in descending size order
-        remainders.sort(key=GetRemainder, reverse=True)
-
-        # While the difference exists, add 0.01 to the next highest remainder
-        loopNum = 0
-        while difference > 0:
-            idsAndWeights[remainders[loopNum]["pos"]]["probability"] += 0.01
-            difference -= 0.01
-            loopNum += 1
-
-    return idsAndWeights
-
-
-
-def GetRemainder(remainder):
-    """Return the key value for remainder."""
-    return remainder.get("remainder")
+def ConvertToPercentages(weights):
+    """Return a list of the probability values, adjusted proportionately so they sum up to 1."""
+    startTotal = sum(weights)
+    return [weight / startTotal for weight in weights]
@@ -48,6 +48,18 @@ def GetHallmarkSelection(mySettings):
 
 
 
+def GetPlotRecord(mySettings):
+    """Return a dictionary with the plot ID, plot, first choice of image and first choice of title from one set of Hallmark settings, ready to be sent as JSON."""
+    myRecord = {}
+    myRecord["id"] = mySettings.get("plotID")
+    myRecord["plot"] = mySettings["plot"]
+    myRecord["image"] = mySettings["images"][0] if len(mySettings["images"]) > 0 else None
+    myRecord["title"] = mySettings["titles"][0] if len(mySettings["titles"]) > 0 else None
+    return myRecord
+
+
+
+
 def apology(errMsg, errcode):
     """Render the apology page."""
     return render_template("apology.html", theError=errMsg), errcode
\ No newline at end of file
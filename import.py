@@ -1,76 +1,221 @@
 # Populates Hallmark database
-import cs50
-import re
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from sys import argv, exit
+from queryTracer import StartTrace, StopTrace, TraceConnection, FormatTraceReport
+from sourceParser import ParseSourceFile, ParseFileSections, OrderSections, SourceFormatError
+from storage import OpenStorage
+
+
+# Where to find the sourceData files (alongside this script)
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sourceData")
+
+# Columns (apart from id) which bulk mode writes for each table
+BULK_COLUMNS = {
+    "categories": ["name"],
+    "choiceGroups": ["name"],
+    "infinitives": ["name"],
+    "pronounGroups": ["name"],
+    "images": ["name", "filename", "fextension"],
+    "titleTemplates": ["titleTemplate"],
+    "words": ["categories_id", "display"],
+    "probabilities": ["choiceGroups_id", "probability", "note", "words_id", "categories_id", "prefixStr"],
+    "pronounGroupMembers": ["group_id", "pronoun_id"],
+    "pronounSets": ["subjectPronoun_id", "objectPronoun_id"],
+    "verbs": ["infinitives_id", "pronounGroups_id", "result_id"],
+    "charactersToPronouns": ["character_id", "subjectPronoun_id"],
+    "charactersToHometowns": ["character_id", "location_id"],
+    "wordsToImages": ["words_id", "images_id"],
+    "wordsToTitles": ["words_id", "titleTemplates_id"]
+}
+
+# Tables which only link records in other tables together
+LINK_TABLES = ["pronounGroupMembers", "pronounSets", "verbs", "charactersToPronouns", "charactersToHometowns", "wordsToImages", "wordsToTitles"]
+
+# Columns which must be unique in each table, so bulk mode can use INSERT OR IGNORE
+UNIQUE_KEYS = {
+    "categories": ["name"],
+    "choiceGroups": ["name"],
+    "infinitives": ["name"],
+    "pronounGroups": ["name"],
+    "images": ["name"],
+    "titleTemplates": ["titleTemplate"],
+    "words": ["categories_id", "display"]
+}
+UNIQUE_KEYS.update({table: BULK_COLUMNS[table] for table in LINK_TABLES})
+
+# Sync mode describes each section as a set of "facts" (rows identified by names and display text rather than IDs).
+# Facts for link tables are deleted by looking up each column's ID from its (table, column) name.
+LINK_FACT_COLUMNS = {
+    "pronounGroupMembers": [("group_id", "pronounGroups", "name"), ("pronoun_id", "words", "display")],
+    "pronounSets": [("subjectPronoun_id", "words", "display"), ("objectPronoun_id", "words", "display")],
+    "verbs": [("infinitives_id", "infinitives", "name"), ("pronounGroups_id", "pronounGroups", "name"), ("result_id", "words", "display")],
+    "charactersToPronouns": [("character_id", "words", "display"), ("subjectPronoun_id", "words", "display")],
+    "charactersToHometowns": [("character_id", "words", "display"), ("location_id", "words", "display")],
+    "wordsToImages": [("words_id", "words", "display"), ("images_id", "images", "name")],
+    "wordsToTitles": [("words_id", "words", "display"), ("titleTemplates_id", "titleTemplates", "titleTemplate")]
+}
+
+# Rows which refer to each kind of record, and so must go when that record is deleted
+RECORD_REFERENCES = {
+    "words": {"pronounGroupMembers": ["pronoun_id"], "pronounSets": ["subjectPronoun_id", "objectPronoun_id"], "verbs": ["result_id"],
+              "charactersToPronouns": ["character_id", "subjectPronoun_id"], "charactersToHometowns": ["character_id", "location_id"],
+              "wordsToImages": ["words_id"], "wordsToTitles": ["words_id"], "probabilities": ["words_id"]},
+    "images": {"wordsToImages": ["images_id"]},
+    "titleTemplates": {"wordsToTitles": ["titleTemplates_id"]},
+    "infinitives": {"verbs": ["infinitives_id"]},
+    "pronounGroups": {"pronounGroupMembers": ["group_id"], "verbs": ["pronounGroups_id"]},
+    "choiceGroups": {"probabilities": ["choiceGroups_id"]}
+}
+
+# Links which are skipped (rather than being an error) when their words or image don't exist. These never keep a record from being deleted.
+OPTIONAL_LINK_TABLES = ["wordsToImages", "wordsToTitles"]
+
+# The column which identifies each kind of record in the facts, in the order to delete them (things which refer to words, before words)
+RECORD_NAME_COLUMNS = {"choiceGroups": "name", "words": "display", "images": "name", "titleTemplates": "titleTemplate",
+                       "infinitives": "name", "pronounGroups": "name", "categories": "name"}
 
 
 
 def main():
-    """Import the contents of a correctly formatted .txt file into hallmark.db."""
-    # Check for correct usage
-    if len(argv) == 2:
-        srcDataFile = "/home/ubuntu/project/sourceData/" + argv[1]
+    """Import the contents of a correctly formatted .txt file, or a whole directory of them, into hallmark.db."""
+    # Check for correct usage. --trace works with any mode, so take it out before checking the rest
+    options = [arg for arg in argv[1:] if arg.startswith("--") and arg != "--trace"]
+    filenames = [arg for arg in argv[1:] if not arg.startswith("--")]
+    if "--dir" in options and len(filenames) <= 1 and set(options) <= {"--dir", "--bulk", "--defer-indexes"}:
+        srcDataPath = filenames[0] if len(filenames) == 1 else SOURCE_DIR
+    elif options == ["--sync"] and len(filenames) <= 1:
+        srcDataPath = filenames[0] if len(filenames) == 1 else SOURCE_DIR
+    elif len(filenames) == 1 and set(options) <= {"--bulk", "--defer-indexes"}:
+        srcDataPath = os.path.join(SOURCE_DIR, filenames[0])
     else:
-        print("Usage: python import.py filename.txt")
+        print("Usage: python import.py [--trace] [--bulk [--defer-indexes]] filename.txt")
+        print("       python import.py [--trace] --dir [--bulk [--defer-indexes]] [directory]")
+        print("       python import.py [--trace] --sync [directory]")
         exit()
 
-    # Set the database
-    db = cs50.SQL("sqlite:///hallmark.db")
+    # Tracing records every query, then reports any that were repeated or run once per row
+    if "--trace" in argv[1:]:
+        StartTrace("import.py " + " ".join(argv[1:]))
 
-    # Open the source data, stick it into a reader and turn it into a nice list
-    with open(srcDataFile, "r") as reader:
-        try:
-            # Get rid of the newline characters, then send it to the database
-            fileList = [line.rstrip("\n") for line in reader]
-            ImportToDatabase(db, fileList)
-        finally:
-            reader.close()
+    try:
+        # Sync mode makes hallmark.db match a directory, re-importing only what has changed since the last sync
+        if "--sync" in options:
+            SyncDirectory("hallmark.db", srcDataPath)
+
+        # Directory mode parses every .txt file in parallel, then imports the sections in dependency order
+        elif "--dir" in options:
+            ImportDirectory("hallmark.db", srcDataPath, "--bulk" in options, "--defer-indexes" in options)
+
+        # Bulk mode imports the whole file in one transaction, looking everything up in memory
+        elif "--bulk" in options:
+            BulkImportFile("hallmark.db", srcDataPath, "--defer-indexes" in options)
+
+        # Otherwise open the source data and send it to the database, one line at a time
+        else:
+            db = OpenStorage("hallmark.db")
+            with open(srcDataPath, "r") as reader:
+                ImportToDatabase(db, reader)
+
+    except SourceFormatError as e:
+        print(srcDataPath + ": " + str(e))
+        exit(1)
+
+    except (LookupError, ValueError, sqlite3.Error) as e:
+        if "--sync" in options:
+            print("Sync failed, nothing was changed: " + str(e))
+        elif "--bulk" in options:
+            print("Bulk import failed, nothing was imported: " + str(e))
+        else:
+            print("Import failed: " + str(e))
+        exit(1)
+
+    finally:
+        trace = StopTrace()
+        if trace != None:
+            print(FormatTraceReport(trace))
+
+
+
+def ImportDirectory(dbPath, srcDir, bulk, deferIndexes):
+    """Import every .txt file in a directory, in an order which satisfies the dependencies between sections.
+
+    Keyword arguments:
+    dbPath -- the path to the SQLite database file.
+    srcDir -- the directory containing the .txt files.
+    bulk -- boolean. True = import everything in a single bulk mode transaction; False = import one row at a time.
+    deferIndexes -- boolean. Bulk mode only. True = drop the indexes before importing and rebuild them at the end.
+    """
+    srcDataFiles = sorted(glob.glob(os.path.join(srcDir, "*.txt")))
+
+    # Parsing doesn't need the database, so each file can be parsed in its own process
+    with ProcessPoolExecutor() as executor:
+        parsedFiles = list(zip(srcDataFiles, executor.map(ParseFileSections, srcDataFiles)))
+
+    # Then a single writer works through the sections, e.g. all the words before anything that refers to words
+    sections = OrderSections(parsedFiles)
+    if bulk:
+        BulkImportSections(dbPath, sections, deferIndexes)
+    else:
+        db = OpenStorage(dbPath)
+        for myTable, records in sections:
+            ImportSection(db, myTable, iter(records))
+        db.close()
+
+    PrintDone(str(len(srcDataFiles)) + " files in " + srcDir)
 
 
 
-def ImportToDatabase(db, fileList):
-    """Select and call the correct import function, based on the contents of the first row of the .txt file."""
-    # The first row of each input file always contains "#name" where the name is the name of (one of) the tables where the data should go
-    if fileList[0][0] == "#":
+def ImportToDatabase(db, reader):
+    """Select and call the correct import function for each section of the .txt file, based on its "#table" header."""
+    # Each section begins with a row containing "#name", where the name is the name of (one of) the tables where the data should go
+    for myTable, records in ParseSourceFile(reader):
+        ImportSection(db, myTable, records)
 
-        # Get the name, store it away nicely, then get rid of it from the data
-        myTable = fileList[0].replace("#", "").replace("\n", "")
-        contentsArr = fileList[1:]
 
-        # Run the appropriate function to process the file and dunk it into the table(s)
-        if myTable == "infinitives":
-            ImportNames(db, myTable, contentsArr)
 
-        elif myTable == "pronounGroupMembers":
-            ImportPronounGroups(db, contentsArr)
+def ImportSection(db, myTable, records):
+    """Run the appropriate function to process a section and dunk it into the table(s)."""
+    if myTable == "infinitives":
+        ImportNames(db, myTable, records)
 
-        elif myTable == "words":
-            ImportWords(db, contentsArr)
+    elif myTable == "pronounGroupMembers":
+        ImportPronounGroups(db, records)
 
-        elif myTable == "pronounSets":
-            ImportPronounSets(db, contentsArr)
+    elif myTable == "words":
+        ImportWords(db, records)
 
-        elif myTable == "verbs":
-            ImportVerbs(db, contentsArr)
+    elif myTable == "pronounSets":
+        ImportPronounSets(db, records)
 
-        elif myTable == "characterSettings":
-            ImportCharacterSettings(db, contentsArr)
+    elif myTable == "verbs":
+        ImportVerbs(db, records)
 
-        elif myTable == "probabilities":
-            ImportProbabilities(db, contentsArr)
+    elif myTable == "characterSettings":
+        ImportCharacterSettings(db, records)
 
-        elif myTable == "images":
-            ImportImages(db, contentsArr)
+    elif myTable == "probabilities":
+        ImportProbabilities(db, records)
+
+    elif myTable == "images":
+        ImportImages(db, records)
+    
+    elif myTable == "wordsToImages":
+        ImportWordsToImages(db, records)
         
-        elif myTable == "wordsToImages":
-            ImportWordsToImages(db, contentsArr)
-            
-        elif myTable == "titleTemplates":
-            ImportTitleTemplates(db, contentsArr)
+    elif myTable == "titleTemplates":
+        ImportTitleTemplates(db, records)
+
+    else:
+        print("Skipping unknown section '" + myTable + "'.")
 
 
 
-def ImportNames(db, myTable, fileContents):
+def ImportNames(db, myTable, records):
     """Import .txt file into a table with two columns, "id" and "name".
     
     Source file requirements:
@@ -81,23 +226,17 @@ def ImportNames(db, myTable, fileContents):
     countStr = "SELECT COUNT(id) FROM " + safeTableName + " WHERE name = ?"
     insertStr = "INSERT INTO " + safeTableName + "(name) VALUES (?)"
 
-    for e in range(len(fileContents)):
-        # Check if the task has changed; if so, switch task
-        if "#" == fileContents[e][0]:
-            PrintDone("names for " + safeTableName)
-            ImportToDatabase(db, fileContents[e:])
-            return
-        
-        # If not, check if the name already exists; if not, add it now
-        elif 0 == db.execute(countStr, fileContents[e])[0]["COUNT(id)"]:
-            db.execute(insertStr, fileContents[e])
-            PrintAdded(e, safeTableName)
+    for record in records:
+        # Check if the name already exists; if not, add it now
+        if 0 == db.execute(countStr, record["name"])[0]["COUNT(id)"]:
+            db.execute(insertStr, record["name"])
+            PrintAdded(record["name"], safeTableName)
 
     PrintDone("names for " + safeTableName)
 
 
 
-def ImportPronounGroups(db, fileContents):
+def ImportPronounGroups(db, records):
     """Import pronoun groups and their definitions from a .txt file.
     
     Source file requirements:
@@ -108,44 +247,27 @@ def ImportPronounGroups(db, fileContents):
     Notes:
         "pronounGroups" are used in verb conjugations. She, he and it are interchangeable for conjugation purposes: this gathers them under a single banner.
     """
-    for e in range(len(fileContents)):
-        # If the task has changed, run the next task
-        if "#" == fileContents[e][0]:
-            PrintDone("pronoun group names and definitions")
-            ImportToDatabase(db, fileContents[e:])
-            return
-
+    for record in records:
         # The line contains "~groupName". Update the groupID accordingly and, if necessary, add this new group to the list.
-        elif fileContents[e][0] == "~":
-            activeGroupName = fileContents[e].replace("~", "")
-            activeGroupID = GetIdFromName(db, "pronounGroups", activeGroupName, True)
-
-        # The line contains a list of pronouns for the current group in the format "\tp=pronoun1,pronoun2,..."
-        elif fileContents[e][0] == "\t":
-            pronounList = re.split('p=|,', fileContents[e])
+        if record["type"] == "pronounGroup":
+            activeGroupID = GetIdFromName(db, "pronounGroups", record["name"], True)
 
-            # pronounList[0] will contain the leading tab, so ignore that
-            for p in pronounList[1:]:
-                pronounID = 0
-
-                # Go to the words table and find the ID for this pronoun
-                try:
-                    pronounID = GetWordsID(db, p)
-                except:
-                    exit()
-
-                # Check if this pronoun-to-group link already exists. If not, add it.
-                if 0 == db.execute("SELECT COUNT(id) FROM pronounGroupMembers WHERE group_id = :groupID AND pronoun_id = :pronounID",
-                                    groupID = activeGroupID, pronounID = pronounID)[0]["COUNT(id)"]:
-                    db.execute("INSERT INTO pronounGroupMembers(group_id, pronoun_id) VALUES (:groupID, :pronounID)", groupID = activeGroupID, pronounID = pronounID)
-                    PrintAdded(p + "' to '" + activeGroupName + "' group", "pronounGroupMembers")
+        # The line contains a list of pronouns for the current group in the format "\tp=pronoun1,pronoun2,..." (one record per pronoun)
+        else:
+            # Go to the words table and find the ID for this pronoun
+            pronounID = GetWordsID(db, record["pronoun"])
 
+            # Check if this pronoun-to-group link already exists. If not, add it.
+            if 0 == db.execute("SELECT COUNT(id) FROM pronounGroupMembers WHERE group_id = :groupID AND pronoun_id = :pronounID",
+                                groupID = activeGroupID, pronounID = pronounID)[0]["COUNT(id)"]:
+                db.execute("INSERT INTO pronounGroupMembers(group_id, pronoun_id) VALUES (:groupID, :pronounID)", groupID = activeGroupID, pronounID = pronounID)
+                PrintAdded(record["pronoun"] + "' to '" + record["group"] + "' group", "pronounGroupMembers")
 
     PrintDone("pronoun group names and definitions")
 
 
 
-def ImportWords(db, fileContents):
+def ImportWords(db, records):
     """Import display words from a config file.
     
     Source file requirements:
@@ -155,62 +277,42 @@ def ImportWords(db, fileContents):
         Lines beginning with "~" are categories; lines without are words records.
     """
     # Check if the words and category combo already exists in the words table. If not, add it.
-    for w in range(len(fileContents)):
-        if "#" == fileContents[w][0]:
-            ImportToDatabase(db, fileContents[w:])
-            return
-
-        elif "~" == fileContents[w][0]:
-            # Get the category name and ID
-            categoryName = fileContents[w].replace("~", "")
-            categoryID = GetIdFromName(db, "categories", categoryName, True)
+    for record in records:
+        if record["type"] == "category":
+            # Get the category ID
+            categoryID = GetIdFromName(db, "categories", record["name"], True)
 
         elif 0 == db.execute("SELECT COUNT(id) FROM words WHERE categories_id = :catID AND display = :newWord",
-                            catID = categoryID, newWord = fileContents[w])[0]["COUNT(id)"]:
+                            catID = categoryID, newWord = record["display"])[0]["COUNT(id)"]:
             db.execute("INSERT INTO words(categories_id, display) VALUES (:catID, :newWord)", 
-                            catID = categoryID, newWord = fileContents[w])
-            PrintAdded(fileContents[w] + "' in category '" + categoryName, "words")
+                            catID = categoryID, newWord = record["display"])
+            PrintAdded(record["display"] + "' in category '" + record["category"], "words")
 
 
 
-def ImportPronounSets(db, fileContents):
+def ImportPronounSets(db, records):
     """Import pronoun sets from a config file.
     
     Source file requirements:
         Each line should have two comma-separated words. Subject pronoun on the left; object pronoun on the right. e.g. she,her
     """
-    for l in range(len(fileContents)):
-        # If the task has changed, run the next task
-        if "#" == fileContents[l][0]:
-            PrintDone("pronoun sets")
-            ImportToDatabase(db, fileContents[l:])
-            return        
-        
-        else:
-            mySplit = fileContents[l].split(",")
-    
-            # Get IDs in the words table for the subject and object pronouns
-            subjID = 0
-            objID = 0
-            try:
-                # Get the IDs (and, if the pronoun doesn't exist, add it)
-                subjID = GetWordsID(db, mySplit[0], catName="pronoun")
-                objID = GetWordsID(db, mySplit[1], catName="pronoun")
-            except Exception:
-                pass
-    
-            # Check if the link between subject and object already exists. If not, add it now.
-            if 0 == db.execute("SELECT COUNT(id) FROM pronounSets WHERE subjectPronoun_id = :subjID AND objectPronoun_id = :objID",
-                                subjID = subjID, objID = objID)[0]["COUNT(id)"]:
-                db.execute("INSERT INTO pronounSets(subjectPronoun_id, objectPronoun_id) VALUES (:subjID, :objID)", 
-                                subjID = subjID, objID = objID)
-                PrintAdded(mySplit[0] + "' + '" + mySplit[1], "pronounSets")
+    for record in records:
+        # Get IDs in the words table for the subject and object pronouns (and, if the pronoun doesn't exist, add it)
+        subjID = GetWordsID(db, record["subject"], catName="pronoun")
+        objID = GetWordsID(db, record["object"], catName="pronoun")
+
+        # Check if the link between subject and object already exists. If not, add it now.
+        if 0 == db.execute("SELECT COUNT(id) FROM pronounSets WHERE subjectPronoun_id = :subjID AND objectPronoun_id = :objID",
+                            subjID = subjID, objID = objID)[0]["COUNT(id)"]:
+            db.execute("INSERT INTO pronounSets(subjectPronoun_id, objectPronoun_id) VALUES (:subjID, :objID)", 
+                            subjID = subjID, objID = objID)
+            PrintAdded(record["subject"] + "' + '" + record["object"], "pronounSets")
     
     PrintDone("pronoun sets")
 
 
 
-def ImportVerbs(db, fileContents):
+def ImportVerbs(db, records):
     """Import verb settings from a config file.
     
     Source file requirements:
@@ -223,54 +325,37 @@ def ImportVerbs(db, fileContents):
             she/he/it=works
             they=work
     """
-    for v in range(len(fileContents)):
-        # If the task has changed, run the next task
-        if "#" == fileContents[v][0]:
-            PrintDone("verb conjugation links")
-            ImportToDatabase(db, fileContents[v:])
-            return 
-        
+    for record in records:
         # This row contains an infinitive, e.g. "~to work". This will apply to all upcoming rows (until the next infinitive).
-        elif fileContents[v][0] == "~":
-            infName = fileContents[v].replace("~", "")
-
+        if record["type"] == "infinitive":
             # Get the infinitive ID but only if it already exists (this is not where we add new infinitives)
-            try:
-                infID = GetIdFromName(db, "infinitives", infName, False)
-            except:
-                exit()
+            infID = GetIdFromName(db, "infinitives", record["name"], False)
 
         # This row contains a pronounGroup/result pair, e.g. "she/he/it=works"
         else:
-            pairSplit = fileContents[v].replace("\t", "").split("=")
-
             # Get the pronounGroup ID
             pronounGrpID = 0
             try:
                 pronounGrpID = int(db.execute("SELECT id FROM pronounGroups WHERE name = ?", 
-                                                pairSplit[0])[0]["id"])
+                                                record["pronounGroup"])[0]["id"])
             except:
                 exit()
 
             # Get the words ID for the resulting conjugated verb (if it doesn't exist, add it)
-            resultID = 0
-            try:
-                resultID = GetWordsID(db, pairSplit[1], catName="verb")
-            except:
-                exit()
+            resultID = GetWordsID(db, record["display"], catName="verb")
 
             # Check if a record linking this infinitive, pronounGroup and verb word already exists. If not, add it now
             if 0 == db.execute("SELECT COUNT(id) FROM verbs WHERE infinitives_id = :infID AND pronounGroups_id = :pronounGrpID AND result_id = :resultID",
                                 infID = infID, pronounGrpID = pronounGrpID, resultID = resultID)[0]["COUNT(id)"]:
                 db.execute("INSERT INTO verbs(infinitives_id, result_id, pronounGroups_id) VALUES (:infID, :resultID, :pronounGrpID)",
                                 infID = infID, pronounGrpID = pronounGrpID, resultID = resultID)
-                PrintAdded(infName + "' + '" + pairSplit[0] + "' + '" + pairSplit[1], "verbs")
+                PrintAdded(record["infinitive"] + "' + '" + record["pronounGroup"] + "' + '" + record["display"], "verbs")
 
     PrintDone("verb conjugation links")
 
 
 
-def ImportCharacterSettings(db, fileContents):
+def ImportCharacterSettings(db, records):
     """Import 'character settings' (i.e. acceptable values for subject pronoun and hometown for a given character words ID).
     
     Source file requirements:
@@ -282,40 +367,25 @@ def ImportCharacterSettings(db, fileContents):
 	        p=she	h=small town,village,farm
     """
     characterID = 0
-    for line in range(len(fileContents)):
-        # If the task has changed, run the next task
-        if "#" == fileContents[line][0]:
-            PrintDone("character settings")
-            ImportToDatabase(db, fileContents[line:])
-            return 
-        
+    for record in records:
         # This means it's the row with the character word on it (no prefix this time), so get the ID.
-        elif fileContents[line][0] != "\t":
+        if record["type"] == "character":
             characterID = 0
             try:
-                characterID = GetWordsID(db, fileContents[line])
-            except:
+                characterID = GetWordsID(db, record["display"])
+            except SystemExit:
                 print("Import the character words and category into the words table first.")
-                exit()
+                raise
 
         # This means it's the row with all the settings on it
         # e.g. "\tp=pronoun1,pronoun2,...\th=hometown1,hometown2,..."
         else:
-            # Break it up by \t so each array element contains one type of settings
-            tabSplit = fileContents[line].split("\t")
-
-            for t in tabSplit[1:]:
-                # Split apart the header and the list of valid options
-                headSplit = t.split("=")
-                varList = headSplit[1].split(",")
+            # Send the list of valid options to the appropriate table
+            for var in record["pronouns"]:
+                AddCharacterPronoun(db, characterID, var)
 
-                # Send the list of valid options to the appropriate table
-                for var in varList:
-                    if headSplit[0] == "p":
-                        AddCharacterPronoun(db, characterID, var)
-
-                    elif headSplit[0] == "h":
-                        AddCharacterHometown(db, characterID, var)
+            for var in record["hometowns"]:
+                AddCharacterHometown(db, characterID, var)
 
     PrintDone("character settings")
 
@@ -355,7 +425,7 @@ def AddCharacterHometown(db, characterID, hometown):
 
 
 
-def ImportProbabilities(db, fileContents):
+def ImportProbabilities(db, records):
     """Import data to "probabilities" table from a .txt file.
     
     Source file requirements:
@@ -381,87 +451,49 @@ def ImportProbabilities(db, fileContents):
     # Set flag (used to avoid duplicating records)
     importIsActive = False
     
-    for line in range(len(fileContents)):
-        # If the task has changed, run the next task
-        if "#" == fileContents[line][0]:
-            PrintDone("probabilities")
-            ImportToDatabase(db, fileContents[line:])
-            return 
-        
+    for record in records:
         # This row contains the name of a choice group, which applies to all rows below until the next row containing "~choiceGroup name"
-        elif "~" == fileContents[line][0]:
-            choiceGroupName = fileContents[line].replace("~", "")
-
+        if record["type"] == "choiceGroup":
             # If this group name already exists, skip it; otherwise, prepare for the upload by setting the choiceGroup ID
-            if 0 == db.execute("SELECT COUNT(id) FROM choiceGroups WHERE name = ?", choiceGroupName)[0]["COUNT(id)"]:
+            if 0 == db.execute("SELECT COUNT(id) FROM choiceGroups WHERE name = ?", record["name"])[0]["COUNT(id)"]:
                 importIsActive = True
-                choiceGroupID = GetIdFromName(db, "choiceGroups", choiceGroupName, True)
+                choiceGroupID = GetIdFromName(db, "choiceGroups", record["name"], True)
             else:
                 importIsActive = False
             
-        # This row contains tab-separated info for a single probabilities record
-        elif importIsActive and "\t" == fileContents[line][0]:
-            choiceGroupName = fileContents[line].replace("~", "")
-            recordSettings = fileContents[line].split("\t")
-
-            # [0] will always be empty; [1] should always be a probability, so convert to a float and store it
-            myProbability = float(recordSettings[1])
+        # This row contains the settings for a single probabilities record
+        elif importIsActive:
+            # Look up the IDs for the words and category settings, if there are any
+            wordsID = None
+            if record["word"] != None:
+                wordsID = GetWordsID(db, record["word"])
 
-            # Insert the non-optional bits into the database and get the ID of that record
-            db.execute("INSERT INTO probabilities(choiceGroups_id, probability) VALUES (?, ?)",
-                        choiceGroupID, myProbability)
-            thisRecordID = int(db.execute("SELECT last_insert_rowid()")[0]["last_insert_rowid()"])
-
-            # Loop through the optional bits, undating the record as we go
-            for thisTab in recordSettings[2:]:
-                mySplit = thisTab.split("=")
-
-                if mySplit[0] == "n":
-                    db.execute("UPDATE probabilities SET note = ? WHERE id = ?",
-                                mySplit[1], thisRecordID)
-
-                elif mySplit[0] == "w":
-                    db.execute("UPDATE probabilities SET words_id = ? WHERE id = ?",
-                                GetWordsID(db, mySplit[1]), thisRecordID)
-
-                elif mySplit[0] == "c":
-                    db.execute("UPDATE probabilities SET categories_id = ? WHERE id = ?",
-                                GetIdFromName(db, "categories", mySplit[1], False), thisRecordID)
-
-                elif mySplit[0] == "p":
-                    db.execute("UPDATE probabilities SET prefixStr = ? WHERE id = ?",
-                                mySplit[1], thisRecordID)
+            categoryID = None
+            if record["category"] != None:
+                categoryID = GetIdFromName(db, "categories", record["category"], False)
 
+            # Insert the whole record in one go
+            db.execute("INSERT INTO probabilities(choiceGroups_id, probability, note, words_id, categories_id, prefixStr) VALUES (?, ?, ?, ?, ?, ?)",
+                        choiceGroupID, record["probability"], record["note"], wordsID, categoryID, record["prefixStr"])
 
     PrintDone("probabilities")
 
 
 
-def ImportImages(db, fileContents):
+def ImportImages(db, records):
     """Import links between words and images.
     
     Source file requirements:
     Each row contains three comma-separated values: first is an name for the image record in the table; second is the filename; third is the file extension.
     """
-    for line in range(len(fileContents)):
-        # If the task has changed, run the next task
-        if "#" == fileContents[line][0]:
-            PrintDone("images import")
-            ImportToDatabase(db, fileContents[line:])
-            return 
-        
-        # Split the line and check it has the correct number of variables
-        splitLine = fileContents[line].split(",")
-        if len(splitLine) != 3:
-            exit()
-
+    for record in records:
         try:
             # Check if the record with this name already exists. If not, add it now
             if 0 == db.execute("SELECT COUNT(id) FROM images WHERE name = ?",
-                                splitLine[0])[0]["COUNT(id)"]:
+                                record["name"])[0]["COUNT(id)"]:
                 db.execute("INSERT INTO images(name, filename, fextension) VALUES (?, ?, ?)",
-                            splitLine[0], splitLine[1], splitLine[2])
-                PrintAdded(splitLine[0], "images")
+                            record["name"], record["filename"], record["fextension"])
+                PrintAdded(record["name"], "images")
         except:
             exit()
 
@@ -469,46 +501,33 @@ def ImportImages(db, fileContents):
 
 
 
-def ImportWordsToImages(db, fileContents):
+def ImportWordsToImages(db, records):
     """Import links between words and images.
     
     Source file requirements:
     Each line contains two comma-separated values: left is the display text of a words record; right is the name of an image in the images table.
     """
     # The source file should have a word,imageName pair on each row.
-    for line in range(len(fileContents)):
-        print(fileContents[line])
-        
-        # If the task has changed, run the next task
-        if "#" == fileContents[line][0]:
-            PrintDone("images import")
-            ImportToDatabase(db, fileContents[line:])
-            return 
-        
-        # Otherwise prep for importing some word-to-image links
-        splitLine = fileContents[line].split(",")
-        
-        # Check the line has the right number of elements (a comma could mess things up)
-        if len(splitLine) != 2:
-            exit()
-    
+    for record in records:
         # Get IDs for the words and the image
         try:
-            wordsID = GetWordsID(db, splitLine[0])
-            imgID = GetIdFromName(db, "images", splitLine[1], False)
+            wordsID = GetWordsID(db, record["display"])
+            imgID = GetIdFromName(db, "images", record["image"], False)
             
             # Check if this combo already exists. If not, add it now.
             if 0 == db.execute("SELECT COUNT(id) FROM wordsToImages WHERE words_id = ? AND images_id = ?",
                                 wordsID, imgID)[0]["COUNT(id)"]:
                 db.execute("INSERT INTO wordsToImages(words_id, images_id) VALUES (?, ?)", wordsID, imgID)
-                PrintAdded(splitLine[0] + "'s pic = '" + splitLine[1] + "'", "wordsToImages")
+                PrintAdded(record["display"] + "'s pic = '" + record["image"] + "'", "wordsToImages")
 
-        except Exception:
+        except (Exception, SystemExit):
             pass
 
+    PrintDone("images import")
 
 
-def ImportTitleTemplates(db, fileContents):
+
+def ImportTitleTemplates(db, records):
     """Import title templates and links between title templates and words.
     
     Source file requirements:
@@ -520,48 +539,780 @@ def ImportTitleTemplates(db, fileContents):
     """
 
     # Loop through the file contents importing the data
-    for line in range(len(fileContents)):
-        # If the task has changed, run the next task
-        if "#" == fileContents[line][0]:
-            PrintDone("titles import")
-            ImportToDatabase(db, fileContents[line:])
-            return 
-        
-        # Each line has the format:
-        #   Title template//words
-        splitLine = fileContents[line].split("//")
-        
-        # Even templates without any particular link to words should end in //, so print an error if there aren't 2 array elements
-        if len(splitLine) != 2:
-            exit()
-        
+    for record in records:
         # Add this row's title template to titleTemplates if it doesn't already exist
-        if 0 == db.execute("SELECT COUNT(id) FROM titleTemplates WHERE titleTemplate = ?", splitLine[0])[0]["COUNT(id)"]:
-            db.execute("INSERT INTO titleTemplates(titleTemplate) VALUES(?)", splitLine[0])
-            PrintAdded(splitLine[0], "titleTemplates")
+        if 0 == db.execute("SELECT COUNT(id) FROM titleTemplates WHERE titleTemplate = ?", record["titleTemplate"])[0]["COUNT(id)"]:
+            db.execute("INSERT INTO titleTemplates(titleTemplate) VALUES(?)", record["titleTemplate"])
+            PrintAdded(record["titleTemplate"], "titleTemplates")
         
         # If there's a link to a particular words record, check if it already exists and, if not, create the link
-        if splitLine[1] != "":
+        if record["display"] != None:
             queryStr = "SELECT COUNT(wtt.id) FROM wordsToTitles wtt"
             queryStr += " JOIN words w ON w.id = wtt.words_id"
             queryStr += " JOIN titleTemplates tt ON tt.id = wtt.titleTemplates_id"
             queryStr += " WHERE tt.titleTemplate = ? AND w.display  = ?"
             
-            if 0 == db.execute(queryStr, splitLine[0], splitLine[1])[0]["COUNT(wtt.id)"]:
+            if 0 == db.execute(queryStr, record["titleTemplate"], record["display"])[0]["COUNT(wtt.id)"]:
                 try:
-                    wordsID = GetWordsID(db, splitLine[1])
+                    wordsID = GetWordsID(db, record["display"])
                     titleTemplateID = db.execute("SELECT id FROM titleTemplates WHERE titleTemplate = ?",
-                                                splitLine[0])[0]["id"]
+                                                record["titleTemplate"])[0]["id"]
                     db.execute("INSERT INTO wordsToTitles(words_id, titleTemplates_id) VALUES (?, ?)",
                                 wordsID, titleTemplateID)
-                    PrintAdded("link between " + splitLine[0] + " and " + splitLine[1], "wordsToTitles")
-                except Exception:
+                    PrintAdded("link between " + record["titleTemplate"] + " and " + record["display"], "wordsToTitles")
+                except (Exception, SystemExit):
                     pass
 
     PrintDone("titles import")
 
 
 
+def BulkImportFile(dbPath, srcDataFile, deferIndexes):
+    """Import the contents of a correctly formatted .txt file into the database in a single transaction.
+
+    Keyword arguments:
+    dbPath -- the path to the SQLite database file.
+    srcDataFile -- the path to the .txt file.
+    deferIndexes -- boolean. True = drop the indexes before importing and rebuild them at the end.
+    """
+    with open(srcDataFile, "r") as reader:
+        BulkImportSections(dbPath, ParseSourceFile(reader), deferIndexes)
+
+
+
+def BulkImportSections(dbPath, sections, deferIndexes):
+    """Import a sequence of (table name, records) sections into the database in a single transaction.
+
+    Keyword arguments:
+    dbPath -- the path to the SQLite database file.
+    sections -- an iterable of (table name, iterable of records) pairs, e.g. from ParseSourceFile or OrderSections.
+    deferIndexes -- boolean. True = drop the indexes before importing and rebuild them at the end.
+    """
+    conn = TraceConnection(sqlite3.connect(dbPath))
+    try:
+        # Make sure INSERT OR IGNORE has unique constraints to work with, then load the lookups for names and IDs.
+        # Dropping indexes doesn't start a transaction by itself, so start one first: then the drops, the import and the rebuild
+        # are committed together, and if anything goes wrong the indexes come back with everything else
+        droppedIndexes = []
+        if deferIndexes:
+            conn.execute("BEGIN")
+            droppedIndexes = DropIndexes(conn)
+        else:
+            CreateUniqueIndexes(conn)
+        cache = LoadBulkCache(conn)
+
+        # Import everything, or nothing if it goes wrong part-way through
+        with conn:
+            for myTable, records in sections:
+                BulkImportSection(cache, myTable, records)
+                FlushBulkInserts(conn, cache)
+                PrintDone(myTable + " (bulk)")
+
+            # Rebuild any indexes that were dropped, plus the unique ones (which are new if this is an older database)
+            if deferIndexes:
+                for indexSql in droppedIndexes + GetUniqueIndexSql():
+                    conn.execute(indexSql)
+    finally:
+        conn.close()
+
+
+
+def BulkImportSection(cache, myTable, records):
+    """Queue up the inserts for one section of a .txt file, following the same rules as the one-row-at-a-time import functions."""
+    # As with the one-row-at-a-time import, choice groups which already exist are skipped entirely
+    importIsActive = False
+
+    for record in records:
+        if record["type"] == "name":
+            BulkGetIdFromName(cache, myTable, record["name"], True)
+
+        elif record["type"] == "pronounGroup":
+            BulkGetIdFromName(cache, "pronounGroups", record["name"], True)
+
+        elif record["type"] == "pronounGroupMember":
+            BulkAddLink(cache, "pronounGroupMembers", (BulkGetIdFromName(cache, "pronounGroups", record["group"], False), BulkGetWordsID(cache, record["pronoun"])))
+
+        elif record["type"] == "category":
+            BulkGetIdFromName(cache, "categories", record["name"], True)
+
+        elif record["type"] == "word":
+            categoryID = BulkGetIdFromName(cache, "categories", record["category"], True)
+            if (categoryID, record["display"]) not in cache["wordKeys"]:
+                BulkAddWords(cache, categoryID, record["display"])
+
+        elif record["type"] == "pronounSet":
+            BulkAddLink(cache, "pronounSets", (BulkGetWordsID(cache, record["subject"], catName="pronoun"), BulkGetWordsID(cache, record["object"], catName="pronoun")))
+
+        elif record["type"] == "infinitive":
+            BulkGetIdFromName(cache, "infinitives", record["name"], False)
+
+        elif record["type"] == "verb":
+            infID = BulkGetIdFromName(cache, "infinitives", record["infinitive"], False)
+            pronounGrpID = BulkGetIdFromName(cache, "pronounGroups", record["pronounGroup"], False)
+            BulkAddLink(cache, "verbs", (infID, pronounGrpID, BulkGetWordsID(cache, record["display"], catName="verb")))
+
+        elif record["type"] == "character":
+            BulkGetWordsID(cache, record["display"])
+
+        elif record["type"] == "characterSettings":
+            characterID = BulkGetWordsID(cache, record["character"])
+            for var in record["pronouns"]:
+                BulkAddLink(cache, "charactersToPronouns", (characterID, BulkGetWordsID(cache, var)))
+            for var in record["hometowns"]:
+                BulkAddLink(cache, "charactersToHometowns", (characterID, BulkGetWordsID(cache, var, catName="location")))
+
+        elif record["type"] == "choiceGroup":
+            importIsActive = record["name"] not in cache["names"]["choiceGroups"]
+            if importIsActive:
+                BulkGetIdFromName(cache, "choiceGroups", record["name"], True)
+
+        elif record["type"] == "probability" and importIsActive:
+            choiceGroupID = cache["names"]["choiceGroups"][record["choiceGroup"]]
+            wordsID = None if record["word"] == None else BulkGetWordsID(cache, record["word"])
+            categoryID = None if record["category"] == None else BulkGetIdFromName(cache, "categories", record["category"], False)
+            BulkInsert(cache, "probabilities", (choiceGroupID, record["probability"], record["note"], wordsID, categoryID, record["prefixStr"]))
+
+        elif record["type"] == "image":
+            if record["name"] not in cache["names"]["images"]:
+                cache["names"]["images"][record["name"]] = BulkInsert(cache, "images", (record["name"], record["filename"], record["fextension"]))
+
+        elif record["type"] == "wordsToImage":
+            # As with the one-row-at-a-time import, links to words or images which don't exist are skipped
+            if record["display"] in cache["words"] and record["image"] in cache["names"]["images"]:
+                BulkAddLink(cache, "wordsToImages", (cache["words"][record["display"]], cache["names"]["images"][record["image"]]))
+
+        elif record["type"] == "titleTemplate":
+            if record["titleTemplate"] not in cache["titleTemplates"]:
+                cache["titleTemplates"][record["titleTemplate"]] = BulkInsert(cache, "titleTemplates", (record["titleTemplate"],))
+            if record["display"] != None and record["display"] in cache["words"]:
+                BulkAddLink(cache, "wordsToTitles", (cache["words"][record["display"]], cache["titleTemplates"][record["titleTemplate"]]))
+
+
+
+def LoadBulkCache(conn, wordDisplays=None):
+    """Return a dictionary holding everything bulk mode needs to look up IDs and spot duplicates without querying the database.
+
+    Keyword arguments:
+    conn -- a sqlite3 connection to the database.
+    wordDisplays -- optional set of display text. If given, only the words with that display text are loaded and the existing
+                    links are left out (INSERT OR IGNORE still skips them), so a small import into a big database reads very little.
+    """
+    cache = {}
+
+    # Name => ID for each table with a name column
+    cache["names"] = {}
+    for table in ["categories", "choiceGroups", "infinitives", "pronounGroups", "images"]:
+        cache["names"][table] = {name: rowID for rowID, name in conn.execute("SELECT id, name FROM " + GetSafeTableName(table) + " ORDER BY id DESC")}
+
+    # Words by display text (keeping the lowest ID, like GetWordsID), plus every (category, display) combination
+    cache["words"] = {}
+    cache["wordKeys"] = set()
+    wordsStr = "SELECT id, categories_id, display FROM words ORDER BY id DESC"
+    if wordDisplays != None:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS bulkWords(display TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.bulkWords")
+        conn.executemany("INSERT OR IGNORE INTO temp.bulkWords(display) VALUES (?)", [(display,) for display in sorted(wordDisplays)])
+        wordsStr = "SELECT id, categories_id, display FROM words WHERE display IN (SELECT display FROM temp.bulkWords) ORDER BY id DESC"
+
+    for rowID, categoryID, display in conn.execute(wordsStr):
+        cache["words"][display] = rowID
+        cache["wordKeys"].add((categoryID, display))
+
+    cache["titleTemplates"] = {template: rowID for rowID, template in conn.execute("SELECT id, titleTemplate FROM titleTemplates ORDER BY id DESC")}
+
+    # Every existing link, so duplicates can be skipped before they reach the database
+    cache["links"] = {}
+    for table in LINK_TABLES:
+        if wordDisplays != None:
+            cache["links"][table] = set()
+        else:
+            cache["links"][table] = set(conn.execute("SELECT " + ", ".join(BULK_COLUMNS[table]) + " FROM " + GetSafeTableName(table)))
+
+    # IDs are assigned here rather than by SQLite, so rows can be batched up and still be referred to straight away
+    cache["nextID"] = {}
+    cache["pending"] = {}
+    for table in BULK_COLUMNS:
+        cache["nextID"][table] = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM " + GetSafeTableName(table)).fetchone()[0]
+        cache["pending"][table] = []
+
+    return cache
+
+
+
+def BulkInsert(cache, table, values):
+    """Queue up a new row for a table, returning the ID it will have."""
+    rowID = cache["nextID"][table]
+    cache["nextID"][table] += 1
+    cache["pending"][table].append((rowID,) + tuple(values))
+    return rowID
+
+
+
+def BulkAddLink(cache, table, values):
+    """Queue up a new row for a link table, unless the same link already exists."""
+    if values not in cache["links"][table]:
+        cache["links"][table].add(values)
+        BulkInsert(cache, table, values)
+
+
+
+def BulkAddWords(cache, categoryID, display):
+    """Queue up a new words record, returning its ID."""
+    rowID = BulkInsert(cache, "words", (categoryID, display))
+    cache["wordKeys"].add((categoryID, display))
+    cache["words"].setdefault(display, rowID)
+    return rowID
+
+
+
+def BulkGetIdFromName(cache, tableCode, targetName, wantToAddNew):
+    """Bulk mode version of GetIdFromName. Raise a LookupError if the name doesn't exist and wantToAddNew is False."""
+    names = cache["names"][GetSafeTableName(tableCode)]
+    if targetName not in names:
+        if not wantToAddNew:
+            raise LookupError("'" + targetName + "' not found in " + tableCode)
+        names[targetName] = BulkInsert(cache, tableCode, (targetName,))
+
+    return names[targetName]
+
+
+
+def BulkGetWordsID(cache, theWords, **kwargs):
+    """Bulk mode version of GetWordsID. Raise a LookupError if the words don't exist and no catName was given."""
+    if theWords not in cache["words"]:
+        if "catName" not in kwargs:
+            raise LookupError("'" + theWords + "' not found in words")
+        BulkAddWords(cache, BulkGetIdFromName(cache, "categories", kwargs.get("catName"), True), theWords)
+
+    return cache["words"][theWords]
+
+
+
+def FlushBulkInserts(conn, cache):
+    """Send all the queued rows to the database, one executemany per table."""
+    for table, rows in cache["pending"].items():
+        if len(rows) > 0:
+            columns = ["id"] + BULK_COLUMNS[table]
+            insertStr = "INSERT OR IGNORE INTO " + GetSafeTableName(table) + "(" + ", ".join(columns) + ") VALUES (" + ", ".join(["?"] * len(columns)) + ")"
+            conn.executemany(insertStr, rows)
+            cache["pending"][table] = []
+
+
+
+def CreateUniqueIndexes(conn):
+    """Add the unique indexes which bulk mode relies on, if they don't already exist."""
+    with conn:
+        for indexSql in GetUniqueIndexSql():
+            conn.execute(indexSql)
+
+
+
+def GetUniqueIndexSql():
+    """Return a list of the SQL needed to add each of the unique indexes which bulk mode relies on, if it doesn't already exist."""
+    return ["CREATE UNIQUE INDEX IF NOT EXISTS " + table + "_unique ON " + GetSafeTableName(table) + "(" + ", ".join(columns) + ")"
+            for table, columns in UNIQUE_KEYS.items()]
+
+
+
+def DropIndexes(conn):
+    """Drop every index on the database, returning a list of the SQL needed to recreate them.
+    Nothing is committed: the caller should already have started a transaction, so the drops can be rolled back."""
+    indexes = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall()
+    for name, indexSql in indexes:
+        conn.execute('DROP INDEX "' + name.replace('"', '""') + '"')
+
+    return [indexSql for name, indexSql in indexes]
+
+
+
+def SyncDirectory(dbPath, srcDir):
+    """Make the database match the .txt files in a directory, applying only the inserts and deletes needed since the last sync.
+
+    Keyword arguments:
+    dbPath -- the path to the SQLite database file.
+    srcDir -- the directory containing the .txt files.
+
+    The sync tables hold a hash of each file, a hash of each section and the facts (see SectionFacts) that each section adds.
+    Files with the same hash as last time aren't parsed, and sections with the same hash as last time are left alone.
+    Otherwise the old and new facts are compared: new facts are imported, and facts which have gone from every section are
+    deleted, along with the rows which rely on them (e.g. deleting a words record deletes its wordsToImages, wordsToTitles and
+    charactersToHometowns links). Everything happens in a single transaction. The first sync only adds: it adopts whatever
+    is already in the database.
+    """
+    srcDataFiles = {os.path.basename(path): path for path in sorted(glob.glob(os.path.join(srcDir, "*.txt")))}
+
+    # A missing or mistyped directory would otherwise look like every file had been removed
+    if len(srcDataFiles) == 0:
+        raise ValueError("no .txt files found in " + srcDir)
+
+    conn = TraceConnection(sqlite3.connect(dbPath))
+    try:
+        CreateUniqueIndexes(conn)
+        CreateSyncTables(conn)
+
+        # Only new files and files with a different hash need parsing
+        oldHashes = {filename: fileHash for filename, fileHash in conn.execute("SELECT filename, hash FROM syncFiles")}
+        fileHashes = {filename: HashFile(path) for filename, path in srcDataFiles.items()}
+        changedFiles = [filename for filename in srcDataFiles if oldHashes.get(filename) != fileHashes[filename]]
+        removedFiles = [filename for filename in oldHashes if filename not in srcDataFiles]
+
+        if len(changedFiles) == 0 and len(removedFiles) == 0:
+            print("Synced " + srcDir + ": nothing has changed.")
+            return
+
+        with ProcessPoolExecutor() as executor:
+            parsedFiles = list(zip(changedFiles, executor.map(ParseFileSections, [srcDataFiles[filename] for filename in changedFiles])))
+
+        with conn:
+            changes = UpdateSyncState(conn, parsedFiles, fileHashes, removedFiles)
+
+            # Delete the facts which have gone from every section (the sync tables are already up to date, so they can be asked)
+            changesBefore = conn.total_changes
+            DeleteFacts(conn, changes["droppedFacts"] - changes["addedFacts"], changes["addedFacts"])
+            deletedCount = conn.total_changes - changesBefore
+
+            # Optional links were skipped if their words or image didn't exist. If any of those are new, the links can go in now
+            restoredLinks = GetOptionalLinks(conn, GetFactRecords(changes["addedFacts"] - changes["droppedFacts"]), changes["newSectionIDs"])
+
+            # Import the records with new facts. Only the words they mention need to be looked up
+            wordDisplays = set(name for filename, sections in changes["reimports"] for myTable, records in sections
+                               for fact in SectionFacts(records) for table, name in FactRecords(fact) if table == "words")
+            wordDisplays.update(name for fact in restoredLinks for table, name in FactRecords(fact) if table == "words")
+            wordDisplays.update(record["display"] for filename, sections in changes["reimports"] for myTable, records in sections
+                                for record in records if record["type"] == "character")
+            cache = LoadBulkCache(conn, wordDisplays)
+
+            for myTable, records in OrderSections(changes["reimports"]):
+                BulkImportSection(cache, myTable, records)
+                FlushBulkInserts(conn, cache)
+
+                # Images are matched by name, so a new filename has to be updated in place
+                for record in records:
+                    if record["type"] == "image":
+                        conn.execute("UPDATE images SET filename = ?, fextension = ? WHERE name = ?", (record["filename"], record["fextension"], record["name"]))
+
+            for fact in restoredLinks:
+                BulkImportSection(cache, fact[0], [LinkFactRecord(fact)])
+            FlushBulkInserts(conn, cache)
+    finally:
+        conn.close()
+
+    print("Synced " + srcDir + ": " + str(len(changedFiles)) + " changed and " + str(len(removedFiles)) + " removed out of "
+          + str(len(srcDataFiles)) + " files; " + str(len(changes["addedFacts"])) + " new facts imported; " + str(deletedCount) + " rows deleted.")
+
+
+
+def UpdateSyncState(conn, parsedFiles, fileHashes, removedFiles):
+    """Update the sync tables to describe the changed and removed files, returning a dictionary of what's different.
+
+    Keyword arguments:
+    conn -- a sqlite3 connection to the database.
+    parsedFiles -- a list of (filename, list of (table name, list of records)) pairs for the changed files.
+    fileHashes -- dictionary of filename => hash.
+    removedFiles -- a list of the filenames which have gone.
+
+    Keys in the returned dictionary:
+    droppedFacts -- set of the facts which have gone from a section
+    addedFacts -- set of the facts which are new to a section
+    newSectionIDs -- set of syncSections IDs for the sections which didn't replace an old one
+    reimports -- list of (filename, list of (table name, list of records)) pairs: the records with new facts, for each changed file
+    """
+    changes = {"droppedFacts": set(), "addedFacts": set(), "newSectionIDs": set(), "reimports": []}
+
+    for filename, fileSections in parsedFiles:
+        fileID = conn.execute("SELECT id FROM syncFiles WHERE filename = ?", (filename,)).fetchone()
+        if fileID == None:
+            fileID = conn.execute("INSERT INTO syncFiles(filename, hash) VALUES (?, ?)", (filename, fileHashes[filename])).lastrowid
+        else:
+            fileID = fileID[0]
+            conn.execute("UPDATE syncFiles SET hash = ? WHERE id = ?", (fileHashes[filename], fileID))
+
+        # Sections with the same table and hash as last time are left alone
+        oldSections = {}
+        for sectionID, myTable, sectionHash in conn.execute("SELECT id, tableName, hash FROM syncSections WHERE syncFiles_id = ? ORDER BY id", (fileID,)):
+            oldSections.setdefault((myTable, sectionHash), []).append(sectionID)
+
+        newSections = []
+        for myTable, records in fileSections:
+            section = {"table": myTable, "records": records, "facts": SectionFacts(records)}
+            section["json"] = json.dumps(section["facts"])
+            section["hash"] = HashSection(myTable, section["json"])
+            if len(oldSections.get((myTable, section["hash"]), [])) > 0:
+                oldSections[(myTable, section["hash"])].pop(0)
+            else:
+                newSections.append(section)
+
+        # The rest are paired up with an old section for the same table (in file order), if there is one, so only the facts which differ change
+        unmatched = {}
+        for (myTable, sectionHash), sectionIDs in oldSections.items():
+            unmatched.setdefault(myTable, []).extend(sectionIDs)
+
+        changedSections = []
+        for section in newSections:
+            if len(unmatched.get(section["table"], [])) > 0:
+                unmatched[section["table"]].sort()
+                droppedFacts, addedFacts = ReplaceSyncSection(conn, unmatched[section["table"]].pop(0), section)
+                changes["droppedFacts"].update(droppedFacts)
+                changedSections.append((section["table"], FilterRecords(section["records"], addedFacts)))
+            else:
+                changes["newSectionIDs"].add(AddSyncSection(conn, fileID, section))
+                addedFacts = section["facts"]
+                changedSections.append((section["table"], section["records"]))
+            changes["addedFacts"].update(addedFacts)
+
+        changes["reimports"].append((filename, changedSections))
+
+        # Anything left over has been removed from the file
+        for sectionIDs in unmatched.values():
+            for sectionID in sectionIDs:
+                changes["droppedFacts"].update(DropSyncSection(conn, sectionID))
+
+    for filename in removedFiles:
+        for (sectionID,) in conn.execute("SELECT s.id FROM syncSections s JOIN syncFiles f ON f.id = s.syncFiles_id WHERE f.filename = ?", (filename,)).fetchall():
+            changes["droppedFacts"].update(DropSyncSection(conn, sectionID))
+        conn.execute("DELETE FROM syncFiles WHERE filename = ?", (filename,))
+
+    return changes
+
+
+
+def AddSyncSection(conn, fileID, section):
+    """Add a section, its facts and the records they add or rely on to the sync tables, returning the new syncSections ID."""
+    sectionID = conn.execute("INSERT INTO syncSections(syncFiles_id, tableName, hash, facts) VALUES (?, ?, ?, ?)",
+                             (fileID, section["table"], section["hash"], section["json"])).lastrowid
+
+    # Sorted rows go into the index much faster than rows in random order
+    conn.executemany("INSERT INTO syncRecords(syncSections_id, tableName, name, optional, uses) VALUES (?, ?, ?, ?, ?)",
+                     [(sectionID,) + record + (uses,) for record, uses in sorted(SectionRecords(section["facts"]).items())])
+    return sectionID
+
+
+
+def ReplaceSyncSection(conn, sectionID, section):
+    """Replace the hash and facts for a section in the sync tables, returning a pair of sets: (facts dropped, facts added)."""
+    oldFacts = set(LoadSectionFacts(conn, sectionID))
+    facts = set(section["facts"])
+    droppedFacts = oldFacts - facts
+    addedFacts = facts - oldFacts
+    conn.execute("UPDATE syncSections SET hash = ?, facts = ? WHERE id = ?", (section["hash"], section["json"], sectionID))
+
+    # Only the records used by the dropped and added facts change: adjust their counts, then remove any which are no longer used
+    uses = SectionRecords(addedFacts)
+    for record, count in SectionRecords(droppedFacts).items():
+        uses[record] = uses.get(record, 0) - count
+
+    upsertStr = "INSERT INTO syncRecords(syncSections_id, tableName, name, optional, uses) VALUES (?, ?, ?, ?, ?)"
+    upsertStr += " ON CONFLICT(tableName, name, optional, syncSections_id) DO UPDATE SET uses = uses + excluded.uses"
+    conn.executemany(upsertStr, [(sectionID,) + record + (count,) for record, count in sorted(uses.items()) if count != 0])
+    conn.executemany("DELETE FROM syncRecords WHERE tableName = ? AND name = ? AND optional = ? AND syncSections_id = ? AND uses <= 0",
+                     [record + (sectionID,) for record, count in uses.items() if count < 0])
+
+    return droppedFacts, addedFacts
+
+
+
+def DropSyncSection(conn, sectionID):
+    """Remove a section from the sync tables, returning a list of the facts it had."""
+    facts = LoadSectionFacts(conn, sectionID)
+    conn.execute("DELETE FROM syncRecords WHERE syncSections_id = ?", (sectionID,))
+    conn.execute("DELETE FROM syncSections WHERE id = ?", (sectionID,))
+    return facts
+
+
+
+def LoadSectionFacts(conn, sectionID):
+    """Return a list of the facts stored in the sync tables for a section."""
+    return [FreezeFact(fact) for fact in json.loads(conn.execute("SELECT facts FROM syncSections WHERE id = ?", (sectionID,)).fetchone()[0])]
+
+
+
+def SectionRecords(facts):
+    """Return a dictionary of (table, name, optional) => the number of facts which add or rely on that record, for the syncRecords table.
+
+    Each link fact is also a record in its own right, so it's possible to ask whether any other section has the same link.
+    """
+    records = {}
+    for fact in facts:
+        optional = fact[0] in OPTIONAL_LINK_TABLES
+        keys = [(table, name, optional) for table, name in FactRecords(fact)]
+        if fact[0] in LINK_FACT_COLUMNS:
+            keys.append(LinkFactKey(fact) + (False,))
+
+        for key in keys:
+            records[key] = records.get(key, 0) + 1
+
+    return records
+
+
+
+def SectionFacts(records):
+    """Return a list of the facts added by a section's records.
+
+    A fact is a tuple describing a row by names and display text, rather than by IDs, starting with the table name.
+    e.g. ("words", "animal", "dog"); ("wordsToImages", "dog", "dogPicture")
+    Probabilities are described as a single fact for each choice group, since each group's probabilities only make sense as a whole.
+    """
+    facts = []
+    choiceGroups = {}
+    activeGroup = None
+
+    for record in records:
+        if record["type"] == "choiceGroup":
+            # As with the import, a repeated choice group is skipped
+            activeGroup = None if record["name"] in choiceGroups else record["name"]
+            if activeGroup != None:
+                choiceGroups[activeGroup] = []
+
+        elif record["type"] == "probability":
+            if activeGroup != None:
+                choiceGroups[activeGroup].append((record["probability"], record["note"], record["word"], record["category"], record["prefixStr"]))
+
+        else:
+            facts.extend(RecordFacts(record))
+
+    facts.extend(("choiceGroups", name, tuple(rows)) for name, rows in choiceGroups.items())
+
+    # Remove duplicates, keeping the order
+    return list(dict.fromkeys(facts))
+
+
+
+def RecordFacts(record):
+    """Return a list of the facts added by a single record (apart from probabilities, which SectionFacts groups together)."""
+    if record["type"] == "name":
+        return [("infinitives", record["name"])]
+
+    elif record["type"] == "pronounGroup":
+        return [("pronounGroups", record["name"])]
+
+    elif record["type"] == "pronounGroupMember":
+        return [("pronounGroupMembers", record["group"], record["pronoun"])]
+
+    elif record["type"] == "category":
+        return [("categories", record["name"])]
+
+    elif record["type"] == "word":
+        return [("words", record["category"], record["display"])]
+
+    elif record["type"] == "pronounSet":
+        return [("pronounSets", record["subject"], record["object"])]
+
+    elif record["type"] == "verb":
+        return [("verbs", record["infinitive"], record["pronounGroup"], record["display"])]
+
+    elif record["type"] == "characterSettings":
+        return ([("charactersToPronouns", record["character"], var) for var in record["pronouns"]]
+                + [("charactersToHometowns", record["character"], var) for var in record["hometowns"]])
+
+    elif record["type"] == "image":
+        return [("images", record["name"], record["filename"], record["fextension"])]
+
+    elif record["type"] == "wordsToImage":
+        return [("wordsToImages", record["display"], record["image"])]
+
+    elif record["type"] == "titleTemplate":
+        facts = [("titleTemplates", record["titleTemplate"])]
+        if record["display"] != None:
+            facts.append(("wordsToTitles", record["display"], record["titleTemplate"]))
+        return facts
+
+    return []
+
+
+
+def FilterRecords(records, addedFacts):
+    """Return the records from a section which add any of the facts, along with the group records (e.g. "~category") above them."""
+    if len(addedFacts) == 0:
+        return []
+
+    addedChoiceGroups = set(fact[1] for fact in addedFacts if fact[0] == "choiceGroups")
+    filtered = []
+    for record in records:
+        if record["type"] in ["category", "pronounGroup", "infinitive", "character", "choiceGroup"]:
+            filtered.append(record)
+        elif record["type"] == "probability":
+            if record["choiceGroup"] in addedChoiceGroups:
+                filtered.append(record)
+        elif not addedFacts.isdisjoint(RecordFacts(record)):
+            filtered.append(record)
+
+    return filtered
+
+
+
+def FactRecords(fact):
+    """Return a list of (table, name) pairs for the records which a fact adds or refers to.
+
+    e.g. ("verbs", "to work", "she/he/it", "works") refers to the infinitive "to work", the pronoun group "she/he/it" and the words "works".
+    """
+    if fact[0] in LINK_FACT_COLUMNS:
+        return [(lookupTable, value) for (column, lookupTable, lookupColumn), value in zip(LINK_FACT_COLUMNS[fact[0]], fact[1:])]
+
+    elif fact[0] == "words":
+        return [("categories", fact[1]), ("words", fact[2])]
+
+    elif fact[0] == "choiceGroups":
+        records = [("choiceGroups", fact[1])]
+        for probability, note, word, category, prefixStr in fact[2]:
+            if word != None:
+                records.append(("words", word))
+            if category != None:
+                records.append(("categories", category))
+        return records
+
+    else:
+        return [fact[:2]]
+
+
+
+def GetFactRecords(facts):
+    """Return the set of (table, name) pairs for every record which a collection of facts adds or relies on (ignoring optional links)."""
+    records = set()
+    for fact in facts:
+        if fact[0] not in OPTIONAL_LINK_TABLES:
+            records.update(FactRecords(fact))
+
+    return records
+
+
+
+def LinkFactKey(fact):
+    """Return the (table, name) pair which stands for a link fact in the syncRecords table."""
+    return (fact[0], json.dumps(fact[1:]))
+
+
+
+def RecordIsUsed(conn, table, name):
+    """Return boolean indicating if any fact in the sync tables adds or relies on this record (ignoring optional links)."""
+    return conn.execute("SELECT 1 FROM syncRecords WHERE tableName = ? AND name = ? AND optional = 0 LIMIT 1", (table, name)).fetchone() != None
+
+
+
+def GetOptionalLinks(conn, records, newSectionIDs):
+    """Return the set of optional link facts which refer to any of the records, apart from those in brand new sections (which are imported anyway)."""
+    # Usually there aren't any such sections (e.g. on the first sync), in which case there's nothing to look for
+    sectionIDs = [sectionID for (sectionID,) in conn.execute("SELECT DISTINCT syncSections_id FROM syncRecords WHERE optional = 1") if sectionID not in newSectionIDs]
+    if len(sectionIDs) == 0:
+        return set()
+
+    # Narrow it down to the sections with optional links to any of the records, then pick those links out of their facts
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS syncAdded(tableName TEXT, name TEXT)")
+    conn.execute("DELETE FROM temp.syncAdded")
+    conn.executemany("INSERT INTO temp.syncAdded(tableName, name) VALUES (?, ?)", sorted(records))
+
+    queryStr = "SELECT DISTINCT r.syncSections_id FROM temp.syncAdded a"
+    queryStr += " JOIN syncRecords r ON r.tableName = a.tableName AND r.name = a.name AND r.optional = 1"
+    sectionIDs = [sectionID for (sectionID,) in conn.execute(queryStr) if sectionID not in newSectionIDs]
+
+    links = set()
+    for sectionID in sectionIDs:
+        for fact in LoadSectionFacts(conn, sectionID):
+            if fact[0] in OPTIONAL_LINK_TABLES and not records.isdisjoint(FactRecords(fact)):
+                links.add(fact)
+
+    return links
+
+
+
+def LinkFactRecord(fact):
+    """Turn an optional link fact back into the record that the import functions expect."""
+    if fact[0] == "wordsToImages":
+        return {"type": "wordsToImage", "display": fact[1], "image": fact[2]}
+
+    return {"type": "titleTemplate", "titleTemplate": fact[2], "display": fact[1]}
+
+
+
+def DeleteFacts(conn, removedFacts, addedFacts):
+    """Delete the rows for facts which have gone from the .txt files, along with anything that relies on them.
+
+    Keyword arguments:
+    conn -- a sqlite3 connection to the database. The sync tables must already describe the current .txt files.
+    removedFacts -- facts which have gone from a section, and weren't added to another one.
+    addedFacts -- facts which are about to be imported.
+    """
+    # Each link fact is a single row, which can go unless another section has the same link
+    for fact in removedFacts:
+        if fact[0] in LINK_FACT_COLUMNS and not RecordIsUsed(conn, *LinkFactKey(fact)):
+            whereStr = " AND ".join(column + " IN (SELECT id FROM " + GetSafeTableName(lookupTable) + " WHERE " + lookupColumn + " = ?)"
+                                    for column, lookupTable, lookupColumn in LINK_FACT_COLUMNS[fact[0]])
+            conn.execute("DELETE FROM " + GetSafeTableName(fact[0]) + " WHERE " + whereStr, fact[1:])
+
+    # A changed choice group is deleted as a whole, so the import can add it again
+    addedChoiceGroups = set(fact[1] for fact in addedFacts if fact[0] == "choiceGroups")
+    for fact in removedFacts:
+        if fact[0] == "choiceGroups" and fact[1] in addedChoiceGroups:
+            DeleteRecord(conn, "choiceGroups", fact[1])
+
+    # Then any records which the removed facts added or relied on, if nothing else needs them
+    candidates = GetFactRecords(removedFacts)
+    for table in RECORD_NAME_COLUMNS:
+        for recordTable, name in candidates:
+            if recordTable == table and not RecordIsUsed(conn, table, name):
+                DeleteRecord(conn, table, name)
+
+
+
+def DeleteRecord(conn, table, name):
+    """Delete the records in a table with the given name (or display text), along with any rows which refer to them."""
+    safeTableName = GetSafeTableName(table)
+    whereStr = " WHERE " + RECORD_NAME_COLUMNS[table] + " = ?"
+
+    # Categories can be shared with words added on the fly (e.g. "location"), so only delete them once nothing uses them
+    if table == "categories":
+        conn.execute("DELETE FROM categories" + whereStr + " AND id NOT IN (SELECT categories_id FROM words)"
+                     + " AND id NOT IN (SELECT categories_id FROM probabilities WHERE categories_id IS NOT NULL)", (name,))
+        return
+
+    for refTable, columns in RECORD_REFERENCES[table].items():
+        for column in columns:
+            conn.execute("DELETE FROM " + GetSafeTableName(refTable) + " WHERE " + column + " IN (SELECT id FROM " + safeTableName + whereStr + ")", (name,))
+
+    conn.execute("DELETE FROM " + safeTableName + whereStr, (name,))
+
+
+
+def CreateSyncTables(conn):
+    """Add the tables which sync mode uses to remember what it imported, if they don't already exist."""
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS syncFiles(id INTEGER PRIMARY KEY, filename TEXT NOT NULL UNIQUE, hash TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS syncSections(id INTEGER PRIMARY KEY, syncFiles_id INTEGER NOT NULL, tableName TEXT NOT NULL,"
+                     + " hash TEXT NOT NULL, facts TEXT NOT NULL, FOREIGN KEY(syncFiles_id) REFERENCES syncFiles(id))")
+        conn.execute("CREATE TABLE IF NOT EXISTS syncRecords(id INTEGER PRIMARY KEY, syncSections_id INTEGER NOT NULL, tableName TEXT NOT NULL,"
+                     + " name TEXT NOT NULL, optional INTEGER NOT NULL, uses INTEGER NOT NULL, FOREIGN KEY(syncSections_id) REFERENCES syncSections(id))")
+        conn.execute("CREATE INDEX IF NOT EXISTS syncRecords_section ON syncRecords(syncSections_id)")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS syncRecords_record ON syncRecords(tableName, name, optional, syncSections_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS syncSections_file ON syncSections(syncFiles_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS syncRecords_optional ON syncRecords(optional, syncSections_id)")
+
+
+
+def FreezeFact(fact):
+    """Turn a fact loaded from JSON back into a tuple (JSON has no tuples, so they come back as lists)."""
+    if fact[0] == "choiceGroups":
+        return (fact[0], fact[1], tuple(tuple(row) for row in fact[2]))
+
+    return tuple(fact)
+
+
+
+def HashFile(path):
+    """Return a hash of a file's contents."""
+    fileHash = hashlib.sha1()
+    with open(path, "rb") as reader:
+        for block in iter(lambda: reader.read(65536), b""):
+            fileHash.update(block)
+
+    return fileHash.hexdigest()
+
+
+
+def HashSection(myTable, factsJson):
+    """Return a hash of a section's table name and facts (as JSON)."""
+    return hashlib.sha1((myTable + "\n" + factsJson).encode()).hexdigest()
+
+
+
 def GetIdFromName(db, tableCode, targetName, wantToAddNew):
     """Return an ID in one of the hallmark.db tables, based on the 'name'.
     
@@ -634,6 +1385,5 @@ def PrintAdded(whatWasAdded, toTable):
 
 
 
-main()
-
-
+if __name__ == "__main__":
+    main()
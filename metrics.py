@@ -0,0 +1,233 @@
+# Lightweight timing and fallback counters for plot generation, reported in the Prometheus text format.
+# Nothing is timed until EnableMetrics is called. Until then the stages are the plain, unwrapped functions, so they cost nothing extra
+import bisect
+import functools
+import sys
+import threading
+import time
+
+
+# Declare some globals
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+STAGE_METRIC = "hallmark_stage_seconds"
+FALLBACK_METRIC = "hallmark_fallbacks_total"
+
+# Description of each metric, for the # HELP lines
+METRIC_HELP = {STAGE_METRIC: "Time spent in each stage of plot generation, including any stages it calls",
+               "hallmark_choice_group_seconds": "Time spent in ProbabilitiesPick, by choice group",
+               FALLBACK_METRIC: "Times a stage gave up and fell back to a default (blank text, default pics or titles, etc.)"}
+
+_metrics = {"enabled": False, "stages": [], "histograms": {}, "counters": {}}
+_metricsLock = threading.Lock()
+
+# Per-thread settings. "untimed" marks a thread whose stages aren't timed (see ExcludeThreadFromTiming)
+_threadSettings = threading.local()
+
+
+
+def TimedStage(labelPos=None, labelName=None):
+    """Return a decorator which registers a function as a stage of plot generation, to be timed while metrics are enabled.
+
+    Keyword arguments:
+    labelPos -- optional. The position of an argument to break the timings down by, e.g. 1 for ProbabilitiesPick's choice group name
+    labelName -- the label for that argument. Its timings go in a histogram named hallmark_<labelName>_seconds
+
+    The function comes back untouched: EnableMetrics swaps a timed version into its module, and DisableMetrics swaps it back.
+    Only calls which look the function up in its module are timed, so a stage imported by name into another module isn't.
+    """
+    def Register(func):
+        stage = {"module": func.__module__, "name": func.__name__, "func": func, "labelPos": labelPos, "labelName": labelName}
+        _metrics["stages"].append(stage)
+
+        # Stages defined after metrics were enabled need timing straight away
+        if _metrics["enabled"]:
+            return CreateTimedStage(stage)
+        return func
+
+    return Register
+
+
+
+
+def EnableMetrics():
+    """Start timing every stage and counting fallbacks."""
+    with _metricsLock:
+        if _metrics["enabled"]:
+            return
+        _metrics["enabled"] = True
+
+    for stage in _metrics["stages"]:
+        setattr(sys.modules[stage["module"]], stage["name"], CreateTimedStage(stage))
+
+
+
+
+def DisableMetrics():
+    """Stop timing and counting, putting the plain functions back. Anything recorded so far is kept."""
+    _metrics["enabled"] = False
+    for stage in _metrics["stages"]:
+        setattr(sys.modules[stage["module"]], stage["name"], stage["func"])
+
+
+
+
+def ExcludeThreadFromTiming():
+    """Stop timing the stages the calling thread runs, e.g. for a background thread whose work would otherwise show up
+    alongside the requests' in the latency histograms. Its fallbacks are still counted."""
+    _threadSettings.untimed = True
+
+
+
+
+def MetricsEnabled():
+    """Return boolean indicating if metrics are being recorded."""
+    return _metrics["enabled"]
+
+
+
+
+def ResetMetrics():
+    """Throw away everything recorded so far."""
+    # Timed stages hold on to their histograms, so empty them rather than replacing them
+    with _metricsLock:
+        for histogram in _metrics["histograms"].values():
+            histogram["buckets"] = [0] * (len(LATENCY_BUCKETS) + 1)
+            histogram["sum"] = 0.0
+            histogram["count"] = 0
+        _metrics["counters"] = {}
+
+
+
+
+def CreateTimedStage(stage):
+    """Return a version of a stage's function which records how long each call takes."""
+    # Look the histograms up once, rather than on every call
+    func = stage["func"]
+    labelPos = stage["labelPos"]
+    stageHistogram = GetHistogram(STAGE_METRIC, (("stage", stage["name"]),))
+    labelHistograms = {}
+
+    @functools.wraps(func)
+    def TimedFunc(*args, **kwargs):
+        if getattr(_threadSettings, "untimed", False):
+            return func(*args, **kwargs)
+
+        startTime = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - startTime
+            RecordLatency(stageHistogram, seconds)
+            if labelPos != None and len(args) > labelPos:
+                labelHistogram = labelHistograms.get(args[labelPos])
+                if labelHistogram == None:
+                    labelHistogram = GetHistogram("hallmark_" + stage["labelName"] + "_seconds", ((stage["labelName"], str(args[labelPos])),))
+                    labelHistograms[args[labelPos]] = labelHistogram
+                RecordLatency(labelHistogram, seconds)
+
+    return TimedFunc
+
+
+
+
+def GetHistogram(metric, labels):
+    """Return the histogram for one series of a metric, creating it if it's new.
+
+    Keyword arguments:
+    metric -- the histogram's name
+    labels -- a tuple of (label name, value) pairs, picking out one series of the histogram
+    """
+    with _metricsLock:
+        histogram = _metrics["histograms"].get((metric, labels))
+        if histogram == None:
+            histogram = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0, "count": 0}
+            _metrics["histograms"][(metric, labels)] = histogram
+
+    return histogram
+
+
+
+
+def RecordLatency(histogram, seconds):
+    """Add one timing to a histogram from GetHistogram."""
+    bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _metricsLock:
+        histogram["buckets"][bucket] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+
+
+
+def CountFallback(fallback):
+    """Count one use of a fallback path, if metrics are enabled. Only called when something has gone wrong (a lookup failed, or
+    there was nothing to choose from and a default was used instead), so it's off the normal path.
+
+    Keyword arguments:
+    fallback -- a short name for what happened, e.g. "missing_words"
+    """
+    if not _metrics["enabled"]:
+        return
+
+    key = (FALLBACK_METRIC, (("fallback", fallback),))
+    with _metricsLock:
+        _metrics["counters"][key] = _metrics["counters"].get(key, 0) + 1
+
+
+
+
+def FormatMetrics():
+    """Return everything recorded so far, in the Prometheus text exposition format."""
+    with _metricsLock:
+        histograms = sorted((key, dict(value, buckets=list(value["buckets"]))) for key, value in _metrics["histograms"].items())
+        counters = sorted(_metrics["counters"].items())
+
+    lines = []
+    lastMetric = None
+    for (metric, labels), histogram in histograms:
+        if metric != lastMetric:
+            lines.extend(MetricHeader(metric, "histogram"))
+            lastMetric = metric
+
+        # Prometheus buckets are cumulative: each counts every observation up to its bound
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), histogram["buckets"]):
+            cumulative += count
+            lines.append(metric + "_bucket" + FormatLabels(labels + (("le", FormatBound(bound)),)) + " " + str(cumulative))
+        lines.append(metric + "_sum" + FormatLabels(labels) + " " + repr(histogram["sum"]))
+        lines.append(metric + "_count" + FormatLabels(labels) + " " + str(histogram["count"]))
+
+    for (metric, labels), count in counters:
+        if metric != lastMetric:
+            lines.extend(MetricHeader(metric, "counter"))
+            lastMetric = metric
+        lines.append(metric + FormatLabels(labels) + " " + str(count))
+
+    return "".join(line + "\n" for line in lines)
+
+
+
+
+def MetricHeader(metric, metricType):
+    """Return the # HELP and # TYPE lines for a metric."""
+    return ["# HELP " + metric + " " + METRIC_HELP.get(metric, metric), "# TYPE " + metric + " " + metricType]
+
+
+
+
+def FormatLabels(labels):
+    """Return a tuple of (label name, value) pairs as a Prometheus label set, e.g. {stage="GetTopic"}."""
+    escaped = (name + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for name, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+
+
+def FormatBound(bound):
+    """Return a bucket's upper bound as Prometheus writes it."""
+    if bound == float("inf"):
+        return "+Inf"
+    return repr(bound)
@@ -0,0 +1,301 @@
+# Brings a Hallmark database's schema up to date by applying the numbered .sql files in migrations/, and checks that the queries use indexes.
+# Usage: python migrate.py [database]                  apply any migrations the database hasn't had (creating it if it doesn't exist)
+#        python migrate.py --status [database]         show the database's schema version and any migrations waiting to be applied
+#        python migrate.py --check-plans               fail if any query the importer, the vocabulary load or plotQuery sends would scan a whole table
+import argparse
+import contextlib
+import glob
+import importlib
+import io
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+from sys import exit
+from queryTracer import StartTrace, StopTrace, NormaliseQuery, Shorten
+
+
+# Declare some globals
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_DIR = os.path.join(PROJECT_DIR, "migrations")
+SCHEMA_PATH = os.path.join(PROJECT_DIR, "createDatabase.sql")
+SOURCE_DIR = os.path.join(PROJECT_DIR, "sourceData")
+DATABASE_PATH = "hallmark.db"
+
+# Migration files are named <version>_<description>.sql, e.g. 0001_lookup_indexes.sql. createDatabase.sql is version 0
+MIGRATION_NAME = re.compile(r"^(\d+)_\w+\.sql$")
+
+# Statements which don't have a query plan worth checking
+UNPLANNED_STATEMENTS = ("CREATE", "DROP", "PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "ANALYZE", "VACUUM")
+
+# The name of each common table expression in a WITH clause, e.g. "counter" in "counter(plot) AS (" or "draws" in "draws AS MATERIALIZED ("
+CTE_NAME = re.compile(r"(\w+)\s*(?:\([\w\s,]*\))?\s+AS\s+(?:NOT\s+)?(?:MATERIALIZED\s+)?\(", re.IGNORECASE)
+
+# Each table a statement reads, and its alias if it has one, e.g. "words" and "w" in "JOIN words w ON ...". Query plans use the alias
+TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!(?:ON|WHERE|USING|JOIN|LEFT|INNER|CROSS|NATURAL|GROUP|ORDER|WINDOW|UNION|LIMIT)\b)(\w+))?",
+                         re.IGNORECASE)
+
+
+
+def main():
+    """Bring hallmark.db, or another database, up to the latest schema, show its schema version, or check the query plans."""
+    parser = argparse.ArgumentParser(description="Apply the migrations in migrations/ to a Hallmark database, or check the query plans.")
+    parser.add_argument("database", nargs="?", default=DATABASE_PATH, help="the database to migrate (default: " + DATABASE_PATH + ")")
+    parser.add_argument("--status", action="store_true", help="show the schema version and any pending migrations, without applying them")
+    parser.add_argument("--check-plans", action="store_true",
+                        help="import sourceData into scratch databases with the latest schema and fail if any query would scan a whole table")
+    args = parser.parse_args()
+
+    try:
+        if args.check_plans:
+            problems = CheckQueryPlans()
+            for queryStr, scans in problems:
+                print("Full table scan: " + Shorten(queryStr, 300))
+                for detail in scans:
+                    print("    " + detail)
+            if len(problems) > 0:
+                print(str(len(problems)) + " queries scan a whole table. Add an index in a new migration, or rewrite the query")
+                exit(1)
+            print("Every query uses an index")
+
+        elif args.status:
+            with contextlib.closing(sqlite3.connect(args.database)) as conn:
+                version = GetSchemaVersion(conn)
+            pending = [filename for migrationVersion, filename in GetMigrations() if migrationVersion > version]
+            print(args.database + " is at schema version " + str(version) + " of " + str(GetLatestVersion()))
+            for filename in pending:
+                print("Pending: " + filename)
+
+        else:
+            applied = MigrateDatabase(args.database)
+            for filename in applied:
+                print("Applied " + filename)
+            print(args.database + " is up to date (schema version " + str(GetLatestVersion()) + ")")
+
+    except (ValueError, sqlite3.Error) as e:
+        print("Migration failed: " + str(e))
+        exit(1)
+
+
+
+def GetMigrations():
+    """Return a list of (version, filename) for every file in migrations/, in order. Versions must run 1, 2, 3... without gaps."""
+    migrations = []
+    for path in glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql")):
+        match = MIGRATION_NAME.match(os.path.basename(path))
+        if match == None:
+            raise ValueError("migration files must be named <version>_<description>.sql, not " + os.path.basename(path))
+        migrations.append((int(match.group(1)), os.path.basename(path)))
+
+    migrations.sort()
+    if [version for version, filename in migrations] != list(range(1, len(migrations) + 1)):
+        raise ValueError("migration versions must run 1, 2, 3... with no gaps or repeats")
+
+    return migrations
+
+
+
+def GetLatestVersion():
+    """Return the schema version a database has once every migration has been applied."""
+    return len(GetMigrations())
+
+
+
+def GetSchemaVersion(conn):
+    """Return the schema version of a database: the number of the last migration applied to it (0 = just createDatabase.sql)."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+
+def MigrateDatabase(dbPath):
+    """Apply every migration a database hasn't had yet, each in its own transaction, creating it from createDatabase.sql if it doesn't exist.
+    Return a list of the migration filenames applied.
+
+    Keyword arguments:
+    dbPath -- the path to the SQLite database file.
+
+    The schema version is kept in SQLite's user_version, which is updated in the same transaction as the migration, so a migration
+    which fails part-way through leaves the database as it was.
+    """
+    isNew = not os.path.exists(dbPath)
+    applied = []
+    with contextlib.closing(sqlite3.connect(dbPath, isolation_level=None)) as conn:
+        if isNew:
+            with open(SCHEMA_PATH, "r") as reader:
+                RunInTransaction(conn, reader.read(), 0)
+
+        version = GetSchemaVersion(conn)
+        for migrationVersion, filename in GetMigrations():
+            if migrationVersion <= version:
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, filename), "r") as reader:
+                RunInTransaction(conn, reader.read(), migrationVersion)
+            applied.append(filename)
+
+    return applied
+
+
+
+def CreateDatabase(dbPath):
+    """Create a new, empty database with the latest schema.
+
+    Keyword arguments:
+    dbPath -- the path for the new SQLite database file. It mustn't exist already.
+    """
+    if os.path.exists(dbPath):
+        raise ValueError(dbPath + " already exists")
+    MigrateDatabase(dbPath)
+
+
+
+def RunInTransaction(conn, script, version):
+    """Run a migration script and set the schema version, all or nothing.
+
+    Keyword arguments:
+    conn -- a sqlite3 connection in autocommit mode (isolation_level=None), so the script's statements aren't committed one by one.
+    script -- the SQL, as one or more statements separated by semicolons.
+    version -- the schema version the database is at once the script has run.
+    """
+    # executescript commits anything pending before it starts, but then leaves transactions to the script itself
+    try:
+        conn.executescript("BEGIN;\n" + script + "\n;PRAGMA user_version = " + str(int(version)) + ";\nCOMMIT;")
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+
+def CheckQueryPlans():
+    """Run every kind of import, a vocabulary load and plotQuery against scratch databases with the latest schema, then ask SQLite how it would
+    run each distinct statement they sent. Return a list of (statement, list of plan lines) for any which would scan a whole table."""
+    with tempfile.TemporaryDirectory() as tempDir:
+        queries = CollectQueries(tempDir)
+
+        # Explain against the synced database: it has the latest schema, plus the tables and indexes the importer adds for itself.
+        # It hasn't been analysed, so the plans depend only on the schema, not on how much is in it
+        with contextlib.closing(sqlite3.connect(os.path.join(tempDir, "sync.db"))) as conn:
+            # The importer keeps the names it's looking up in temp tables, which need to exist before anything using them can be explained
+            tempTables = set()
+            for query in queries:
+                match = re.match(r"\s*CREATE\s+TEMP(?:ORARY)?\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(?:temp\.)?(\w+)", query["sql"], re.IGNORECASE)
+                if match != None:
+                    conn.execute(query["sql"])
+                    tempTables.add(match.group(1))
+
+            problems = []
+            for query in queries:
+                scans = FindTableScans(conn, query["sql"], query["params"], tempTables)
+                if len(scans) > 0:
+                    problems.append((" ".join(query["sql"].split()), scans))
+
+    return problems
+
+
+
+def CollectQueries(tempDir):
+    """Return one query (see queryTracer.GetActiveTrace) for each distinct statement sent by row-at-a-time, bulk and sync imports of
+    sourceData, by loading the vocabulary and by resolving plots straight from the database (see plotQuery), each into a new database in tempDir."""
+    importer = importlib.import_module("import")
+    from connectionPool import PoolConnection
+    from plotQuery import GetVariablesFromDatabase
+    from vocabulary import LoadVocabulary
+
+    # A copy of sourceData to sync from, then change (so the second sync has something to delete)
+    syncDir = os.path.join(tempDir, "sourceData")
+    shutil.copytree(SOURCE_DIR, syncDir, ignore=shutil.ignore_patterns("*.md"))
+    for path in [os.path.join(tempDir, name + ".db") for name in ["rows", "bulk", "sync"]]:
+        CreateDatabase(path)
+
+    StartTrace("query plan check")
+    try:
+        # The importer reports on everything it adds, and the CS50 Library logs every query
+        with contextlib.redirect_stdout(io.StringIO()):
+            logging.getLogger("cs50").disabled = True
+            importer.ImportDirectory(os.path.join(tempDir, "rows.db"), SOURCE_DIR, False, False)
+            importer.ImportDirectory(os.path.join(tempDir, "bulk.db"), SOURCE_DIR, True, False)
+            importer.SyncDirectory(os.path.join(tempDir, "sync.db"), syncDir)
+            RemoveSourceLines(syncDir)
+            importer.SyncDirectory(os.path.join(tempDir, "sync.db"), syncDir)
+
+        db = PoolConnection(os.path.join(tempDir, "bulk.db"))
+        try:
+            LoadVocabulary(db)
+            GetVariablesFromDatabase(db, 10)
+        finally:
+            db.close()
+    finally:
+        logging.getLogger("cs50").disabled = False
+        trace = StopTrace()
+
+    # The same statement with different values has the same plan, so keep the first of each (skipping executemany calls with nothing to do)
+    queries = {}
+    for query in trace["queries"]:
+        if query["batchSize"] != 0:
+            queries.setdefault(NormaliseQuery(query["sql"]), query)
+    return list(queries.values())
+
+
+
+def RemoveSourceLines(srcDir):
+    """Take the last few records out of some of the .txt files in a directory, so a sync from it has records and links to delete."""
+    for filename in ["words_topic.txt", "words_adjective.txt", "images.txt", "topicTitles.txt"]:
+        path = os.path.join(srcDir, filename)
+        if not os.path.exists(path):
+            continue
+        with open(path, "r") as reader:
+            lines = reader.readlines()
+        with open(path, "w") as writer:
+            writer.writelines(lines[:-3])
+
+
+
+def FindTableScans(conn, queryStr, params, tempTables):
+    """Return the lines of a statement's query plan which scan a whole table (rather than searching an index), or [] if there aren't any.
+
+    Keyword arguments:
+    conn -- a sqlite3 connection to a database with the schema to check.
+    queryStr -- the SQL. Statements with no query plan (e.g. CREATE INDEX) are skipped.
+    params -- the values for its placeholders: a tuple or a dictionary.
+    tempTables -- set of temp table names. These hold exactly the rows being looked up, so reading all of them is the point.
+
+    A statement with no WHERE clause reads a whole table on purpose (e.g. the vocabulary load), so the table it starts from is allowed
+    to be scanned. Any other scan means a join or a subquery isn't using an index. Only scans of the database's own tables count:
+    common table expressions and subqueries are built by the statement for its own use (like temp tables), and the tables they read
+    from are checked in their own plan lines.
+    """
+    if queryStr.lstrip().upper().startswith(UNPLANNED_STATEMENTS):
+        return []
+
+    plan = conn.execute("EXPLAIN QUERY PLAN " + queryStr, params).fetchall()
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    # A common table expression can have the same name as a table, which it hides
+    cteNames = set(CTE_NAME.findall(queryStr)) if re.match(r"\s*WITH\b", queryStr, re.IGNORECASE) != None else set()
+
+    # Plan lines give the alias where there is one. The same alias can be used for different tables in different parts of a statement
+    sources = {}
+    for name, alias in TABLE_ALIAS.findall(queryStr):
+        sources.setdefault(alias if alias != "" else name, set()).add(name)
+
+    scans = []
+    for planID, parentID, unused, detail in plan:
+        match = re.match(r"SCAN (?:TABLE )?(\w+)", detail)
+        if match == None:
+            continue
+
+        names = sources.get(match.group(1), {match.group(1)})
+        if any(name in tables and name not in tempTables and name not in cteNames for name in names):
+            scans.append(detail)
+
+    if re.search(r"\bWHERE\b", queryStr, re.IGNORECASE) == None:
+        scans = scans[1:]
+
+    return scans
+
+
+
+if __name__ == "__main__":
+    main()
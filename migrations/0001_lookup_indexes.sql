@@ -0,0 +1,29 @@
+-- Index the columns the queries actually filter and join on, and drop the indexes which only repeated a primary key
+
+-- words_index led with id, so it couldn't help look a word up by its display text (as the importer and sync deletes do)
+DROP INDEX IF EXISTS words_index;
+CREATE INDEX IF NOT EXISTS words_display ON words(display);
+
+-- id is already the primary key of both, and categories(name) has categories_unique
+DROP INDEX IF EXISTS cat_index;
+DROP INDEX IF EXISTS probs_index;
+
+-- Choice groups are read by choiceGroups_id. Deleting a word or category removes its probabilities
+CREATE INDEX IF NOT EXISTS probabilities_choiceGroup ON probabilities(choiceGroups_id);
+CREATE INDEX IF NOT EXISTS probabilities_word ON probabilities(words_id);
+CREATE INDEX IF NOT EXISTS probabilities_category ON probabilities(categories_id);
+
+-- Link tables are joined and deleted from by either column. Their unique indexes (see createDatabase.sql) cover the first column;
+-- the IF NOT EXISTS lines are for databases made before those were added to createDatabase.sql
+CREATE UNIQUE INDEX IF NOT EXISTS wordsToImages_unique ON wordsToImages(words_id, images_id);
+CREATE INDEX IF NOT EXISTS wordsToImages_image ON wordsToImages(images_id);
+CREATE UNIQUE INDEX IF NOT EXISTS wordsToTitles_unique ON wordsToTitles(words_id, titleTemplates_id);
+CREATE INDEX IF NOT EXISTS wordsToTitles_titleTemplate ON wordsToTitles(titleTemplates_id);
+CREATE UNIQUE INDEX IF NOT EXISTS pronounGroupMembers_unique ON pronounGroupMembers(group_id, pronoun_id);
+CREATE INDEX IF NOT EXISTS pronounGroupMembers_pronoun ON pronounGroupMembers(pronoun_id);
+CREATE INDEX IF NOT EXISTS pronounSets_objectPronoun ON pronounSets(objectPronoun_id);
+CREATE INDEX IF NOT EXISTS verbs_result ON verbs(result_id);
+CREATE INDEX IF NOT EXISTS ctp_subjectPronoun ON charactersToPronouns(subjectPronoun_id);
+CREATE INDEX IF NOT EXISTS cth_location ON charactersToHometowns(location_id);
+
+-- The sync tables get their indexes from import.py's CreateSyncTables, since older databases only have the sync tables once they've been synced
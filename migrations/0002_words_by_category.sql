@@ -0,0 +1,2 @@
+-- Words in a category, in ID order (the order of the vocabulary's lists), without a sort. plotQuery.py numbers them like this to pick one
+CREATE INDEX IF NOT EXISTS words_category ON words(categories_id);
@@ -0,0 +1,93 @@
+# Packs a sequence of choices into one integer (and a short base62 string), and unpacks them again
+import string
+
+
+# Declare some globals
+BASE62_ALPHABET = string.digits + string.ascii_lowercase + string.ascii_uppercase
+
+
+
+def EncodeDigits(digits):
+    """Return the integer for a list of (digit, radix) pairs, read as a mixed-radix number with the first pair least significant.
+
+    Keyword arguments:
+    digits -- a list of (digit, radix) pairs, where 0 <= digit < radix. Each radix may depend on the digits before it,
+              as long as whatever reads the number back (see ReadDigit) works out the same radix at the same point.
+    """
+    value = 0
+    multiplier = 1
+    for digit, radix in digits:
+        if digit < 0 or digit >= radix:
+            raise ValueError("Digit " + str(digit) + " is out of range for radix " + str(radix))
+        value += digit * multiplier
+        multiplier *= radix
+
+    return value
+
+
+
+
+def CreateDigitReader(value):
+    """Return a dictionary for reading the digits of an integer made by EncodeDigits, one at a time with ReadDigit."""
+    if value < 0:
+        raise ValueError("Encoded values can't be negative")
+    return {"value": value}
+
+
+
+
+def ReadDigit(reader, radix):
+    """Return the next digit from a reader made by CreateDigitReader, given the radix it was written with."""
+    digit = reader["value"] % radix
+    reader["value"] //= radix
+    return digit
+
+
+
+
+def ReaderIsFinished(reader):
+    """Return boolean indicating if every digit has been read. False means the value was too large for the radices it was read with."""
+    return reader["value"] == 0
+
+
+
+
+def EncodeBase62(value):
+    """Return a non-negative integer as a string of 0-9, a-z and A-Z."""
+    if value < 0:
+        raise ValueError("Only non-negative integers can be encoded")
+
+    chars = []
+    while True:
+        value, remainder = divmod(value, 62)
+        chars.append(BASE62_ALPHABET[remainder])
+        if value == 0:
+            break
+
+    return "".join(reversed(chars))
+
+
+
+
+def DecodeBase62(myStr, maxLength=None):
+    """Return the integer for a string made by EncodeBase62. Raise ValueError if it contains anything else.
+
+    Keyword arguments:
+    myStr -- the string to decode
+    maxLength -- optional. Raise ValueError for a string longer than this, without decoding it. None = any length
+    """
+    if myStr == "":
+        raise ValueError("An empty string isn't a base62 number")
+
+    # Decoding costs more than linear time in the length, so turn away anything too long first
+    if maxLength != None and len(myStr) > maxLength:
+        raise ValueError("Longer than " + str(maxLength) + " base62 digits")
+
+    value = 0
+    for ch in myStr:
+        digit = BASE62_ALPHABET.find(ch)
+        if digit == -1:
+            raise ValueError("Not a base62 digit: " + repr(ch))
+        value = value * 62 + digit
+
+    return value
@@ -0,0 +1,177 @@
+# Process-wide pool of ready-made Hallmark settings, kept topped up by a background thread so requests don't have to wait for generation
+import collections
+import threading
+import time
+from hallmarkGenerator import GetHallmarkSettings, GetHallmarkSettingsChunks
+from metrics import ExcludeThreadFromTiming
+from vocabulary import GetVocabulary
+
+
+# Declare some globals
+DEFAULT_LOW_WATERMARK = 30
+DEFAULT_HIGH_WATERMARK = 120
+
+# The worker generates this many settings at a time (see GetHallmarkSettingsChunks)
+REFILL_CHUNK_SIZE = 30
+
+# How long (in seconds) the worker waits before trying again if generation fails
+RETRY_DELAY = 5
+
+_plotPool = {"low": DEFAULT_LOW_WATERMARK, "high": DEFAULT_HIGH_WATERMARK, "ready": collections.deque(), "worker": None, "stopping": False,
+             "generated": 0, "generatingSeconds": 0.0, "fromPool": 0, "inline": 0, "discarded": 0, "errors": 0}
+_plotPoolCondition = threading.Condition()
+
+
+
+def ConfigurePlotPool(lowWatermark=DEFAULT_LOW_WATERMARK, highWatermark=DEFAULT_HIGH_WATERMARK):
+    """Set the watermarks for the pool.
+
+    Keyword arguments:
+    lowWatermark -- when the pool falls below this many settings, the worker starts refilling it
+    highWatermark -- the worker stops refilling once the pool holds this many settings
+    """
+    if lowWatermark < 0 or highWatermark < 1 or lowWatermark > highWatermark:
+        raise ValueError("Watermarks must satisfy 0 <= lowWatermark <= highWatermark, with highWatermark at least 1")
+
+    with _plotPoolCondition:
+        _plotPool["low"] = lowWatermark
+        _plotPool["high"] = highWatermark
+        _plotPoolCondition.notify()
+
+
+
+
+def StartPlotPool():
+    """Start the background worker which keeps the pool topped up, if it isn't already running."""
+    with _plotPoolCondition:
+        if _plotPool["worker"] != None and _plotPool["worker"].is_alive():
+            return
+
+        _plotPool["stopping"] = False
+        _plotPool["worker"] = threading.Thread(target=RefillWorker, name="plotPool", daemon=True)
+        _plotPool["worker"].start()
+
+
+
+
+def StopPlotPool():
+    """Ask the background worker to stop, and wait for it to finish what it's doing."""
+    with _plotPoolCondition:
+        _plotPool["stopping"] = True
+        _plotPoolCondition.notify()
+        worker = _plotPool["worker"]
+
+    if worker != None:
+        worker.join()
+
+
+
+
+def TakePlots(n, inline=True):
+    """Return a list of n sets of modified Hallmark settings, as from GetHallmarkSettings(False).
+
+    Keyword arguments:
+    n -- the number of settings wanted
+    inline -- boolean. True = if the pool runs dry, generate the rest inline; False = return however many the pool had
+    """
+    vocab = GetVocabulary()
+    settingsList = []
+
+    # Counters are only changed while holding the lock, since several request threads (and the worker) share them
+    with _plotPoolCondition:
+        while len(settingsList) < n:
+            try:
+                entryVocab, settings = _plotPool["ready"].popleft()
+            except IndexError:
+                break
+
+            # Settings made before the vocabulary was reloaded might use words that no longer exist, so throw them away
+            if entryVocab is vocab:
+                settingsList.append(settings)
+            else:
+                _plotPool["discarded"] += 1
+
+        _plotPool["fromPool"] += len(settingsList)
+
+        # Wake the worker if that took the pool below the low watermark
+        if len(_plotPool["ready"]) < _plotPool["low"]:
+            _plotPoolCondition.notify()
+
+    # Generate any the pool couldn't supply outside the lock, so other requests can still take from the pool meanwhile
+    fromPool = len(settingsList)
+    while inline and len(settingsList) < n:
+        settingsList.append(GetHallmarkSettings(False))
+
+    if len(settingsList) > fromPool:
+        with _plotPoolCondition:
+            _plotPool["inline"] += len(settingsList) - fromPool
+
+    return settingsList
+
+
+
+
+def RefillWorker():
+    """Keep the pool topped up: sleep until it falls below the low watermark, then fill it to the high watermark."""
+    # The stage timings are for requests. Refilling in the background doesn't hold anyone up, so leave it out of them
+    ExcludeThreadFromTiming()
+
+    while True:
+        with _plotPoolCondition:
+            while not _plotPool["stopping"] and len(_plotPool["ready"]) >= _plotPool["low"]:
+                _plotPoolCondition.wait()
+
+            if _plotPool["stopping"]:
+                return
+
+        while not _plotPool["stopping"] and len(_plotPool["ready"]) < _plotPool["high"]:
+            try:
+                RefillChunk(min(REFILL_CHUNK_SIZE, _plotPool["high"] - len(_plotPool["ready"])))
+
+            # If generation fails (e.g. hallmark.db is missing), requests will generate inline and report the problem. Try again later
+            except Exception:
+                with _plotPoolCondition:
+                    _plotPool["errors"] += 1
+                time.sleep(RETRY_DELAY)
+                break
+
+
+
+
+def RefillChunk(n):
+    """Generate n settings and add them to the pool, tagged with the vocabulary they came from."""
+    vocab = GetVocabulary()
+    startTime = time.perf_counter()
+
+    newSettings = next(GetHallmarkSettingsChunks(n, n))
+
+    with _plotPoolCondition:
+        _plotPool["generatingSeconds"] += time.perf_counter() - startTime
+        _plotPool["generated"] += len(newSettings)
+        _plotPool["ready"].extend((vocab, settings) for settings in newSettings)
+
+
+
+
+def GetPlotPoolStats():
+    """Return a dictionary describing the state of the pool."""
+    # Read everything under the lock, so the numbers all come from the same moment
+    with _plotPoolCondition:
+        stats = {}
+        stats["depth"] = len(_plotPool["ready"])
+        stats["low"] = _plotPool["low"]
+        stats["high"] = _plotPool["high"]
+        stats["running"] = _plotPool["worker"] != None and _plotPool["worker"].is_alive()
+        stats["generated"] = _plotPool["generated"]
+        stats["fromPool"] = _plotPool["fromPool"]
+        stats["inline"] = _plotPool["inline"]
+        stats["discarded"] = _plotPool["discarded"]
+        stats["errors"] = _plotPool["errors"]
+
+        # Refill rate is settings generated per second of the worker's generating time
+        if _plotPool["generatingSeconds"] > 0:
+            stats["refillRate"] = _plotPool["generated"] / _plotPool["generatingSeconds"]
+        else:
+            stats["refillRate"] = None
+
+    return stats
@@ -0,0 +1,367 @@
+# Resolves the variables for a batch of plots with a single SQL statement, for when hallmark.db is used directly rather than the in-memory vocabulary
+from connectionPool import PooledConnection
+from hallmarkGenerator import PLOT_TEMPLATE, MISSING_WORDS, BuildSettings, GetAOrAn, GetPrefixTemplate, GetRandom
+from metrics import CountFallback
+from plotCodec import EncodeDigits
+from plotTemplate import RenderTemplate
+from vocabulary import GetVocabulary, MAIN_CHAR_CATEGORIES
+
+
+# Declare some globals
+# The choice groups GetVariables picks from, in the order it picks from them
+PLOT_CHOICE_GROUPS = ("mainChar", "toBeeOrNotToBee", "jobDesc", "lifeguide")
+
+# The verbs in the plot
+PLOT_INFINITIVES = ("to work", "to meet")
+
+# A uniform random number in [0, 1), made from the top 53 bits of SQLite's random()
+SQL_RANDOM = "((random() & 9007199254740991) / 9007199254740992.0)"
+
+# Does all of the random sampling that doesn't depend on another pick: the weighted choice groups, the lifeguide's words and prefix
+# words, the topic, and "any valid main character". Everything is done for the whole batch at once, rather than plot by plot:
+#   Weighted picks sort every plot's random target in with the running totals of the group's weights. A target's pick is the first
+#   option whose running total is above it.
+#   Uniform picks count the options, choose a random position for each plot, then number the options in ID order (the same order as
+#   the vocabulary's lists) to find the ones at those positions. SQLite can't jump to the nth row of an index, so numbering has to walk
+#   through the options: only the categories some plot needs are numbered, and the main character candidates only if some plot needs them.
+# The result has one row per pick, plus the pronouns and hometowns of each plot's character and the grammar for those pronouns,
+# so the picks which depend on the character can be made in Python. Columns: kind, plot, pos, optionCount, id, name, subject, display
+PLOT_QUERY = """
+WITH RECURSIVE
+    counter(plot) AS (SELECT 1 UNION ALL SELECT plot + 1 FROM counter WHERE plot < :plotCount),
+    draws AS MATERIALIZED (
+        SELECT plot, {random} AS rMainChar, {random} AS rAnyChar, {random} AS rBees, {random} AS rJobDesc,
+            {random} AS rLifeguide, {random} AS rGuide, {random} AS rTopic
+        FROM counter),
+    choices AS MATERIALIZED (
+        SELECT cg.name AS groupName, p.words_id, p.categories_id, p.prefixStr,
+            ROW_NUMBER() OVER running - 1 AS pos, COUNT(*) OVER whole AS optionCount,
+            SUM(p.probability) OVER running AS upTo, SUM(p.probability) OVER whole AS total
+        FROM choiceGroups cg JOIN probabilities p ON p.choiceGroups_id = cg.id
+        WHERE cg.name IN ({choiceGroups})
+        WINDOW running AS (PARTITION BY p.choiceGroups_id ORDER BY p.id ROWS UNBOUNDED PRECEDING), whole AS (PARTITION BY p.choiceGroups_id)),
+    weightedTargets AS (
+        SELECT g.groupName, d.plot, 0 AS isOption, NULL AS pos,
+            g.total * CASE g.groupName WHEN 'mainChar' THEN d.rMainChar WHEN 'toBeeOrNotToBee' THEN d.rBees
+                                       WHEN 'jobDesc' THEN d.rJobDesc ELSE d.rLifeguide END AS value
+        FROM draws d CROSS JOIN (SELECT DISTINCT groupName, total FROM choices) g
+        UNION ALL
+        SELECT groupName, NULL, 1, pos, upTo FROM choices),
+    weighted AS MATERIALIZED (
+        SELECT groupName, plot, pos FROM (
+            SELECT groupName, plot, isOption,
+                MIN(pos) OVER (PARTITION BY groupName ORDER BY value DESC, isOption ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS pos
+            FROM weightedTargets)
+        WHERE isOption = 0),
+    chosen AS MATERIALIZED (
+        SELECT d.plot, d.rAnyChar, d.rGuide, d.rTopic,
+            cm.pos AS mainCharPos, cm.optionCount AS mainCharCount, cm.words_id AS mainCharID,
+            cb.pos AS beesPos, cb.optionCount AS beesCount, cb.words_id AS beesID,
+            cj.pos AS jobDescPos, cj.optionCount AS jobDescCount, cj.words_id AS jobDescID,
+            cl.pos AS lifeguidePos, cl.optionCount AS lifeguideCount, cl.categories_id AS guideCategoryID, cl.prefixStr,
+            (SELECT id FROM categories WHERE name = 'topic') AS topicCategoryID
+        FROM draws d
+            LEFT JOIN weighted wm ON wm.groupName = 'mainChar' AND wm.plot = d.plot
+            LEFT JOIN choices cm ON cm.groupName = 'mainChar' AND cm.pos = wm.pos
+            LEFT JOIN weighted wb ON wb.groupName = 'toBeeOrNotToBee' AND wb.plot = d.plot
+            LEFT JOIN choices cb ON cb.groupName = 'toBeeOrNotToBee' AND cb.pos = wb.pos
+            LEFT JOIN weighted wj ON wj.groupName = 'jobDesc' AND wj.plot = d.plot
+            LEFT JOIN choices cj ON cj.groupName = 'jobDesc' AND cj.pos = wj.pos
+            LEFT JOIN weighted wl ON wl.groupName = 'lifeguide' AND wl.plot = d.plot
+            LEFT JOIN choices cl ON cl.groupName = 'lifeguide' AND cl.pos = wl.pos),
+    mainCharCandidates AS MATERIALIZED (
+        SELECT w.id, ROW_NUMBER() OVER (ORDER BY w.id) - 1 AS pos
+        FROM categories c JOIN words w ON w.categories_id = c.id
+        WHERE c.name IN ({mainCharCategories})
+            AND EXISTS (SELECT 1 FROM chosen WHERE mainCharID IS NULL)
+            AND EXISTS (SELECT 1 FROM charactersToPronouns ctp WHERE ctp.character_id = w.id)
+            AND EXISTS (SELECT 1 FROM charactersToHometowns cth WHERE cth.character_id = w.id)),
+    prefixSlots(plot, slot, categoryName, rest) AS (
+        SELECT plot, -1, NULL, prefixStr FROM chosen WHERE prefixStr IS NOT NULL
+        UNION ALL
+        SELECT plot, slot + 1,
+            substr(rest, instr(rest, '#[') + 2, instr(substr(rest, instr(rest, '#[') + 2), ']#') - 1),
+            substr(rest, instr(rest, '#[') + instr(substr(rest, instr(rest, '#[') + 2), ']#') + 3)
+        FROM prefixSlots WHERE instr(rest, '#[') > 0 AND instr(substr(rest, instr(rest, '#[') + 2), ']#') > 0),
+    prefixDraws AS MATERIALIZED (
+        SELECT s.plot, s.slot, s.categoryName, c.id AS categoryID, {random} AS r
+        FROM prefixSlots s LEFT JOIN categories c ON c.name = s.categoryName
+        WHERE s.slot >= 0),
+    neededCategories(categoryID) AS (
+        SELECT guideCategoryID FROM chosen
+        UNION SELECT categoryID FROM prefixDraws
+        UNION SELECT topicCategoryID FROM chosen),
+    categoryCounts AS MATERIALIZED (
+        SELECT categories_id, COUNT(*) AS optionCount FROM words
+        WHERE categories_id IN (SELECT categoryID FROM neededCategories) GROUP BY categories_id),
+    resolved AS MATERIALIZED (
+        SELECT ch.*, anyCount.optionCount AS anyCharCount, CAST(ch.rAnyChar * anyCount.optionCount AS INTEGER) AS anyCharPos,
+            COALESCE(gc.optionCount, 0) AS guideCount, CAST(ch.rGuide * COALESCE(gc.optionCount, 0) AS INTEGER) AS guidePos,
+            COALESCE(tc.optionCount, 0) AS topicCount, CAST(ch.rTopic * COALESCE(tc.optionCount, 0) AS INTEGER) AS topicPos
+        FROM chosen ch
+            CROSS JOIN (SELECT COUNT(*) AS optionCount FROM mainCharCandidates) anyCount
+            LEFT JOIN categoryCounts gc ON gc.categories_id = ch.guideCategoryID
+            LEFT JOIN categoryCounts tc ON tc.categories_id = ch.topicCategoryID),
+    prefixPicks AS MATERIALIZED (
+        SELECT pd.plot, pd.slot, pd.categoryName, pd.categoryID, COALESCE(cc.optionCount, 0) AS optionCount,
+            CAST(pd.r * COALESCE(cc.optionCount, 0) AS INTEGER) AS pos
+        FROM prefixDraws pd LEFT JOIN categoryCounts cc ON cc.categories_id = pd.categoryID),
+    wantedWords(categoryID, pos) AS (
+        SELECT guideCategoryID, guidePos FROM resolved
+        UNION SELECT topicCategoryID, topicPos FROM resolved
+        UNION SELECT categoryID, pos FROM prefixPicks),
+    pickedWords AS MATERIALIZED (
+        SELECT categories_id, pos, display FROM (
+            SELECT w.categories_id, w.display, ROW_NUMBER() OVER (PARTITION BY w.categories_id ORDER BY w.id) - 1 AS pos
+            FROM words w WHERE w.categories_id IN (SELECT categoryID FROM neededCategories))
+        WHERE (categories_id, pos) IN (SELECT categoryID, pos FROM wantedWords)),
+    pickedCharacters AS MATERIALIZED (
+        SELECT id, pos FROM mainCharCandidates WHERE pos IN (SELECT anyCharPos FROM resolved WHERE mainCharID IS NULL)),
+    characters AS MATERIALIZED (
+        SELECT r.plot, COALESCE(r.mainCharID, pc.id) AS characterID, wb.display AS beesDisplay,
+            CASE WHEN r.beesID IS NOT NULL AND COALESCE(wb.display, '') != ' ' THEN r.beesID ELSE COALESCE(r.mainCharID, pc.id) END AS workingID
+        FROM resolved r
+            LEFT JOIN pickedCharacters pc ON r.mainCharID IS NULL AND pc.pos = r.anyCharPos
+            LEFT JOIN words wb ON wb.id = r.beesID),
+    pronounCandidates AS (
+        SELECT DISTINCT w.display FROM characters ch
+            JOIN charactersToPronouns ctp ON ctp.character_id = ch.workingID
+            JOIN words w ON w.id = ctp.subjectPronoun_id)
+SELECT 'mainChar' AS kind, r.plot, r.mainCharPos AS pos, r.mainCharCount AS optionCount, ch.characterID AS id, NULL AS name, NULL AS subject,
+    w.display
+    FROM resolved r JOIN characters ch ON ch.plot = r.plot LEFT JOIN words w ON w.id = ch.characterID
+UNION ALL
+SELECT 'anyChar', r.plot, r.anyCharPos, r.anyCharCount, NULL, NULL, NULL, NULL FROM resolved r WHERE r.mainCharID IS NULL
+UNION ALL
+SELECT 'bees', r.plot, r.beesPos, r.beesCount, r.beesID, NULL, NULL, ch.beesDisplay
+    FROM resolved r JOIN characters ch ON ch.plot = r.plot
+UNION ALL
+SELECT 'jobDesc', r.plot, r.jobDescPos, r.jobDescCount, r.jobDescID, NULL, NULL, w.display
+    FROM resolved r LEFT JOIN words w ON w.id = r.jobDescID
+UNION ALL
+SELECT 'lifeguide', r.plot, r.lifeguidePos, r.lifeguideCount, r.guideCategoryID, r.prefixStr, NULL, gw.display
+    FROM resolved r LEFT JOIN pickedWords gw ON gw.categories_id = r.guideCategoryID AND gw.pos = r.guidePos
+UNION ALL
+SELECT 'guide', r.plot, r.guidePos, r.guideCount, r.guideCategoryID, NULL, NULL, NULL FROM resolved r
+UNION ALL
+SELECT 'prefix', pp.plot, pp.pos, pp.optionCount, pp.slot, pp.categoryName, NULL, pw.display
+    FROM prefixPicks pp LEFT JOIN pickedWords pw ON pw.categories_id = pp.categoryID AND pw.pos = pp.pos
+UNION ALL
+SELECT 'topic', r.plot, r.topicPos, r.topicCount, NULL, NULL, NULL, tw.display
+    FROM resolved r LEFT JOIN pickedWords tw ON tw.categories_id = r.topicCategoryID AND tw.pos = r.topicPos
+UNION ALL
+SELECT 'pronoun', ch.plot, ctp.id, NULL, ch.workingID, NULL, NULL, w.display
+    FROM characters ch JOIN charactersToPronouns ctp ON ctp.character_id = ch.workingID JOIN words w ON w.id = ctp.subjectPronoun_id
+UNION ALL
+SELECT 'hometown', ch.plot, cth.id, NULL, ch.workingID, NULL, NULL, w.display
+    FROM characters ch JOIN charactersToHometowns cth ON cth.character_id = ch.workingID JOIN words w ON w.id = cth.location_id
+UNION ALL
+SELECT 'objectPronoun', NULL, ps.id, NULL, NULL, NULL, ws.display, wo.display
+    FROM words ws JOIN pronounSets ps ON ps.subjectPronoun_id = ws.id JOIN words wo ON wo.id = ps.objectPronoun_id
+    WHERE ws.display IN (SELECT display FROM pronounCandidates)
+UNION ALL
+SELECT 'verb', NULL, v.id, NULL, NULL, i.name, wp.display, w.display
+    FROM words wp JOIN pronounGroupMembers pgm ON pgm.pronoun_id = wp.id JOIN verbs v ON v.pronounGroups_id = pgm.group_id
+        JOIN infinitives i ON i.id = v.infinitives_id JOIN words w ON w.id = v.result_id
+    WHERE wp.display IN (SELECT display FROM pronounCandidates) AND i.name IN ({infinitives})
+ORDER BY kind, plot, pos, id
+""".format(random=SQL_RANDOM,
+           choiceGroups=", ".join(":choiceGroup" + str(i) for i in range(len(PLOT_CHOICE_GROUPS))),
+           mainCharCategories=", ".join(":mainCharCategory" + str(i) for i in range(len(MAIN_CHAR_CATEGORIES))),
+           infinitives=", ".join(":infinitive" + str(i) for i in range(len(PLOT_INFINITIVES))))
+
+
+
+def GetHallmarkSettingsFromDatabase(n, rng=None):
+    """Output a list of n modified Hallmark plots, each in the same format as GetHallmarkSettings(False), with their variables
+    resolved by one query to hallmark.db (see GetVariablesFromDatabase) instead of the in-memory vocabulary.
+
+    Keyword arguments:
+    n -- the number of plots wanted.
+    rng -- optional. A random.Random instance (or a seed for one) for the picks made in Python. SQLite's own picks can't be seeded,
+           so the plots are different every time regardless.
+
+    Images and titles still come from the vocabulary's indexes, as they do for every other plot. Each plot has a plot ID, which
+    RenderPlot turns back into the same plot as long as the vocabulary was loaded from the same hallmark.db.
+    """
+    vocab = GetVocabulary()
+    with PooledConnection() as db:
+        plots = GetVariablesFromDatabase(db, n, rng)
+
+    return [BuildSettings(vocab, varDict, RenderTemplate(PLOT_TEMPLATE, varDict), plotID) for varDict, plotID in plots]
+
+
+
+def GetVariablesFromDatabase(db, n, rng=None):
+    """Return a list of n (dictionary of variables, plot ID) pairs, in the same format as GetVariables, from a single query.
+
+    Keyword arguments:
+    db -- a connection to the Hallmark database, with a CS50 Library style execute method (e.g. from connectionPool).
+    n -- the number of plots wanted.
+    rng -- optional. A random.Random instance, or a seed for one, for the picks which depend on the main character (pronoun and hometown).
+
+    Every choice is noted in the same order GetVariables makes them, so the plot ID is the same one GetHallmarkSettings would give
+    the plot, and falls back to the same defaults when the data is missing.
+    """
+    if n < 1:
+        return []
+
+    params = {"plotCount": n}
+    params.update({"choiceGroup" + str(i): name for i, name in enumerate(PLOT_CHOICE_GROUPS)})
+    params.update({"mainCharCategory" + str(i): name for i, name in enumerate(MAIN_CHAR_CATEGORIES)})
+    params.update({"infinitive" + str(i): name for i, name in enumerate(PLOT_INFINITIVES)})
+
+    # Sort the rows into the picks for each plot, the candidates for each plot's character, and the grammar they all share
+    picks = [{} for i in range(n)]
+    candidates = [{"pronoun": [], "hometown": [], "prefix": []} for i in range(n)]
+    objectPronouns = {}
+    verbs = {}
+    for row in db.execute(PLOT_QUERY, **params):
+        if row["kind"] == "objectPronoun":
+            objectPronouns.setdefault(row["subject"], row["display"])
+        elif row["kind"] == "verb":
+            verbs.setdefault((row["name"], row["subject"]), row["display"])
+        elif row["kind"] in ("pronoun", "hometown", "prefix"):
+            candidates[row["plot"] - 1][row["kind"]].append(row)
+        else:
+            picks[row["plot"] - 1][row["kind"]] = row
+
+    rng = GetRandom(rng)
+    return [ResolvePlotVariables(picks[i], candidates[i], objectPronouns, verbs, rng) for i in range(n)]
+
+
+
+def ResolvePlotVariables(picks, candidates, objectPronouns, verbs, rng):
+    """Return (dictionary of variables, plot ID) for one plot from its rows in the results of PLOT_QUERY, making the picks which
+    depend on the main character."""
+    digits = []
+    myVars = {}
+    myVars["dictName"] = "v2.0"
+
+    # Main character: a choice from the mainChar group, then (if that was "any valid main character") one of the candidates
+    mainChar = picks["mainChar"]
+    NoteChoice(digits, mainChar)
+    if "anyChar" in picks:
+        NoteDigit(digits, picks["anyChar"]["pos"], picks["anyChar"]["optionCount"])
+        if picks["anyChar"]["optionCount"] == 0:
+            CountFallback("no_main_char")
+
+    if mainChar["display"] == None:
+        CountFallback("missing_words")
+        myVars["mainChar"] = MISSING_WORDS
+    else:
+        myVars["mainChar"] = mainChar["display"]
+
+    # The bees plot twist. The character's pronouns and hometowns are the bees' if it's active
+    bees = picks["bees"]
+    NoteChoice(digits, bees)
+    if bees["id"] == None:
+        myVars["bees"] = " "
+    elif bees["display"] == None:
+        CountFallback("missing_words")
+        myVars["bees"] = MISSING_WORDS
+    else:
+        myVars["bees"] = bees["display"]
+
+    subjectPronoun = PickCandidate(candidates["pronoun"], rng, digits)
+    if subjectPronoun == None:
+        CountFallback("no_pronoun")
+        subjectPronoun = ""
+
+    myVars["hometown"] = PickCandidate(candidates["hometown"], rng, digits)
+    if myVars["hometown"] == None:
+        CountFallback("no_hometown")
+        myVars["hometown"] = ""
+
+    myVars["pronounSubj"] = subjectPronoun
+    myVars["pronounObj"] = objectPronouns.get(subjectPronoun, "")
+    myVars["work/s"] = verbs.get(("to work", subjectPronoun), "")
+    myVars["meet/s"] = verbs.get(("to meet", subjectPronoun), "")
+    if myVars["pronounObj"] == "":
+        CountFallback("no_object_pronoun")
+    if myVars["work/s"] == "" or myVars["meet/s"] == "":
+        CountFallback("no_verb")
+
+    # Job description
+    jobDesc = picks["jobDesc"]
+    NoteChoice(digits, jobDesc)
+    if jobDesc["id"] == None:
+        CountFallback("blank_job_desc")
+        myVars["jobDesc"] = ""
+    else:
+        jobDescDisplay = jobDesc["display"] if jobDesc["display"] != None else MISSING_WORDS
+        myVars["jobDesc"] = GetAOrAn(jobDescDisplay) + " " + jobDescDisplay
+
+    # Lifeguide: the words for the prefix's slots, in the same order as HandlePrefix, then the words from the category
+    lifeguide = picks["lifeguide"]
+    NoteChoice(digits, lifeguide)
+    myPrefix = FillPrefix(lifeguide["name"], candidates["prefix"], digits)
+    if lifeguide["id"] == None:
+        CountFallback("blank_lifeguide")
+        myVars["lifeguide"] = ""
+    else:
+        NoteDigit(digits, picks["guide"]["pos"], picks["guide"]["optionCount"])
+        if lifeguide["display"] == None:
+            CountFallback("no_lifeguide_words")
+            myVars["lifeguide"] = ""
+        else:
+            guideStr = myPrefix + " " + lifeguide["display"]
+            myVars["lifeguide"] = GetAOrAn(guideStr) + " " + guideStr
+
+    # Topic
+    topic = picks["topic"]
+    NoteDigit(digits, topic["pos"], topic["optionCount"])
+    if topic["display"] == None:
+        CountFallback("no_topic")
+        myVars["topic"] = ""
+    else:
+        myVars["topic"] = topic["display"]
+
+    return myVars, EncodeDigits(digits)
+
+
+
+def FillPrefix(myPrefix, prefixRows, digits):
+    """Return display text for a lifeguide prefix, as HandlePrefix does, using the words PLOT_QUERY picked for each slot."""
+    if myPrefix == None or myPrefix == "":
+        return ""
+
+    # The rows come sorted by the word picked, so put them back in slot order
+    prefixTemplate = GetPrefixTemplate(myPrefix)
+    parts = list(prefixTemplate["parts"])
+    prefixRows = sorted(prefixRows, key=lambda row: row["id"])
+    for (pos, categoryName), row in zip(prefixTemplate["slots"], prefixRows):
+        NoteDigit(digits, row["pos"], row["optionCount"])
+        if row["display"] == None:
+            CountFallback("happy_prefix")
+            parts[pos] = "happy"
+        else:
+            parts[pos] = row["display"]
+
+    return "".join(parts)
+
+
+
+def PickCandidate(rows, rng, digits):
+    """Return the display text of one of a plot's candidate rows, each with an equal chance, or None if there aren't any."""
+    if len(rows) == 0:
+        return None
+
+    pos = rng.randint(0, len(rows) - 1)
+    NoteDigit(digits, pos, len(rows))
+    return rows[pos]["display"]
+
+
+
+def NoteChoice(digits, row):
+    """Note a pick from a choice group, as ProbabilitiesPick does. A group with nothing in it gives blank settings."""
+    if row["pos"] == None:
+        CountFallback("blank_probabilities")
+    NoteDigit(digits, row["pos"], row["optionCount"])
+
+
+
+def NoteDigit(digits, pos, optionCount):
+    """Add a choice to a plot's list of digits, as RandomChooser does: only if there was a choice to make."""
+    if pos != None and optionCount != None and optionCount > 1:
+        digits.append((pos, optionCount))
@@ -0,0 +1,284 @@
+# Works out every plot the generator can produce, with exact probabilities, by walking the same choices as GetVariables.
+# Run directly for a report on the size of the plot space: python plotSpace.py [database path]
+import itertools
+import random
+import sys
+from fractions import Fraction
+from connectionPool import ConfigurePool, DATABASE_PATH
+from hallmarkGenerator import GetVariableBlocks, BuildSettings, CreateAliasTableFromWeights, WeightedPick, PLOT_TEMPLATE
+from plotCodec import EncodeDigits
+from plotTemplate import RenderTemplate
+from vocabulary import GetVocabulary
+
+
+# Declare some globals
+# The most plots CreatePlotSampler will put in a single alias table. Each plot costs around 200 bytes of table
+DEFAULT_MAX_SAMPLER_SIZE = 1000000
+
+
+
+def main():
+    """Print a report on the size of the plot space for hallmark.db, or another database."""
+    if len(sys.argv) > 2:
+        print("Usage: python plotSpace.py [database path]")
+        return
+
+    ConfigurePool(sys.argv[1] if len(sys.argv) == 2 else DATABASE_PATH)
+    space = GetPlotSpace()
+
+    for block in space["blocks"]:
+        mostLikely = max(block["outcomes"], key=lambda outcome: outcome["probability"])
+        print(block["name"] + ": " + str(block["paths"]) + " paths, " + str(len(block["outcomes"])) + " distinct outcomes, most likely " +
+              format(float(mostLikely["probability"]), ".4%"))
+
+    print("Plot IDs: " + str(space["paths"]))
+    print("Distinct plots: " + str(space["size"]))
+    print("Most likely plot: " + format(float(space["maxProbability"]), ".6%"))
+    print("A cache of every distinct plot would hold about " + format(EstimateCacheCharacters(space) / 1000000, ",.1f") + " million characters")
+
+
+
+
+def GetPlotSpace(vocab=None):
+    """Enumerate the choices behind every plot, returning a dictionary describing the whole plot space.
+
+    Keyword arguments:
+    vocab -- optional. The vocabulary to use; None = the current one
+
+    The plot is built from independent blocks of variables (see GetVariableBlocks), so each block is enumerated on its own
+    and the plot space is every combination of one outcome from each block.
+
+    Keys in the returned dictionary:
+    vocab -- the vocabulary the space was worked out for
+    blocks -- list of dictionaries, one per block, each with:
+        name -- the block's name
+        paths -- the number of different sets of choices through the block
+        outcomes -- tuple of dictionaries, one per distinct set of variables, with "variables", "probability" (an exact Fraction),
+                    "paths" (how many sets of choices lead to it) and "digits" (the choices for one of them, as used in plot IDs)
+        lookup -- the block's variables, as a sorted tuple of items => position in "outcomes"
+    paths -- the number of different plot IDs
+    size -- the number of distinct plots (sets of variables)
+    maxProbability -- the probability of the most likely plot
+    """
+    if vocab == None:
+        vocab = GetVocabulary()
+
+    space = {}
+    space["vocab"] = vocab
+    space["blocks"] = []
+    space["paths"] = 1
+    space["size"] = 1
+    space["maxProbability"] = Fraction(1)
+
+    for blockName, GetBlockVariables in GetVariableBlocks():
+        block = {"name": blockName, "outcomes": [], "lookup": {}, "paths": 0}
+        for blockVars, probability, digits in EnumerateBlock(vocab, GetBlockVariables):
+            block["paths"] += 1
+
+            # Different choices can lead to the same variables (e.g. two records for the same words), so combine those
+            key = tuple(sorted(blockVars.items()))
+            if key in block["lookup"]:
+                outcome = block["outcomes"][block["lookup"][key]]
+                outcome["probability"] += probability
+                outcome["paths"] += 1
+            else:
+                block["lookup"][key] = len(block["outcomes"])
+                block["outcomes"].append({"variables": blockVars, "probability": probability, "paths": 1, "digits": digits})
+
+        block["outcomes"] = tuple(block["outcomes"])
+        space["blocks"].append(block)
+        space["paths"] *= block["paths"]
+        space["size"] *= len(block["outcomes"])
+        space["maxProbability"] *= max(outcome["probability"] for outcome in block["outcomes"])
+
+    return space
+
+
+
+
+def EnumerateBlock(vocab, GetBlockVariables):
+    """Return a list of (variables, probability, digits) for every set of choices through a block, leaving out any which can't happen.
+
+    Keyword arguments:
+    vocab -- the Hallmark vocabulary
+    GetBlockVariables -- a function from GetVariableBlocks
+
+    Depth-first: run the block with a PathChooser, then move on to the next path by going up one at the last choice which has
+    options left. Choices after that start again from 0, since what they are (and how many options they have) can depend on it.
+    """
+    leaves = []
+    weightTotals = {}
+    path = []
+    while True:
+        chooser = PathChooser(path, weightTotals)
+        blockVars = GetBlockVariables(vocab, chooser)
+        if chooser.probability > 0:
+            leaves.append((blockVars, chooser.probability, tuple(chooser.digits)))
+
+        choices = chooser.digits
+        while len(choices) > 0 and choices[-1][0] + 1 >= choices[-1][1]:
+            choices.pop()
+
+        if len(choices) == 0:
+            return leaves
+
+        path = [pos for pos, count in choices[:-1]]
+        path.append(choices[-1][0] + 1)
+
+
+
+
+class PathChooser:
+    """Follows a given path of positions through a block's choices, taking the first option at any choice past the end of the path.
+
+    Keeps a note of each choice as a (position, count) digit, like RandomChooser, and of the exact probability of the whole path.
+    """
+
+    def __init__(self, path, weightTotals):
+        """Keyword arguments:
+        path -- a list of positions, one for each of the first few choices
+        weightTotals -- a dictionary for caching the total weight of each alias table, shared between choosers
+        """
+        self.path = path
+        self.weightTotals = weightTotals
+        self.digits = []
+        self.probability = Fraction(1)
+
+
+    def Choose(self, count):
+        """Return the next position on the path, where every option has an equal chance."""
+        if count <= 1:
+            return 0
+
+        pos = self.NextPosition(count)
+        self.probability *= Fraction(1, count)
+        return pos
+
+
+    def ChooseWeighted(self, aliasTable):
+        """Return the next position on the path, where each option's chance comes from the alias table's weights."""
+        count = len(aliasTable["ids"])
+        if count <= 1:
+            return 0
+
+        tableKey = id(aliasTable)
+        if tableKey not in self.weightTotals:
+            self.weightTotals[tableKey] = (aliasTable, sum(Fraction(weight) for weight in aliasTable["weights"]))
+
+        pos = self.NextPosition(count)
+        self.probability *= Fraction(aliasTable["weights"][pos]) / self.weightTotals[tableKey][1]
+        return pos
+
+
+    def NextPosition(self, count):
+        """Return the position for the next choice (from the path, or 0 past the end of it) and note it down."""
+        pos = self.path[len(self.digits)] if len(self.digits) < len(self.path) else 0
+        self.digits.append((pos, count))
+        return pos
+
+
+
+
+def IterPlots(space):
+    """Yield (variables, probability, plot ID) for every distinct plot in a plot space from GetPlotSpace.
+
+    The plot ID is an integer for RenderPlot. Where more than one ID leads to the same plot, it's one of them.
+    """
+    for outcomes in itertools.product(*(block["outcomes"] for block in space["blocks"])):
+        myVars = {"dictName": "v2.0"}
+        probability = Fraction(1)
+        digits = []
+        for outcome in outcomes:
+            myVars.update(outcome["variables"])
+            probability *= outcome["probability"]
+            digits.extend(outcome["digits"])
+
+        yield myVars, probability, EncodeDigits(digits)
+
+
+
+
+def PlotProbability(space, varDict):
+    """Return the exact probability of the plot with these variables (0 if it can't be generated)."""
+    probability = Fraction(1)
+    for block in space["blocks"]:
+        blockKeys = block["outcomes"][0]["variables"].keys()
+        pos = block["lookup"].get(tuple(sorted((key, varDict.get(key)) for key in blockKeys)))
+        if pos == None:
+            return Fraction(0)
+        probability *= block["outcomes"][pos]["probability"]
+
+    return probability
+
+
+
+
+def EstimateCacheCharacters(space):
+    """Return the total length of every distinct plot's sentence, before tidying (which only trims a leading space here and there)."""
+    # Each slot adds its value (or its default text) to the static text, so the total can be added up one block at a time
+    staticLength = sum(len(part) for part in PLOT_TEMPLATE["parts"][0::2])
+    total = staticLength * space["size"]
+    for block in space["blocks"]:
+        blockLength = 0
+        for outcome in block["outcomes"]:
+            for pos, key in PLOT_TEMPLATE["slots"]:
+                if key in outcome["variables"]:
+                    value = outcome["variables"][key]
+                    blockLength += len(value) if value != "" else len(PLOT_TEMPLATE["parts"][pos])
+
+        total += blockLength * (space["size"] // len(block["outcomes"]))
+
+    return total
+
+
+
+
+def CreatePlotSampler(space, maxSize=DEFAULT_MAX_SAMPLER_SIZE):
+    """Return a single alias table over every distinct plot in a plot space, so a plot can be generated with one weighted draw.
+
+    Keyword arguments:
+    space -- a dictionary from GetPlotSpace
+    maxSize -- raise ValueError rather than build a table for more plots than this
+
+    Table positions are mixed-radix numbers with one digit per block (the first block least significant), each the position in its outcomes.
+    """
+    if space["size"] > maxSize:
+        raise ValueError("The plot space has " + str(space["size"]) + " plots, more than the limit of " + str(maxSize))
+
+    # Multiply out the block probabilities. Each new block's position is more significant than those before it
+    weights = [1.0]
+    for block in space["blocks"]:
+        blockWeights = [float(outcome["probability"]) for outcome in block["outcomes"]]
+        weights = [weight * blockWeight for blockWeight in blockWeights for weight in weights]
+
+    sampler = {}
+    sampler["space"] = space
+    sampler["aliasTable"] = CreateAliasTableFromWeights(range(len(weights)), weights)
+    return sampler
+
+
+
+
+def SampleHallmarkSettings(sampler, rng=random):
+    """Return a modified Hallmark plot in the same format as GetHallmarkSettings(False), using a single draw from a CreatePlotSampler table.
+
+    Keyword arguments:
+    sampler -- a dictionary from CreatePlotSampler
+    rng -- a random.Random, or the random module
+    """
+    pos = WeightedPick(sampler["aliasTable"], rng)
+
+    # Split the position into one outcome per block
+    myVars = {"dictName": "v2.0"}
+    digits = []
+    for block in sampler["space"]["blocks"]:
+        pos, outcomePos = divmod(pos, len(block["outcomes"]))
+        myVars.update(block["outcomes"][outcomePos]["variables"])
+        digits.extend(block["outcomes"][outcomePos]["digits"])
+
+    return BuildSettings(sampler["space"]["vocab"], myVars, RenderTemplate(PLOT_TEMPLATE, myVars), EncodeDigits(digits))
+
+
+
+if __name__ == "__main__":
+    main()
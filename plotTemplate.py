@@ -0,0 +1,92 @@
+# Compiles strings with #[...]# tags into templates which can be filled in many times without being re-parsed
+from types import MappingProxyType
+
+
+# Declare some globals
+OPEN_TAG = "#["
+CLOSE_TAG = "]#"
+STRONG_OPEN = "<strong>"
+STRONG_CLOSE = "</strong>"
+
+
+
+def CompileTemplate(taggedStr, keyForSlot=None, validKeys=None):
+    """Parse a string with #[...]# tags once, returning a read-only dictionary which RenderTemplate can fill in.
+
+    Keyword arguments:
+    taggedStr -- the template, e.g. "#[]#an attractive young <strong>#[woman]#</strong> ..."
+    keyForSlot -- a list with one element for each tag, containing the dictionary key to be inserted. None = use the text inside each tag as its key
+    validKeys -- optional collection of the keys RenderTemplate will be given. Any other key in keyForSlot is an error
+
+    Raise ValueError if the tags aren't balanced, or if keyForSlot doesn't fit the template.
+
+    Keys in the returned dictionary:
+    parts -- tuple of strings, with static text at even positions and the text inside each tag (the default) at odd positions
+    keys -- tuple with the dictionary key for each slot
+    strong -- tuple of booleans, one per slot, indicating if the slot is wrapped in <strong> tags
+    default -- the template with every slot left as its default text
+    slots -- tuple of (position in parts, key) for each slot
+    """
+    # Walk through the string from tag to tag. str.find is enough for this, so there's no need for a regular expression
+    parts = []
+    pos = 0
+    while True:
+        openPos = taggedStr.find(OPEN_TAG, pos)
+        closePos = taggedStr.find(CLOSE_TAG, pos)
+
+        # No more tags, so whatever's left is static text. A close tag here has no matching open tag
+        if openPos == -1:
+            if closePos != -1:
+                raise ValueError("Unmatched " + CLOSE_TAG + " at position " + str(closePos) + ": " + repr(taggedStr))
+            parts.append(taggedStr[pos:])
+            break
+
+        # The next close tag must belong to this open tag: not before it and not after another open tag
+        nextOpenPos = taggedStr.find(OPEN_TAG, openPos + len(OPEN_TAG))
+        if closePos < openPos or (nextOpenPos != -1 and nextOpenPos < closePos):
+            raise ValueError("Unmatched " + OPEN_TAG + " at position " + str(openPos) + ": " + repr(taggedStr))
+
+        parts.append(taggedStr[pos:openPos])
+        parts.append(taggedStr[openPos + len(OPEN_TAG):closePos])
+        pos = closePos + len(CLOSE_TAG)
+
+    # Check there's a key assigned to each slot now, rather than finding out when the template is used
+    numSlots = len(parts) // 2
+    if keyForSlot == None:
+        keyForSlot = parts[1::2]
+    elif len(keyForSlot) != numSlots:
+        raise ValueError("The template has " + str(numSlots) + " slots, but " + str(len(keyForSlot)) + " keys were given")
+
+    if validKeys != None:
+        unknownKeys = [key for key in keyForSlot if key not in validKeys]
+        if len(unknownKeys) > 0:
+            raise ValueError("Unknown template keys: " + ", ".join(unknownKeys))
+
+    template = {}
+    template["parts"] = tuple(parts)
+    template["keys"] = tuple(keyForSlot)
+    template["strong"] = tuple(parts[i - 1].endswith(STRONG_OPEN) and parts[i + 1].startswith(STRONG_CLOSE) for i in range(1, len(parts), 2))
+    template["default"] = "".join(parts)
+
+    # Pair each key with its position in "parts", so RenderTemplate can drop the values straight in
+    template["slots"] = tuple((i * 2 + 1, key) for i, key in enumerate(keyForSlot))
+    return MappingProxyType(template)
+
+
+
+
+def RenderTemplate(template, newWordsDict):
+    """Return the template with each slot replaced by its value in newWordsDict.
+
+    Keyword arguments:
+    template -- a dictionary created by CompileTemplate.
+    newWordsDict -- a dictionary of replacement words. A value of "" means something went wrong, so the slot keeps its default text.
+    """
+    # Start from a copy of the parts, which already has the defaults in place, then overwrite the slots
+    parts = list(template["parts"])
+    for pos, key in template["slots"]:
+        value = newWordsDict[key]
+        if value != "":
+            parts[pos] = str(value)
+
+    return "".join(parts)
@@ -0,0 +1,312 @@
+# Records every database query made during a request or an import run, then reports repeated queries and per-row query loops (N+1 patterns)
+import re
+import sqlite3
+import threading
+import time
+
+
+# Declare some globals
+# A statement run this many times with different parameters counts as a per-row loop: usually one query (or executemany) could do the lot
+LOOP_THRESHOLD = 10
+
+# How many statements to list in each part of the report
+REPORT_ROWS = 10
+
+# Each thread has its own trace, so concurrent requests don't get mixed up
+_traceState = threading.local()
+
+
+
+def StartTrace(name):
+    """Start recording the queries made by this thread, replacing any trace already running.
+
+    Keyword arguments:
+    name -- what's being traced, for the report (e.g. "GET /" or "import.py --bulk words_topic.txt")
+    """
+    _traceState.trace = {"name": name, "queries": [], "startTime": time.perf_counter(), "seconds": None}
+
+
+
+
+def StopTrace():
+    """Stop recording and return this thread's trace (see GetActiveTrace), or None if there wasn't one."""
+    trace = GetActiveTrace()
+    _traceState.trace = None
+    if trace != None:
+        trace["seconds"] = time.perf_counter() - trace["startTime"]
+    return trace
+
+
+
+
+def GetActiveTrace():
+    """Return the trace this thread is recording, or None.
+
+    Keys in a trace:
+    name -- as given to StartTrace
+    queries -- list of dictionaries, one per statement in the order they ran, with "sql", "params", "rows" (rows returned, or changed
+               for statements that don't return any; None if unknown), "seconds" and "batchSize" (see RecordQuery)
+    seconds -- how long the trace ran for. None until it's stopped
+    """
+    return getattr(_traceState, "trace", None)
+
+
+
+
+def RecordQuery(queryStr, params, rows, seconds, batchSize=None):
+    """Add a statement to this thread's trace, if it's recording. Otherwise do nothing.
+
+    Keyword arguments:
+    queryStr -- the SQL
+    params -- the values for its placeholders: a tuple or a dictionary. For executemany, the first set
+    rows -- the number of rows returned or changed, or None if unknown
+    seconds -- how long it took
+    batchSize -- optional. For executemany, the number of sets of parameters it was given. Batches are already the cure for
+                 per-row queries, so they're left out when looking for duplicates and loops
+    """
+    trace = getattr(_traceState, "trace", None)
+    if trace != None:
+        trace["queries"].append({"sql": queryStr, "params": params, "rows": rows, "seconds": seconds, "batchSize": batchSize})
+
+
+
+
+def TraceConnection(db):
+    """Return a version of a database connection which records its queries in this thread's trace.
+
+    Keyword arguments:
+    db -- a sqlite3 connection, or anything with a CS50 Library style execute method (e.g. cs50.SQL)
+
+    If this thread isn't tracing, the connection comes back as it was, so there's no cost.
+    """
+    if GetActiveTrace() == None:
+        return db
+    if isinstance(db, sqlite3.Connection):
+        return TracedSQLiteConnection(db)
+    return TracedCS50Connection(db)
+
+
+
+
+class TracedCS50Connection:
+    """Wraps a connection with a CS50 Library style execute method (returning a list of rows for SELECTs, or a number otherwise)."""
+
+    def __init__(self, db):
+        self.db = db
+
+
+    def execute(self, queryStr, *args, **kwargs):
+        """Run a query on the wrapped connection, recording it."""
+        startTime = time.perf_counter()
+        result = self.db.execute(queryStr, *args, **kwargs)
+        seconds = time.perf_counter() - startTime
+
+        # SELECTs return their rows. INSERTs return the new row's ID, so the number of rows isn't known; anything else returns it
+        if isinstance(result, list):
+            rows = len(result)
+        elif queryStr.lstrip()[:6].upper() in ("UPDATE", "DELETE"):
+            rows = result
+        else:
+            rows = None
+
+        RecordQuery(queryStr, kwargs if kwargs else args, rows, seconds)
+        return result
+
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+
+
+
+class TracedSQLiteConnection:
+    """Wraps a sqlite3 connection, recording each execute, executemany and executescript.
+
+    Rows from execute are fetched straight away (so their count and the time to fetch them can be recorded), then handed back through
+    a TracedCursor. Everything else, including "with conn:" transactions, goes straight to the real connection.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+    def execute(self, queryStr, params=()):
+        startTime = time.perf_counter()
+        cursor = self.conn.execute(queryStr, params)
+        rows = cursor.fetchall()
+        seconds = time.perf_counter() - startTime
+
+        RecordQuery(queryStr, params, len(rows) if cursor.description != None else cursor.rowcount, seconds)
+        return TracedCursor(cursor, rows)
+
+
+    def executemany(self, queryStr, paramsList):
+        paramsList = list(paramsList)
+        startTime = time.perf_counter()
+        cursor = self.conn.executemany(queryStr, paramsList)
+        RecordQuery(queryStr, paramsList[0] if len(paramsList) > 0 else (), cursor.rowcount, time.perf_counter() - startTime, len(paramsList))
+        return cursor
+
+
+    def executescript(self, script):
+        startTime = time.perf_counter()
+        cursor = self.conn.executescript(script)
+        RecordQuery(script, (), None, time.perf_counter() - startTime)
+        return cursor
+
+
+    def __enter__(self):
+        self.conn.__enter__()
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        return self.conn.__exit__(excType, excValue, traceback)
+
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+
+
+class TracedCursor:
+    """Hands back rows already fetched by TracedSQLiteConnection.execute, with the same methods the importer uses on a sqlite3 cursor."""
+
+    def __init__(self, cursor, rows):
+        self.cursor = cursor
+        self.rows = iter(rows)
+        self.lastrowid = cursor.lastrowid
+        self.rowcount = cursor.rowcount
+        self.description = cursor.description
+
+
+    def __iter__(self):
+        return self.rows
+
+
+    def fetchone(self):
+        return next(self.rows, None)
+
+
+    def fetchall(self):
+        return list(self.rows)
+
+
+
+
+def NormaliseQuery(queryStr):
+    """Return the shape of a statement: whitespace collapsed, with any literal strings and numbers written into the SQL replaced by ?."""
+    queryStr = re.sub(r"'(?:[^']|'')*'", "?", queryStr)
+    queryStr = re.sub(r"\b\d+(?:\.\d+)?\b", "?", queryStr)
+    return " ".join(queryStr.split())
+
+
+
+
+def GetStatementStats(trace, includeBatches=True):
+    """Return a list of dictionaries, one per statement shape (see NormaliseQuery), with "sql", "count", "distinct" (different
+    sets of parameters), "rows" and "seconds", slowest first.
+
+    Keyword arguments:
+    trace -- a trace from StopTrace
+    includeBatches -- optional. False = leave out executemany calls
+    """
+    stats = {}
+    for query in trace["queries"]:
+        if query["batchSize"] != None and not includeBatches:
+            continue
+        shape = NormaliseQuery(query["sql"])
+        stat = stats.setdefault(shape, {"sql": shape, "count": 0, "calls": set(), "rows": 0, "seconds": 0.0})
+        stat["count"] += 1
+        stat["calls"].add((query["sql"], FreezeParams(query["params"])))
+        stat["rows"] += query["rows"] if query["rows"] != None and query["rows"] > 0 else 0
+        stat["seconds"] += query["seconds"]
+
+    for stat in stats.values():
+        stat["distinct"] = len(stat.pop("calls"))
+
+    return sorted(stats.values(), key=lambda stat: stat["seconds"], reverse=True)
+
+
+
+
+def FindDuplicateQueries(trace):
+    """Return a list of (sql, params, count, seconds) for every statement run more than once with exactly the same parameters,
+    most repeated first. Unless something changed in between, every run after the first was wasted."""
+    calls = {}
+    for query in trace["queries"]:
+        if query["batchSize"] != None:
+            continue
+        key = (query["sql"], FreezeParams(query["params"]))
+        count, seconds = calls.get(key, (0, 0.0))
+        calls[key] = (count + 1, seconds + query["seconds"])
+
+    duplicates = [(sql, params, count, seconds) for (sql, params), (count, seconds) in calls.items() if count > 1]
+    return sorted(duplicates, key=lambda duplicate: duplicate[2], reverse=True)
+
+
+
+
+def FindQueryLoops(trace, threshold=LOOP_THRESHOLD):
+    """Return the statement stats (see GetStatementStats) for every statement run at least threshold times with different parameters:
+    the sign of a loop making one query per row (an N+1 pattern), which a single query or an executemany could usually replace."""
+    return [stat for stat in GetStatementStats(trace, False) if stat["count"] >= threshold and stat["distinct"] > 1]
+
+
+
+
+def FreezeParams(params):
+    """Return query parameters in a form which can go in a set."""
+    if isinstance(params, dict):
+        return tuple(sorted(params.items()))
+    if isinstance(params, (list, tuple)):
+        return tuple(params)
+    return params
+
+
+
+
+def FormatTraceReport(trace):
+    """Return a summary of a trace as text: totals, the statements that took longest, then any duplicates and per-row loops."""
+    totalSeconds = sum(query["seconds"] for query in trace["queries"])
+    totalRows = sum(query["rows"] for query in trace["queries"] if query["rows"] != None and query["rows"] > 0)
+    lines = ["Query trace for " + trace["name"] + ": " + str(len(trace["queries"])) + " queries, " + FormatMs(totalSeconds) + " in the database, " +
+             str(totalRows) + " rows" + ("" if trace["seconds"] == None else ", " + FormatMs(trace["seconds"]) + " in total")]
+
+    stats = GetStatementStats(trace)
+    if len(stats) > 0:
+        lines.append("Slowest statements:")
+        for stat in stats[:REPORT_ROWS]:
+            lines.append("  " + str(stat["count"]) + "x, " + FormatMs(stat["seconds"]) + ", " + str(stat["rows"]) + " rows: " + Shorten(stat["sql"]))
+
+    duplicates = FindDuplicateQueries(trace)
+    if len(duplicates) > 0:
+        lines.append("Repeated identical queries (" + str(len(duplicates)) + "):")
+        for sql, params, count, seconds in duplicates[:REPORT_ROWS]:
+            lines.append("  " + str(count) + "x, " + FormatMs(seconds) + ": " + Shorten(" ".join(sql.split())) + " with " + Shorten(repr(params)))
+
+    loops = FindQueryLoops(trace)
+    if len(loops) > 0:
+        lines.append("Per-row query loops, possible N+1 (" + str(len(loops)) + "):")
+        for stat in loops[:REPORT_ROWS]:
+            lines.append("  " + str(stat["count"]) + "x with " + str(stat["distinct"]) + " different parameters, " + FormatMs(stat["seconds"]) +
+                         ": " + Shorten(stat["sql"]))
+
+    return "\n".join(lines)
+
+
+
+
+def FormatMs(seconds):
+    """Return a number of seconds as milliseconds, for the report."""
+    return format(seconds * 1000, ",.1f") + "ms"
+
+
+
+
+def Shorten(text, maxLength=160):
+    """Return text cut down to maxLength characters, for the report."""
+    if len(text) <= maxLength:
+        return text
+    return text[:maxLength - 3] + "..."
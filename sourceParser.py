@@ -0,0 +1,248 @@
+# Reads the sourceData .txt format one line at a time, turning it into typed records for import.py
+import os
+import re
+
+
+# Tables the parser understands (i.e. the valid "#table" section headers), with the sections each one relies on.
+# e.g. verbs need the infinitives and the pronoun groups; pronoun groups need the pronoun words.
+# Anything that looks words up by display text relies on every section which can add words.
+WORDS_SECTIONS = ["words", "pronounSets", "verbs", "characterSettings"]
+SECTION_DEPENDENCIES = {
+    "words": [],
+    "pronounSets": [],
+    "infinitives": [],
+    "images": [],
+    "pronounGroupMembers": ["words", "pronounSets"],
+    "verbs": ["infinitives", "pronounGroupMembers"],
+    "characterSettings": ["words", "pronounSets"],
+    "probabilities": WORDS_SECTIONS,
+    "wordsToImages": WORDS_SECTIONS + ["images"],
+    "titleTemplates": WORDS_SECTIONS
+}
+SECTION_TABLES = list(SECTION_DEPENDENCIES)
+
+
+
+class SourceFormatError(ValueError):
+    """Raised when a line in a sourceData file doesn't match the format for its section."""
+
+    def __init__(self, lineNum, line, problem):
+        super().__init__(lineNum, line, problem)
+        self.lineNum = lineNum
+        self.line = line
+        self.problem = problem
+
+
+    def __str__(self):
+        return "Line " + str(self.lineNum) + ": " + self.problem + ": " + repr(self.line)
+
+
+
+
+def ParseSourceFile(reader):
+    """Yield a (table name, records) pair for each "#table" section in a sourceData file.
+
+    Keyword arguments:
+    reader -- an open file (or any iterable of lines).
+
+    "records" is a generator which reads the section's lines as they're needed, yielding one dictionary per record.
+    Every record has a "type" key; see ParseLine for the rest. A section's records must be used before moving on to the next
+    section (any that aren't are skipped). Only one line is held in memory at a time, however long the file.
+    """
+    # The parser is a small state machine. "header" is the "#table" line which ended the previous section (if any)
+    state = {"lines": enumerate(reader, start=1), "header": None}
+
+    # Skip anything before the first header
+    for lineNum, line in state["lines"]:
+        if line.startswith("#"):
+            state["header"] = line
+            break
+
+    while state["header"] != None:
+        myTable = state["header"].rstrip("\r\n").replace("#", "")
+        state["header"] = None
+        records = ParseSection(myTable, state)
+        yield myTable, records
+
+        # If the section wasn't used up, finish reading it so the next header is found
+        for record in records:
+            pass
+
+
+
+
+def ParseFileSections(srcDataFile):
+    """Parse a whole sourceData file, returning a list of (table name, list of records) pairs. Used by the parallel directory import."""
+    with open(srcDataFile, "r") as reader:
+        try:
+            return [(myTable, list(records)) for myTable, records in ParseSourceFile(reader)]
+        except SourceFormatError as e:
+            raise SourceFormatError(e.lineNum, e.line, os.path.basename(srcDataFile) + ": " + e.problem)
+
+
+
+
+def GetSectionOrder():
+    """Return a dictionary of section table name => rank, where every section ranks after all the sections it relies on."""
+    # Kahn's algorithm: repeatedly take the sections whose dependencies have all been placed
+    ranks = {}
+    remaining = list(SECTION_TABLES)
+    while len(remaining) > 0:
+        ready = [table for table in remaining if all(dep in ranks for dep in SECTION_DEPENDENCIES[table])]
+        if len(ready) == 0:
+            raise ValueError("SECTION_DEPENDENCIES contains a cycle: " + ", ".join(remaining))
+        for table in ready:
+            ranks[table] = len(ranks)
+            remaining.remove(table)
+
+    return ranks
+
+
+
+
+def OrderSections(parsedFiles):
+    """Return every section from a list of parsed files, sorted so each section comes after the sections it relies on.
+
+    Keyword arguments:
+    parsedFiles -- a list of (filename, list of (table name, list of records)) pairs, as from ParseFileSections.
+
+    Sections of the same type keep their order (by filename, then position within the file). Unknown sections go last.
+    """
+    ranks = GetSectionOrder()
+    sections = []
+    for filename, fileSections in parsedFiles:
+        for position, (myTable, records) in enumerate(fileSections):
+            sections.append((ranks.get(myTable, len(ranks)), filename, position, myTable, records))
+
+    sections.sort(key=lambda section: section[:3])
+    return [(myTable, records) for rank, filename, position, myTable, records in sections]
+
+
+
+
+def ParseSection(myTable, state):
+    """Yield the records for one section, stopping at the next "#table" header (which is left in state["header"])."""
+    # Some lines set a "group" (e.g. "~categoryName") which applies to every line below it, until the next one
+    group = {"name": None}
+
+    for lineNum, line in state["lines"]:
+        line = line.rstrip("\r\n")
+
+        if line == "":
+            continue
+
+        if line[0] == "#":
+            state["header"] = line
+            return
+
+        for record in ParseLine(myTable, group, lineNum, line):
+            yield record
+
+
+
+
+def ParseLine(myTable, group, lineNum, line):
+    """Return a list of records for one line of a section. Raise SourceFormatError if the line doesn't fit the section's format.
+
+    Record types, by section:
+    infinitives -- "name" {name}
+    pronounGroupMembers -- "pronounGroup" {name}; "pronounGroupMember" {group, pronoun}
+    words -- "category" {name}; "word" {category, display}
+    pronounSets -- "pronounSet" {subject, object}
+    verbs -- "infinitive" {name}; "verb" {infinitive, pronounGroup, display}
+    characterSettings -- "character" {display}; "characterSettings" {character, pronouns, hometowns}
+    probabilities -- "choiceGroup" {name}; "probability" {choiceGroup, probability, note, word, category, prefixStr}
+    images -- "image" {name, filename, fextension}
+    wordsToImages -- "wordsToImage" {display, image}
+    titleTemplates -- "titleTemplate" {titleTemplate, display}  (display is None for templates that suit anything)
+    anything else -- "unknown" {line}
+    """
+    if myTable == "infinitives":
+        return [{"type": "name", "name": line}]
+
+    elif myTable in ["pronounGroupMembers", "words", "verbs", "probabilities"] and line[0] == "~":
+        group["name"] = line.replace("~", "")
+        groupTypes = {"pronounGroupMembers": "pronounGroup", "words": "category", "verbs": "infinitive", "probabilities": "choiceGroup"}
+        return [{"type": groupTypes[myTable], "name": group["name"]}]
+
+    elif myTable == "words":
+        if group["name"] == None:
+            raise SourceFormatError(lineNum, line, "words before the first ~category")
+        return [{"type": "word", "category": group["name"], "display": line}]
+
+    elif myTable == "pronounGroupMembers":
+        if group["name"] == None or line[0] != "\t":
+            raise SourceFormatError(lineNum, line, "expected a tab, then p=pronoun,pronoun,... after a ~group")
+        return [{"type": "pronounGroupMember", "group": group["name"], "pronoun": p} for p in re.split('p=|,', line)[1:]]
+
+    elif myTable == "pronounSets":
+        mySplit = line.split(",")
+        if len(mySplit) != 2:
+            raise SourceFormatError(lineNum, line, "expected subject,object")
+        return [{"type": "pronounSet", "subject": mySplit[0], "object": mySplit[1]}]
+
+    elif myTable == "verbs":
+        pairSplit = line.replace("\t", "").split("=")
+        if group["name"] == None or len(pairSplit) != 2:
+            raise SourceFormatError(lineNum, line, "expected a tab, then pronounGroup=verb after a ~infinitive")
+        return [{"type": "verb", "infinitive": group["name"], "pronounGroup": pairSplit[0], "display": pairSplit[1]}]
+
+    elif myTable == "characterSettings":
+        # Lines without a tab name the character; lines with one hold the settings for the character above
+        if line[0] != "\t":
+            group["name"] = line
+            return [{"type": "character", "display": line}]
+
+        if group["name"] == None:
+            raise SourceFormatError(lineNum, line, "settings before the first character")
+
+        record = {"type": "characterSettings", "character": group["name"], "pronouns": [], "hometowns": []}
+        for t in line.split("\t")[1:]:
+            headSplit = t.split("=")
+            if len(headSplit) != 2:
+                raise SourceFormatError(lineNum, line, "expected p=... and/or h=...")
+            if headSplit[0] == "p":
+                record["pronouns"].extend(headSplit[1].split(","))
+            elif headSplit[0] == "h":
+                record["hometowns"].extend(headSplit[1].split(","))
+        return [record]
+
+    elif myTable == "probabilities":
+        recordSettings = line.split("\t")
+        if group["name"] == None or line[0] != "\t" or len(recordSettings) < 2:
+            raise SourceFormatError(lineNum, line, "expected a tab, then a probability and settings after a ~choiceGroup")
+
+        try:
+            record = {"type": "probability", "choiceGroup": group["name"], "probability": float(recordSettings[1]),
+                      "note": None, "word": None, "category": None, "prefixStr": None}
+        except ValueError:
+            raise SourceFormatError(lineNum, line, "the probability isn't a number")
+
+        # There are four possible types of settings, flagged as n, w, c and p
+        settingKeys = {"n": "note", "w": "word", "c": "category", "p": "prefixStr"}
+        for thisTab in recordSettings[2:]:
+            mySplit = thisTab.split("=")
+            if mySplit[0] in settingKeys:
+                record[settingKeys[mySplit[0]]] = mySplit[1]
+        return [record]
+
+    elif myTable == "images":
+        splitLine = line.split(",")
+        if len(splitLine) != 3:
+            raise SourceFormatError(lineNum, line, "expected name,filename,extension")
+        return [{"type": "image", "name": splitLine[0], "filename": splitLine[1], "fextension": splitLine[2]}]
+
+    elif myTable == "wordsToImages":
+        splitLine = line.split(",")
+        if len(splitLine) != 2:
+            raise SourceFormatError(lineNum, line, "expected words,imageName")
+        return [{"type": "wordsToImage", "display": splitLine[0], "image": splitLine[1]}]
+
+    elif myTable == "titleTemplates":
+        splitLine = line.split("//")
+        if len(splitLine) != 2:
+            raise SourceFormatError(lineNum, line, "expected titleTemplate//words")
+        return [{"type": "titleTemplate", "titleTemplate": splitLine[0], "display": splitLine[1] if splitLine[1] != "" else None}]
+
+    else:
+        return [{"type": "unknown", "line": line}]
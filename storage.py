@@ -0,0 +1,190 @@
+# Database connections for the importer and the generator, behind one interface with a choice of backends:
+#   sqlite -- Python's own sqlite3 module (the default)
+#   cs50 -- the CS50 Library's SQL class, for compatibility. Much slower, since it parses and reformats every statement
+# Set HALLMARK_STORAGE=cs50 to use the CS50 Library instead of sqlite3
+import os
+import sqlite3
+import time
+from queryTracer import RecordQuery
+
+# The CS50 Library is only needed for the cs50 backend
+try:
+    import cs50
+except ImportError:
+    cs50 = None
+
+
+# Declare some globals
+DEFAULT_BACKEND = "sqlite"
+
+# How many prepared statements each sqlite3 connection keeps. Enough for every distinct statement the importer or the generator sends,
+# so each one is only compiled the first time it's used
+STATEMENT_CACHE_SIZE = 256
+
+# First words of statements which return the ID of the row they added, or the number of rows they changed
+INSERT_COMMANDS = ("INSERT", "REPLACE")
+CHANGE_COMMANDS = ("UPDATE", "DELETE")
+
+
+
+def OpenStorage(dbPath, backend=None, readOnly=False):
+    """Return a new connection to a database, with a CS50 Library style execute method (see SQLiteStorage.execute).
+
+    Keyword arguments:
+    dbPath -- the path to the SQLite database file.
+    backend -- optional. "sqlite" or "cs50". None = the HALLMARK_STORAGE environment variable, or "sqlite" if it isn't set.
+    readOnly -- optional. True = refuse to change the database. The cs50 backend can't open a database read-only, so it ignores this.
+    """
+    if backend == None:
+        backend = os.environ.get("HALLMARK_STORAGE", DEFAULT_BACKEND)
+
+    if backend == "sqlite":
+        return SQLiteStorage(dbPath, readOnly)
+
+    if backend == "cs50":
+        if cs50 == None:
+            raise ValueError("the cs50 storage backend needs the CS50 Library (pip install cs50)")
+        return CS50Storage(dbPath)
+
+    raise ValueError("unknown storage backend: " + str(backend) + ". Use sqlite or cs50")
+
+
+
+
+class SQLiteStorage:
+    """A sqlite3 connection whose execute method behaves like the CS50 Library's, without its cost.
+
+    Each distinct statement is prepared once and kept in sqlite3's statement cache, along with a note of what kind of statement it
+    is. Rows come back as sqlite3.Row objects, which can be read by column name like the CS50 Library's dictionaries.
+    Like the CS50 Library, every statement outside an explicit BEGIN ... COMMIT is committed straight away.
+    """
+
+    def __init__(self, dbPath, readOnly=False):
+        """Keyword arguments:
+        dbPath -- the path to the SQLite database file.
+        readOnly -- optional. True = open the database read-only.
+        """
+        # Pooled connections are handed from thread to thread, but only ever used by one thread at a time
+        if readOnly:
+            self.connection = sqlite3.connect("file:" + dbPath + "?mode=ro", uri=True, check_same_thread=False,
+                                              isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE)
+        else:
+            self.connection = sqlite3.connect(dbPath, check_same_thread=False, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE)
+        self.connection.row_factory = sqlite3.Row
+        self.commands = {}
+
+
+    def execute(self, queryStr, *args, **kwargs):
+        """Run a statement and return what the CS50 Library would: a list of rows for statements which return rows, the new row's ID
+        (or None) for INSERT, the number of rows changed for UPDATE and DELETE, and True for anything else.
+
+        Keyword arguments:
+        queryStr -- the SQL, with ? or :name placeholders
+        args / kwargs -- values for the placeholders (positional for ?, named for :name)
+
+        A statement which breaks a constraint (e.g. a duplicate in a unique index) raises ValueError, as it does in the CS50 Library.
+        """
+        startTime = time.perf_counter()
+        params = kwargs if kwargs else args
+        try:
+            cursor = self.connection.execute(queryStr, params)
+        except sqlite3.IntegrityError as e:
+            raise ValueError(str(e)) from None
+
+        if cursor.description != None:
+            result = cursor.fetchall()
+            rows = len(result)
+        else:
+            command = self.GetCommand(queryStr)
+            rows = cursor.rowcount
+            if command in INSERT_COMMANDS:
+                result = cursor.lastrowid if cursor.rowcount == 1 else None
+            elif command in CHANGE_COMMANDS:
+                result = cursor.rowcount
+            else:
+                result = True
+
+        # Does nothing unless this thread is tracing its queries
+        RecordQuery(queryStr, params, rows, time.perf_counter() - startTime)
+        return result
+
+
+    def executemany(self, queryStr, paramsList):
+        """Run a statement once for each set of values in paramsList, in a single call, and return the number of rows changed.
+
+        Keyword arguments:
+        queryStr -- the SQL, with ? or :name placeholders
+        paramsList -- a list of tuples (for ?) or dictionaries (for :name)
+        """
+        paramsList = list(paramsList)
+        startTime = time.perf_counter()
+        try:
+            cursor = self.connection.executemany(queryStr, paramsList)
+        except sqlite3.IntegrityError as e:
+            raise ValueError(str(e)) from None
+
+        RecordQuery(queryStr, paramsList[0] if len(paramsList) > 0 else (), cursor.rowcount, time.perf_counter() - startTime, len(paramsList))
+        return cursor.rowcount
+
+
+    def GetCommand(self, queryStr):
+        """Return the first word of a statement, in capitals, working it out only the first time the statement is seen."""
+        command = self.commands.get(queryStr)
+        if command == None:
+            words = queryStr.split(None, 1)
+            command = words[0].upper() if len(words) > 0 else ""
+            self.commands[queryStr] = command
+        return command
+
+
+    def close(self):
+        """Close the underlying connection."""
+        self.connection.close()
+
+
+
+
+class CS50Storage:
+    """The CS50 Library's SQL class, with an executemany method and its queries recorded for tracing like SQLiteStorage's."""
+
+    def __init__(self, dbPath):
+        """Keyword arguments:
+        dbPath -- the path to the SQLite database file.
+        """
+        self.connection = cs50.SQL("sqlite:///" + dbPath)
+
+
+    def execute(self, queryStr, *args, **kwargs):
+        """Run a statement through the CS50 Library and return its result."""
+        startTime = time.perf_counter()
+        result = self.connection.execute(queryStr, *args, **kwargs)
+
+        # SELECTs return their rows. INSERTs return the new row's ID, so the number of rows isn't known; anything else returns it
+        if isinstance(result, list):
+            rows = len(result)
+        elif queryStr.lstrip()[:6].upper() in CHANGE_COMMANDS:
+            rows = result
+        else:
+            rows = None
+
+        RecordQuery(queryStr, kwargs if kwargs else args, rows, time.perf_counter() - startTime)
+        return result
+
+
+    def executemany(self, queryStr, paramsList):
+        """Run a statement once for each set of values in paramsList and return the number of rows changed.
+        The CS50 Library has no batches, so this is one execute per set."""
+        isInsert = queryStr.lstrip().upper().startswith(INSERT_COMMANDS)
+        changed = 0
+        for params in paramsList:
+            result = self.execute(queryStr, **params) if isinstance(params, dict) else self.execute(queryStr, *params)
+            if isInsert and result != None:
+                changed += 1
+            elif not isInsert and type(result) == int:
+                changed += result
+        return changed
+
+
+    def close(self):
+        """The CS50 Library closes its connections itself."""
+        pass
@@ -0,0 +1,77 @@
+# Finds which of a fixed set of strings appear inside a piece of text, in a single pass over the text
+from collections import deque
+
+
+
+def BuildMatcher(patterns):
+    """Return an Aho-Corasick automaton, as a dictionary, for finding the given patterns inside other strings.
+
+    Keyword arguments:
+    patterns -- a list of strings. Matches are reported by position in this list
+
+    Keys in the returned dictionary:
+    goto -- list with a dictionary for each state, of character => next state. State 0 is the start
+    fail -- list with the state to fall back to for each state, when the next character has nowhere to go
+    output -- list with a tuple for each state, of the positions of every pattern which ends at that state
+    """
+    goto = [{}]
+    output = [[]]
+
+    # Build a trie of the patterns. Each pattern's final state records its position in the list
+    for patternPos, pattern in enumerate(patterns):
+        state = 0
+        for ch in pattern:
+            nextState = goto[state].get(ch)
+            if nextState == None:
+                nextState = len(goto)
+                goto[state][ch] = nextState
+                goto.append({})
+                output.append([])
+            state = nextState
+        output[state].append(patternPos)
+
+    # Work out the fail links breadth-first, so each state's fallback is finished before anything that depends on it.
+    # Each state also takes on the outputs of its fallback, so a search never has to follow the fail links to find matches
+    fail = [0] * len(goto)
+    workList = deque(goto[0].values())
+    while len(workList) > 0:
+        state = workList.popleft()
+        for ch, nextState in goto[state].items():
+            fallback = fail[state]
+            while fallback != 0 and ch not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[nextState] = goto[fallback].get(ch, 0)
+            output[nextState].extend(output[fail[nextState]])
+            workList.append(nextState)
+
+    matcher = {}
+    matcher["goto"] = goto
+    matcher["fail"] = fail
+    matcher["output"] = [tuple(patternPositions) for patternPositions in output]
+    return matcher
+
+
+
+
+def FindMatches(matcher, text):
+    """Return a set with the position of every pattern which appears somewhere in 'text'.
+
+    Keyword arguments:
+    matcher -- a dictionary created by BuildMatcher
+    text -- the string to search
+    """
+    goto = matcher["goto"]
+    fail = matcher["fail"]
+    output = matcher["output"]
+
+    # Empty patterns end at the start state, so they match anything
+    found = set(output[0])
+    state = 0
+    for ch in text:
+        while state != 0 and ch not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(ch, 0)
+        if output[state]:
+            found.update(output[state])
+
+    return found
@@ -0,0 +1,292 @@
+# Writes a made-up vocabulary in the sourceData format, at any size, for testing how the generator and importer cope with a big vocabulary.
+# Usage: python syntheticSourceData.py [--words N] [--skew S] [--seed N] [--out directory] [--db database path]
+import argparse
+import importlib
+import os
+import random
+from hallmarkGenerator import CreateAliasTableFromWeights, WeightedPick
+from migrate import CreateDatabase
+
+
+# Declare some globals
+DEFAULT_WORDS = 10000
+DEFAULT_SKEW = 1.1
+DEFAULT_SEED = 2022
+DEFAULT_OUT_DIR = "syntheticData"
+
+# Share of the words in each category. Locations are the hometowns, which characterSettings adds to the words table itself
+WORD_SHARES = {"humanoid": 0.15, "animal": 0.08, "inanimate": 0.07, "location": 0.10, "topic": 0.35,
+               "adjective": 0.12, "age": 0.02, "jobDesc": 0.05, "specialLifeguide": 0.06}
+CHARACTER_CATEGORIES = ("humanoid", "animal", "inanimate")
+
+# Made-up words are strings of these syllables, so they never contain anything with a meaning in sourceData (commas, tabs, //, #, ~ or =)
+SYLLABLES = [consonant + vowel for consonant in "bdfgklmnprstvz" for vowel in "aeiou"]
+
+# The pronouns and verbs the plot needs, as in sourceData/grammar.txt. Made-up pronouns are added to the she/he/it group
+PRONOUN_SETS = [("she", "her"), ("he", "him"), ("it", "it"), ("they", "them")]
+PRONOUN_WEIGHTS = {"she": 0.4, "he": 0.4, "it": 0.05, "they": 0.1}
+EXTRA_PRONOUN_WEIGHT = 0.05
+EXTRA_PRONOUN_SHARE = 0.0005
+VERBS = {"to work": {"she/he/it": "works", "they": "work"}, "to meet": {"she/he/it": "meets", "they": "meet"}}
+
+# The bees and the lifeguide settings are the same as sourceData's
+BEES = "a swarm of bees in the shape of "
+LIFEGUIDE_SETTINGS = [("0.80", "humanoid", "#[adjective]# #[age]#"), ("0.08", "animal", "#[adjective]# talking"),
+                      ("0.08", "inanimate", "#[adjective]# sentient"), ("0.04", "specialLifeguide", None)]
+
+# Share of the characters with their own record in the mainChar choice group. The rest can only come up as "any valid main character", which gets ANY_CHARACTER_WEIGHT
+MAIN_CHAR_SHARE = 0.1
+ANY_CHARACTER_WEIGHT = 0.1
+
+# Number of images and title templates per word, and the share of title templates which suit any plot (i.e. use #[topic]# and aren't linked to words)
+IMAGES_PER_WORD = 0.05
+TITLES_PER_WORD = 0.1
+UNIVERSAL_TITLE_SHARE = 0.05
+
+# The most pronouns and hometowns for one character, words linked to one image and words linked to one title template.
+# The number for each is skewed towards 1, with a long tail up to these
+MAX_PRONOUNS = 3
+MAX_HOMETOWNS = 8
+MAX_IMAGE_WORDS = 50
+MAX_TITLE_WORDS = 5
+
+TITLE_PATTERNS = ["Romance at the {}", "Love in the {}", "A {} Christmas", "Home for the {}", "Finding the {}", "Return to the {}"]
+UNIVERSAL_TITLE_PATTERNS = ["A {} of #[topic]#", "{} and #[topic]#", "Love, {}, #[topic]#", "Just Add #[topic]# and {}"]
+
+
+
+def main():
+    """Write a made-up vocabulary to a directory of .txt files, and import it into a new database if one is named."""
+    parser = argparse.ArgumentParser(description="Write a made-up vocabulary in the sourceData format, and optionally import it into a new database.")
+    parser.add_argument("--words", type=int, default=DEFAULT_WORDS, help="roughly how many words to make (default: " + str(DEFAULT_WORDS) + ")")
+    parser.add_argument("--skew", type=float, default=DEFAULT_SKEW, help="Zipf exponent for weights and links; 0 = no skew (default: " + str(DEFAULT_SKEW) + ")")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="the same seed and settings always make the same files")
+    parser.add_argument("--out", default=DEFAULT_OUT_DIR, help="new or empty directory for the .txt files (default: " + DEFAULT_OUT_DIR + ")")
+    parser.add_argument("--db", default=None, help="also create this database and import the files into it, as with import.py --dir --bulk")
+    args = parser.parse_args()
+
+    if args.words < 1 or args.skew < 0:
+        parser.error("--words must be at least 1 and --skew can't be negative")
+    if os.path.isdir(args.out) and len(os.listdir(args.out)) > 0:
+        parser.error(args.out + " isn't empty. import.py --dir would import anything else in there too, so choose a new or empty directory")
+    if args.db != None and os.path.exists(args.db):
+        parser.error(args.db + " already exists")
+
+    os.makedirs(args.out, exist_ok=True)
+    vocab = CreateSyntheticVocabulary(args.words, args.skew, random.Random(args.seed))
+    WriteSourceData(vocab, args.out)
+    print("Wrote " + format(CountWords(vocab), ",") + " words to " + args.out)
+
+    if args.db != None:
+        BuildDatabase(args.db, args.out)
+
+
+
+def CreateSyntheticVocabulary(numWords, skew, rng):
+    """Return a dictionary holding a made-up vocabulary, ready for WriteSourceData.
+
+    Keyword arguments:
+    numWords -- roughly how many words to make, split between the categories as per WORD_SHARES
+    skew -- the exponent for the Zipf distributions: the nth most popular option is 1/n^skew times as likely as the most popular
+    rng -- a random.Random
+
+    Keys in the returned dictionary:
+    categoryWords -- category name => list of display text, for the #words sections
+    pronounSets -- list of (subject, object) pronouns
+    pronounGroups -- pronoun group name => list of subject pronouns
+    characterSettings -- list of (character, list of pronouns, list of hometowns)
+    choiceGroups -- choice group name => list of (probability string, dictionary of flags), for the #probabilities sections
+    images -- list of image names. The filename is the same as the name
+    wordsToImages -- list of (words display text, image name)
+    titleTemplates -- list of (title template, words display text or None)
+    """
+    vocab = {}
+    nextIndex = [0]
+
+    def NewWord(extraWords):
+        # Every word starts with a made-up word no other word has, so display text never repeats
+        nextIndex[0] += 1
+        return " ".join([PseudoWord(nextIndex[0])] + [PseudoWord(rng.randrange(len(SYLLABLES) ** 2)) for i in range(extraWords)])
+
+    countSkew = CreateZipfTable(4, skew)
+    vocab["categoryWords"] = {}
+    for category, share in WORD_SHARES.items():
+        vocab["categoryWords"][category] = [NewWord(WeightedPick(countSkew, rng)) for i in range(max(2, round(numWords * share)))]
+
+    # Locations only become words through characterSettings, so take them back out of the #words sections
+    locations = vocab["categoryWords"].pop("location")
+    vocab["categoryWords"]["toBeeOrNotToBee"] = [BEES, " "]
+
+    # Grammar: the usual pronouns, plus some made-up ones
+    extraPronouns = [(PseudoWord(len(SYLLABLES) + i) + "x", PseudoWord(len(SYLLABLES) + i) + "xm") for i in range(round(numWords * EXTRA_PRONOUN_SHARE))]
+    vocab["pronounSets"] = PRONOUN_SETS + extraPronouns
+    vocab["pronounGroups"] = {"they": ["they"], "she/he/it": ["she", "he", "it"] + [subj for subj, obj in extraPronouns]}
+
+    pronounWeights = list(PRONOUN_WEIGHTS.values()) + [EXTRA_PRONOUN_WEIGHT * weight for weight in ZipfWeights(len(extraPronouns), skew)]
+    pronounTable = CreateAliasTableFromWeights(list(PRONOUN_WEIGHTS) + [subj for subj, obj in extraPronouns], pronounWeights)
+
+    # Each character gets a different first hometown (so every location is used), then a skewed number of extra ones.
+    # Extra hometowns are skewed too, so a few are shared by lots of characters, like "small town"
+    characters = [word for category in CHARACTER_CATEGORIES for word in vocab["categoryWords"][category]]
+    rng.shuffle(characters)
+    locationTable = CreateZipfTable(len(locations), skew)
+    pronounCountTable = CreateZipfTable(MAX_PRONOUNS, skew)
+    hometownCountTable = CreateZipfTable(MAX_HOMETOWNS, skew)
+
+    vocab["characterSettings"] = [(BEES, ["they"], ["rural apiary"])]
+    for pos, character in enumerate(characters):
+        pronouns = PickDistinct(pronounTable, WeightedPick(pronounCountTable, rng) + 1, rng)
+        hometowns = [locations[pos % len(locations)]]
+        hometowns += [locations[pick] for pick in PickDistinct(locationTable, WeightedPick(hometownCountTable, rng), rng) if pick != pos % len(locations)]
+        vocab["characterSettings"].append((character, pronouns, hometowns))
+
+    # Choice groups: a skewed selection of characters for mainChar, plus "any valid main character"; skewed job descriptions; the usual lifeguides and bees
+    mainChars = characters[:max(1, round(len(characters) * MAIN_CHAR_SHARE))]
+    vocab["choiceGroups"] = {}
+    vocab["choiceGroups"]["toBeeOrNotToBee"] = [("0.92", {"n": "not to bee", "w": " "}), ("0.08", {"w": BEES, "n": "to bee"})]
+    vocab["choiceGroups"]["mainChar"] = [(FormatWeight(weight * (1 - ANY_CHARACTER_WEIGHT)), {"w": character})
+                                         for character, weight in zip(mainChars, ZipfWeights(len(mainChars), skew))]
+    vocab["choiceGroups"]["mainChar"].append((FormatWeight(ANY_CHARACTER_WEIGHT), {"n": "has pronoun, has hometown, is humanoid|animal|inanimate"}))
+    vocab["choiceGroups"]["jobDesc"] = [(FormatWeight(weight), {"w": jobDesc})
+                                        for jobDesc, weight in zip(vocab["categoryWords"]["jobDesc"], ZipfWeights(len(vocab["categoryWords"]["jobDesc"]), skew))]
+    vocab["choiceGroups"]["lifeguide"] = [(probability, {"c": category} if prefixStr == None else {"c": category, "p": prefixStr})
+                                          for probability, category, prefixStr in LIFEGUIDE_SETTINGS]
+
+    # Images and titles link to the words that can trigger them: some words are far more likely to be linked than others
+    linkable = characters + vocab["categoryWords"]["topic"] + vocab["categoryWords"]["jobDesc"] + vocab["categoryWords"]["specialLifeguide"]
+    rng.shuffle(linkable)
+    linkableTable = CreateZipfTable(len(linkable), skew)
+
+    vocab["images"] = ["default0", "default1", "default2", "original", "bees"]
+    vocab["wordsToImages"] = [(BEES, "bees")]
+    imageWordsTable = CreateZipfTable(MAX_IMAGE_WORDS, skew)
+    for i in range(max(4, round(numWords * IMAGES_PER_WORD))):
+        imageName = "image-" + PseudoWord(i)
+        vocab["images"].append(imageName)
+        vocab["wordsToImages"].extend((linkable[pick], imageName) for pick in PickDistinct(linkableTable, WeightedPick(imageWordsTable, rng) + 1, rng))
+
+    # Each title template gets a made-up word of its own, so no two are the same (popular words would otherwise keep getting the same titles)
+    numTitles = max(5, round(numWords * TITLES_PER_WORD))
+    numUniversal = max(1, round(numTitles * UNIVERSAL_TITLE_SHARE))
+    vocab["titleTemplates"] = [(UNIVERSAL_TITLE_PATTERNS[i % len(UNIVERSAL_TITLE_PATTERNS)].format(PseudoWord(i).title()), None) for i in range(numUniversal)]
+    titleWordsTable = CreateZipfTable(MAX_TITLE_WORDS, skew)
+    for i in range(numUniversal, numTitles):
+        titleTemplate = TITLE_PATTERNS[i % len(TITLE_PATTERNS)].format(PseudoWord(i).title())
+        vocab["titleTemplates"].extend((titleTemplate, linkable[pick]) for pick in PickDistinct(linkableTable, WeightedPick(titleWordsTable, rng) + 1, rng))
+
+    return vocab
+
+
+
+def PseudoWord(index):
+    """Return a made-up word for a number: its digits in base len(SYLLABLES), as syllables. Different numbers always give different words."""
+    syllables = []
+    while True:
+        index, remainder = divmod(index, len(SYLLABLES))
+        syllables.append(SYLLABLES[remainder])
+        if index == 0:
+            return "".join(syllables)
+
+
+
+def ZipfWeights(n, skew):
+    """Return a list of n weights adding up to 1, where the weight at position k (counting from 1) is proportional to 1/k^skew."""
+    weights = [1 / (k ** skew) for k in range(1, n + 1)]
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+
+
+def CreateZipfTable(n, skew):
+    """Return an alias table for picking a position from 0 to n-1 with Zipf weights (see ZipfWeights)."""
+    return CreateAliasTableFromWeights(range(n), ZipfWeights(n, skew))
+
+
+
+def PickDistinct(aliasTable, count, rng):
+    """Return a list of up to count different IDs from an alias table, picked with its weights.
+
+    Gives up after a few repeats, so a count close to the size of the table can't take forever. The first pick is always kept.
+    """
+    picks = []
+    attempts = 0
+    while len(picks) < count and attempts < count * 4:
+        pick = aliasTable["ids"][WeightedPick(aliasTable, rng)]
+        if pick not in picks:
+            picks.append(pick)
+        attempts += 1
+
+    return picks
+
+
+
+def FormatWeight(weight):
+    """Return a weight as a string for the #probabilities section, keeping enough digits for tiny weights in big choice groups."""
+    return format(weight, ".6g")
+
+
+
+def CountWords(vocab):
+    """Return the number of words records the vocabulary will create, including hometowns and grammar."""
+    locations = set(hometown for character, pronouns, hometowns in vocab["characterSettings"] for hometown in hometowns)
+    verbs = set(verb for conjugations in VERBS.values() for verb in conjugations.values())
+    pronouns = set(pronoun for pronounSet in vocab["pronounSets"] for pronoun in pronounSet)
+    return sum(len(words) for words in vocab["categoryWords"].values()) + len(locations) + len(pronouns) + len(verbs)
+
+
+
+def WriteSourceData(vocab, outDir):
+    """Write a vocabulary from CreateSyntheticVocabulary as .txt files in the sourceData format, one file per kind of section."""
+    with open(os.path.join(outDir, "grammar.txt"), "w") as writer:
+        writer.write("#pronounSets\n")
+        writer.writelines(subj + "," + obj + "\n" for subj, obj in vocab["pronounSets"])
+        writer.write("#pronounGroupMembers\n")
+        writer.writelines("~" + group + "\n\tp=" + ",".join(pronouns) + "\n" for group, pronouns in vocab["pronounGroups"].items())
+        writer.write("#infinitives\n")
+        writer.writelines(infinitive + "\n" for infinitive in VERBS)
+        writer.write("#verbs\n")
+        for infinitive, conjugations in VERBS.items():
+            writer.write("~" + infinitive + "\n")
+            writer.writelines("\t" + group + "=" + verb + "\n" for group, verb in conjugations.items())
+
+    with open(os.path.join(outDir, "words.txt"), "w") as writer:
+        writer.write("#words\n")
+        for category, words in vocab["categoryWords"].items():
+            writer.write("~" + category + "\n")
+            writer.writelines(word + "\n" for word in words)
+
+    with open(os.path.join(outDir, "characters.txt"), "w") as writer:
+        writer.write("#characterSettings\n")
+        writer.writelines(character + "\n\tp=" + ",".join(pronouns) + "\th=" + ",".join(hometowns) + "\n"
+                          for character, pronouns, hometowns in vocab["characterSettings"])
+
+    with open(os.path.join(outDir, "probabilities.txt"), "w") as writer:
+        writer.write("#probabilities\n")
+        for groupName, records in vocab["choiceGroups"].items():
+            writer.write("~" + groupName + "\n")
+            writer.writelines("\t" + probability + "".join("\t" + flag + "=" + value for flag, value in flags.items()) + "\n"
+                              for probability, flags in records)
+
+    with open(os.path.join(outDir, "images.txt"), "w") as writer:
+        writer.write("#images\n")
+        writer.writelines(imageName + "," + imageName + ",png\n" for imageName in vocab["images"])
+        writer.write("#wordsToImages\n")
+        writer.writelines(display + "," + imageName + "\n" for display, imageName in vocab["wordsToImages"])
+
+    with open(os.path.join(outDir, "titles.txt"), "w") as writer:
+        writer.write("#titleTemplates\n")
+        writer.writelines(titleTemplate + "//" + (display if display != None else "") + "\n" for titleTemplate, display in vocab["titleTemplates"])
+
+
+
+def BuildDatabase(dbPath, srcDir):
+    """Create a new database with the latest schema and import every .txt file in srcDir into it, as import.py --dir --bulk --defer-indexes does."""
+    CreateDatabase(dbPath)
+
+    # import is a keyword, so import.py has to be loaded by name
+    importlib.import_module("import").ImportDirectory(dbPath, srcDir, True, True)
+
+
+
+if __name__ == "__main__":
+    main()
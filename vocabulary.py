@@ -0,0 +1,227 @@
+# Loads everything the Hallmark generator needs from hallmark.db (or a compiled vocabulary file) into an immutable in-memory model
+import os
+import threading
+import time
+from types import MappingProxyType
+from compiledVocabulary import LoadCompiledVocabulary
+from connectionPool import GetDatabasePath, PooledConnection
+
+
+# Declare some globals
+MAIN_CHAR_CATEGORIES = ("humanoid", "animal", "inanimate")
+
+# How often (in seconds) to check whether hallmark.db has changed since the vocabulary was loaded
+RELOAD_CHECK_INTERVAL = 5
+
+# A vocabulary file from compiledVocabulary.py to map into memory instead of loading hallmark.db. None = use hallmark.db
+_vocabularyFile = None
+
+_vocabulary = None
+_vocabularyLock = threading.Lock()
+_loadedVersion = None
+_nextCheck = 0
+
+
+
+def GetVocabulary():
+    """Return the vocabulary model, loading it from hallmark.db (or the vocabulary file, if one is configured) the first time it's requested.
+
+    Every RELOAD_CHECK_INTERVAL seconds, check whether hallmark.db or the file has been modified; if so, load a fresh model.
+    The model itself is never modified, so anything derived from it (e.g. alias tables) can be cached against it.
+    """
+    global _vocabulary, _loadedVersion, _nextCheck
+
+    # Most calls fall between checks, so the common case is a single comparison with no locking
+    if _vocabulary == None or time.monotonic() >= _nextCheck:
+        with _vocabularyLock:
+            if _vocabulary == None or time.monotonic() >= _nextCheck:
+                currentVersion = GetSourceVersion()
+                if _vocabulary == None or currentVersion != _loadedVersion:
+                    if _vocabularyFile != None:
+                        _vocabulary = LoadCompiledVocabulary(_vocabularyFile)
+                    else:
+                        with PooledConnection() as db:
+                            _vocabulary = LoadVocabulary(db)
+                    _loadedVersion = currentVersion
+                _nextCheck = time.monotonic() + RELOAD_CHECK_INTERVAL
+
+    return _vocabulary
+
+
+
+
+def GetVocabularyVersion():
+    """Return a string identifying the vocabulary model currently in use, which changes whenever a fresh model is loaded (e.g. for ETags)."""
+    GetVocabulary()
+    if _loadedVersion == None:
+        return "none"
+    return format(_loadedVersion[0], "x") + "-" + format(_loadedVersion[1], "x")
+
+
+
+
+def ConfigureVocabularyFile(path):
+    """Set the vocabulary file to load the vocabulary from, instead of hallmark.db. The next GetVocabulary loads from the new source.
+
+    Keyword arguments:
+    path -- a file written by compiledVocabulary.py, or None to go back to hallmark.db
+    """
+    global _vocabularyFile, _loadedVersion, _nextCheck
+    with _vocabularyLock:
+        _vocabularyFile = path
+        _loadedVersion = None
+        _nextCheck = 0
+
+
+
+
+def GetSourceVersion():
+    """Return a value which changes whenever the vocabulary's source (the vocabulary file if there is one, otherwise hallmark.db) is modified."""
+    try:
+        sourceStat = os.stat(GetDatabasePath() if _vocabularyFile == None else _vocabularyFile)
+        return (sourceStat.st_mtime_ns, sourceStat.st_size)
+    except OSError:
+        return None
+
+
+
+
+def LoadVocabulary(db):
+    """Read every table used by the generator and return a read-only dictionary describing the vocabulary.
+
+    Keyword arguments:
+    db -- a connection to the Hallmark database.
+
+    Keys in the returned dictionary:
+    words -- words ID => display text
+    wordIDs -- display text => words ID (the lowest ID, where the same display text appears more than once)
+    categoryWords -- category name => tuple of display text for every words record in that category
+    categoryIDWords -- categories ID => tuple of display text for every words record in that category
+    objectPronouns -- subject pronoun display text => object pronoun display text
+    verbs -- (infinitive, subject pronoun display text) => conjugated verb display text
+    characterPronouns -- character words ID => tuple of valid subject pronoun display text
+    characterHometowns -- character words ID => tuple of valid hometown display text
+    mainCharCandidates -- tuple of words IDs that can be picked when "any valid main character" is selected
+    probabilities -- probabilities ID => the results fields of that probabilities record
+    choiceGroups -- choice group name => tuple of probabilities records in that group
+    images -- image name => filename with extension
+    defaultImages -- tuple of filenames for the images named "default..."
+    wordImages -- words display text => tuple of filenames for the images linked to those words
+    titleTemplates -- tuple of (title template, linked words display text or None)
+    """
+    vocab = {}
+
+    # Words, by ID, by display text and by category
+    words = {}
+    wordIDs = {}
+    categoryWords = {}
+    categoryIDWords = {}
+    wordCategoryNames = {}
+    for row in db.execute("SELECT w.id, w.display, w.categories_id, c.name FROM words w JOIN categories c ON c.id = w.categories_id ORDER BY w.id"):
+        words[row["id"]] = row["display"]
+        wordCategoryNames[row["id"]] = row["name"]
+        wordIDs.setdefault(row["display"], row["id"])
+        categoryWords.setdefault(row["name"], []).append(row["display"])
+        categoryIDWords.setdefault(row["categories_id"], []).append(row["display"])
+
+    vocab["words"] = MappingProxyType(words)
+    vocab["wordIDs"] = MappingProxyType(wordIDs)
+    vocab["categoryWords"] = FreezeListDict(categoryWords)
+    vocab["categoryIDWords"] = FreezeListDict(categoryIDWords)
+
+    # Grammar: subject => object pronouns, then the full verb conjugation table
+    objectPronouns = {}
+    queryStr = "SELECT ws.display AS subj, wo.display AS obj FROM pronounSets ps"
+    queryStr += " JOIN words ws ON ws.id = ps.subjectPronoun_id"
+    queryStr += " JOIN words wo ON wo.id = ps.objectPronoun_id"
+    queryStr += " ORDER BY ps.id"
+    for row in db.execute(queryStr):
+        objectPronouns.setdefault(row["subj"], row["obj"])
+
+    vocab["objectPronouns"] = MappingProxyType(objectPronouns)
+
+    verbs = {}
+    queryStr = "SELECT i.name AS infinitive, wp.display AS pronoun, w.display FROM verbs v"
+    queryStr += " JOIN words w ON w.id = v.result_id"
+    queryStr += " JOIN infinitives i ON i.id = v.infinitives_id"
+    queryStr += " JOIN pronounGroupMembers pgm ON pgm.group_id = v.pronounGroups_id"
+    queryStr += " JOIN words wp ON wp.id = pgm.pronoun_id"
+    queryStr += " ORDER BY v.id"
+    for row in db.execute(queryStr):
+        verbs.setdefault((row["infinitive"], row["pronoun"]), row["display"])
+
+    vocab["verbs"] = MappingProxyType(verbs)
+
+    # Character settings
+    characterPronouns = {}
+    queryStr = "SELECT ctp.character_id, w.display FROM charactersToPronouns ctp"
+    queryStr += " JOIN words w ON w.id = ctp.subjectPronoun_id"
+    queryStr += " ORDER BY ctp.id"
+    for row in db.execute(queryStr):
+        characterPronouns.setdefault(row["character_id"], []).append(row["display"])
+
+    characterHometowns = {}
+    queryStr = "SELECT cth.character_id, w.display FROM charactersToHometowns cth"
+    queryStr += " JOIN words w ON w.id = cth.location_id"
+    queryStr += " ORDER BY cth.id"
+    for row in db.execute(queryStr):
+        characterHometowns.setdefault(row["character_id"], []).append(row["display"])
+
+    vocab["characterPronouns"] = FreezeListDict(characterPronouns)
+    vocab["characterHometowns"] = FreezeListDict(characterHometowns)
+
+    # A character can only be picked at random if it has a pronoun, a hometown and a suitable category
+    vocab["mainCharCandidates"] = tuple(wid for wid in sorted(characterPronouns)
+                                        if wid in characterHometowns and wordCategoryNames.get(wid) in MAIN_CHAR_CATEGORIES)
+
+    # Probabilities, by ID and by choice group
+    probabilities = {}
+    choiceGroups = {}
+    queryStr = "SELECT p.id, p.probability, p.words_id, p.categories_id, p.prefixStr, cg.name FROM probabilities p"
+    queryStr += " JOIN choiceGroups cg ON cg.id = p.choiceGroups_id"
+    queryStr += " ORDER BY p.id"
+    for row in db.execute(queryStr):
+        record = MappingProxyType({"id": row["id"], "probability": row["probability"], "words_id": row["words_id"],
+                                   "categories_id": row["categories_id"], "prefixStr": row["prefixStr"]})
+        probabilities[row["id"]] = record
+        choiceGroups.setdefault(row["name"], []).append(record)
+
+    vocab["probabilities"] = MappingProxyType(probabilities)
+    vocab["choiceGroups"] = FreezeListDict(choiceGroups)
+
+    # Images, including the defaults and the links to words
+    images = {}
+    defaultImages = []
+    for row in db.execute("SELECT i.name, i.filename, i.fextension FROM images i ORDER BY i.id"):
+        images[row["name"]] = row["filename"] + "." + row["fextension"]
+        if row["name"].startswith("default"):
+            defaultImages.append(images[row["name"]])
+
+    vocab["images"] = MappingProxyType(images)
+    vocab["defaultImages"] = tuple(defaultImages)
+
+    wordImages = {}
+    queryStr = "SELECT w.display, i.filename, i.fextension FROM images i"
+    queryStr += " JOIN wordsToImages wti ON i.id = wti.images_id"
+    queryStr += " JOIN words w ON w.id = wti.words_id"
+    queryStr += " ORDER BY wti.id"
+    for row in db.execute(queryStr):
+        wordImages.setdefault(row["display"], []).append(row["filename"] + "." + row["fextension"])
+
+    vocab["wordImages"] = FreezeListDict(wordImages)
+
+    # Title templates, with the display text of the words that activate them (None means "suitable for anything")
+    queryStr = "SELECT t.titleTemplate, w.display FROM titleTemplates t"
+    queryStr += " LEFT JOIN wordsToTitles wtc ON wtc.titleTemplates_id = t.id"
+    queryStr += " LEFT JOIN words w ON wtc.words_id = w.id"
+    queryStr += " ORDER BY t.id, wtc.id"
+    vocab["titleTemplates"] = tuple((row["titleTemplate"], row["display"]) for row in db.execute(queryStr))
+
+    return MappingProxyType(vocab)
+
+
+
+
+def FreezeListDict(listDict):
+    """Return a read-only copy of a dictionary of lists, with each list converted to a tuple."""
+    return MappingProxyType({key: tuple(value) for key, value in listDict.items()})